@@ -0,0 +1 @@
+"""Performance benchmarks of the parsers, datastore, and download path. Run with `nox -s benchmark`."""
@@ -0,0 +1,61 @@
+"""Run the benchmarks, writing results as JSON and optionally comparing to a baseline."""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks import bench_datastore  # noqa: F401
+from benchmarks import bench_download  # noqa: F401
+from benchmarks import bench_parsers  # noqa: F401
+from benchmarks.harness import BENCHMARKS
+from benchmarks.harness import compare
+from benchmarks.harness import format_result
+from benchmarks.harness import run
+from benchmarks.harness import write_results
+
+RESULTS_PATH = Path(".benchmarks")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("filter", nargs="*", help="Only run benchmarks whose name contains one")
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Run only the first parameter of each benchmark for a few rounds",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help=f"File to write JSON results to (default: {RESULTS_PATH}/<timestamp>.json)",
+    )
+    parser.add_argument("--compare", type=Path, help="Earlier JSON results to compare with")
+    args = parser.parse_args(argv)
+
+    # Progress logs of the code under test would dominate the output
+    logging.disable(logging.INFO)
+
+    selected = [
+        bench
+        for bench in BENCHMARKS
+        if not args.filter or any(name in f"{bench.group}.{bench.name}" for name in args.filter)
+    ]
+    results = run(selected, quick=args.quick, report=lambda result: print(format_result(result)))
+
+    output = args.output or RESULTS_PATH / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    write_results(results, output)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        print(f"Compared to {args.compare}:")
+        for line in compare(results, args.compare):
+            print(f"  {line}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,99 @@
+"""Benchmarks of the datastore at 10k, 100k, and 1M rows."""
+
+from __future__ import annotations
+
+import functools
+import itertools
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+
+from benchmarks import synthetic
+from benchmarks.harness import benchmark
+from fafav_downloader.datastore import Datastore
+
+SIZES = (10_000, 100_000, 1_000_000)
+
+
+@functools.lru_cache(maxsize=None)
+def _datastore(rows: int) -> Datastore:
+    """Build, once per size, a populated datastore shared by the benchmarks of that size."""
+    return synthetic.populated_datastore(rows)
+
+
+@benchmark("datastore", params=SIZES)
+def save_views(rows: int) -> Callable[[], object]:
+    datastore = _datastore(rows)
+    batches = itertools.count()
+
+    def save() -> None:
+        batch = next(batches)
+        views = [(f"/view/new{batch}-{idx}/", "title", "author") for idx in range(72)]
+        datastore.save_views(views, synthetic.USERNAME)
+
+    return save
+
+
+@benchmark("datastore", params=SIZES)
+def filter_new_views(rows: int) -> Callable[[], object]:
+    datastore = _datastore(rows)
+    views = [(f"/view/{idx}/", "title", "author") for idx in range(0, rows, rows // 72)]
+    return lambda: datastore.filter_new_views(views)
+
+
+@benchmark("datastore", params=SIZES, rounds=5)
+def iter_views_to_download(rows: int) -> Callable[[], object]:
+    datastore = _datastore(rows)
+    return lambda: sum(1 for _ in datastore.iter_views_to_download())
+
+
+@benchmark("datastore", params=SIZES)
+def count_downloads_to_process(rows: int) -> Callable[[], object]:
+    datastore = _datastore(rows)
+    return datastore.count_downloads_to_process
+
+
+@benchmark("datastore", params=SIZES)
+def get_filename_by_hash(rows: int) -> Callable[[], object]:
+    datastore = _datastore(rows)
+    return lambda: datastore.get_filename_by_hash(f"{rows - 1:064x}")
+
+
+@benchmark("datastore", params=SIZES, rounds=10)
+def write_behind_downloads(rows: int) -> Callable[[], object]:
+    datastore = _datastore(rows)
+    views = [f"/view/{idx}/" for idx in range(0, rows, 4)][:1_000]
+
+    def save() -> None:
+        datastore._batch_size = 200
+        try:
+            for view in views:
+                datastore.save_download(view, None)
+            datastore.flush()
+        finally:
+            datastore._batch_size = 1
+
+    return save
+
+
+@benchmark("datastore", params=SIZES, rounds=3)
+def export_full(rows: int) -> Callable[[], object]:
+    datastore = _datastore(rows)
+    path = Path(tempfile.mkdtemp()) / "export.csv"
+    return lambda: datastore.export(str(path))
+
+
+@benchmark("datastore", params=SIZES)
+def export_incremental(rows: int) -> Callable[[], object]:
+    datastore = _datastore(rows)
+    path = Path(tempfile.mkdtemp()) / "export.csv"
+    datastore.export(str(path), incremental=True)
+    changes = itertools.count()
+
+    def export() -> None:
+        change = next(changes)
+        for idx in range(5):
+            datastore.save_download(f"/view/{idx * 4}/", f"https://d.furaffinity.net/{change}")
+        datastore.export(str(path), incremental=True)
+
+    return export
@@ -0,0 +1,73 @@
+"""End-to-end benchmarks of resolving and downloading against a mocked site."""
+
+from __future__ import annotations
+
+import asyncio
+import shutil
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+
+import httpx
+
+from benchmarks import synthetic
+from benchmarks.harness import benchmark
+from fafav_downloader import asyncdownloader
+from fafav_downloader import fadownloader
+from fafav_downloader.datastore import Datastore
+
+FILE_SIZE = 256 * 1024
+FAVORITES = 100
+
+
+def _site(file_size: int) -> httpx.MockTransport:
+    """Mock the site and CDN, serving view pages and PNG files of file_size bytes."""
+    view_page = synthetic.view_page()
+    content = b"\x89PNG\r\n\x1a\n" + b"\x00" * (file_size - 8)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.startswith("/view/"):
+            return httpx.Response(200, text=view_page)
+        return httpx.Response(200, content=content)
+
+    return httpx.MockTransport(handler)
+
+
+def _fresh_run(directory: Path) -> Datastore:
+    """Empty the download directory and return a datastore of unresolved favorites."""
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir()
+    datastore = Datastore()
+    datastore.save_views([(f"/view/{idx}/", f"title{idx}", "author") for idx in range(FAVORITES)])
+    return datastore
+
+
+@benchmark("download", params=(FILE_SIZE,), rounds=5)
+def sync_resolve_and_download(file_size: int) -> Callable[[], object]:
+    directory = Path(tempfile.mkdtemp()) / "downloads"
+    fadownloader.DOWNLOAD_PATH = directory
+    http_client = httpx.Client(transport=_site(file_size))
+
+    def run() -> None:
+        datastore = _fresh_run(directory)
+        fadownloader.save_download_links(http_client, datastore)
+        fadownloader.download_favorite_files(http_client, datastore)
+
+    return run
+
+
+@benchmark("download", params=(FILE_SIZE,), rounds=5)
+def async_resolve_and_download(file_size: int) -> Callable[[], object]:
+    directory = Path(tempfile.mkdtemp()) / "downloads"
+    fadownloader.DOWNLOAD_PATH = directory
+    transport = _site(file_size)
+
+    async def stages(datastore: Datastore) -> None:
+        async with httpx.AsyncClient(transport=transport) as http_client:
+            await asyncdownloader.save_download_links(http_client, datastore)
+            await asyncdownloader.download_favorite_files(http_client, datastore)
+
+    def run() -> None:
+        asyncio.run(stages(_fresh_run(directory)))
+
+    return run
@@ -0,0 +1,56 @@
+"""Benchmarks of page parsing and filename sanitizing."""
+
+from __future__ import annotations
+
+from collections.abc import Callable
+
+from benchmarks import synthetic
+from benchmarks.harness import benchmark
+from fafav_downloader import fadownloader
+from fafav_downloader.extractor import extract_page
+
+PATHOLOGICAL = tuple(synthetic.pathological_pages())
+
+
+@benchmark("parsers", params=(72, 500))
+def get_favorite_data(favorites: int) -> Callable[[], object]:
+    page = synthetic.favorites_page(favorites)
+    return lambda: fadownloader.get_favorite_data(page)
+
+
+@benchmark("parsers", params=(0, 5_000))
+def get_download_url(description_lines: int) -> Callable[[], object]:
+    page = synthetic.view_page(description_lines)
+    return lambda: fadownloader.get_download_url(page)
+
+
+@benchmark("parsers")
+def get_download_url_missing(_: None) -> Callable[[], object]:
+    page = synthetic.view_page(download=False)
+    return lambda: fadownloader.get_download_url(page)
+
+
+@benchmark("parsers", params=(72,))
+def extract_page_single_pass(favorites: int) -> Callable[[], object]:
+    page = synthetic.favorites_page(favorites)
+    return lambda: extract_page(page, synthetic.USERNAME)
+
+
+@benchmark("parsers", params=PATHOLOGICAL, rounds=5)
+def extract_page_pathological(name: str) -> Callable[[], object]:
+    page = synthetic.pathological_pages()[name]
+    return lambda: extract_page(page, synthetic.USERNAME)
+
+
+@benchmark("parsers")
+def sanitize_filename(_: None) -> Callable[[], object]:
+    names = [
+        f"Some   Author_-_A {idx} very (long) title: with ~ unicode éè & symbols!!.png"
+        for idx in range(1_000)
+    ]
+
+    def sanitize() -> None:
+        for name in names:
+            fadownloader._sanitize_filename(name)
+
+    return sanitize
@@ -0,0 +1,174 @@
+"""
+Minimal benchmark registry, timer, and result comparison.
+
+A benchmark is a setup function registered with `@benchmark`, returning the
+callable to time. Setup runs once per parameter, outside the timing. Each
+callable is run for a number of rounds after a warmup, and the timings are
+reported as JSON so runs on different revisions can be compared.
+"""
+
+from __future__ import annotations
+
+import json
+import platform
+import statistics
+import subprocess
+import time
+from collections.abc import Callable
+from collections.abc import Iterable
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+from typing import Any
+from typing import NamedTuple
+
+Setup = Callable[[Any], Callable[[], object]]
+
+
+class Benchmark(NamedTuple):
+    """A registered benchmark and the parameters it is run with."""
+
+    group: str
+    name: str
+    setup: Setup
+    params: tuple[Any, ...]
+    rounds: int
+
+
+class Result(NamedTuple):
+    """Timings of one benchmark with one parameter, in seconds."""
+
+    group: str
+    name: str
+    param: Any
+    rounds: int
+    minimum: float
+    median: float
+    mean: float
+    stdev: float
+
+    @property
+    def key(self) -> str:
+        """Identify the benchmark and parameter across runs."""
+        return f"{self.group}.{self.name}[{self.param}]"
+
+
+BENCHMARKS: list[Benchmark] = []
+
+
+def benchmark(
+    group: str,
+    *,
+    params: Iterable[Any] = (None,),
+    rounds: int = 20,
+) -> Callable[[Setup], Setup]:
+    """Register a setup function returning the callable to time, once per parameter."""
+
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS.append(Benchmark(group, setup.__name__, setup, tuple(params), rounds))
+        return setup
+
+    return register
+
+
+def run(
+    benchmarks: Iterable[Benchmark],
+    *,
+    quick: bool = False,
+    report: Callable[[Result], None] = lambda result: None,
+) -> list[Result]:
+    """Time every benchmark, only with its first parameter and a few rounds when quick."""
+    results = []
+    for bench in benchmarks:
+        params = bench.params[:1] if quick else bench.params
+        rounds = min(bench.rounds, 3) if quick else bench.rounds
+        for param in params:
+            result = _time(bench, param, rounds)
+            report(result)
+            results.append(result)
+    return results
+
+
+def _time(bench: Benchmark, param: Any, rounds: int) -> Result:
+    """Run setup once, warm up, then time the benchmark for the given rounds."""
+    func = bench.setup(param)
+    func()
+
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    return Result(
+        group=bench.group,
+        name=bench.name,
+        param=param,
+        rounds=rounds,
+        minimum=min(timings),
+        median=statistics.median(timings),
+        mean=statistics.fmean(timings),
+        stdev=statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    )
+
+
+def write_results(results: list[Result], path: Path) -> None:
+    """Write results with details of the machine and revision as JSON."""
+    document = {
+        "created": datetime.now(tz=timezone.utc).isoformat(),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [{"key": result.key, **result._asdict()} for result in results],
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(document, indent=2, default=str), encoding="utf-8")
+
+
+def compare(results: list[Result], baseline_path: Path) -> list[str]:
+    """Return a line per benchmark comparing its median to the one in a baseline file."""
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    medians = {entry["key"]: entry["median"] for entry in baseline["results"]}
+
+    lines = []
+    for result in results:
+        before = medians.get(result.key)
+        if before is None:
+            lines.append(f"{result.key}: {_format(result.median)} (new)")
+            continue
+        change = (result.median - before) / before * 100 if before else 0.0
+        lines.append(
+            f"{result.key}: {_format(before)} -> {_format(result.median)} ({change:+.1f}%)"
+        )
+    return lines
+
+
+def format_result(result: Result) -> str:
+    """Format a result for the console."""
+    return (
+        f"{result.key}: median {_format(result.median)}, min {_format(result.minimum)}, "
+        f"stdev {_format(result.stdev)} over {result.rounds} rounds"
+    )
+
+
+def _format(seconds: float) -> str:
+    """Format seconds with a readable unit."""
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.1f}us"
+
+
+def _git_revision() -> str | None:
+    """Return the current git revision, if run from a checkout."""
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
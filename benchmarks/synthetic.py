@@ -0,0 +1,120 @@
+"""
+Synthetic pages and datastores of realistic size for the benchmarks.
+
+Pages are built from the markup of the test fixtures, so the parsers see the
+same structure as on the live site, with the number of favorites, the size
+of descriptions, and the pathological parts scaled up.
+"""
+
+from __future__ import annotations
+
+import re
+import sqlite3
+from collections.abc import Iterator
+from pathlib import Path
+
+from fafav_downloader.datastore import Datastore
+
+FIXTURES = Path(__file__).parent.parent / "tests" / "fixtures"
+USERNAME = "wolf-nymph"
+
+_FAVORITES_PAGE = (FIXTURES / "fav_page.html").read_text(encoding="utf-8")
+_VIEW_PAGE = (FIXTURES / "view_page.html").read_text(encoding="utf-8")
+
+_GALLERY_START = '<section id="gallery-favorites" class="gallery s-250 ">'
+_GALLERY_END = "</section>"
+_FIGURE = re.compile(r"<figure .*?</figure>", re.DOTALL)
+_DOWNLOAD = re.compile(r'<div class="download">.*?</div>')
+_DESCRIPTION_LINE = (
+    'Commissioned by <a href="/user/someone/" class="linkusername">someone</a>, '
+    "thank you so much! <br />\n"
+)
+
+
+def _split_gallery() -> tuple[str, str, str, str]:
+    """
+    Split the favorites fixture into the markup before, a single figure, and after.
+
+    Also returns the view id of the figure, to be replaced when repeating it.
+    """
+    start = _FAVORITES_PAGE.index(_GALLERY_START) + len(_GALLERY_START)
+    end = _FAVORITES_PAGE.index(_GALLERY_END, start)
+    figure = _FIGURE.search(_FAVORITES_PAGE, start, end)
+    view = re.search(r"/view/(\d+)/", figure.group()) if figure else None
+    if figure is None or view is None:
+        raise ValueError("Favorites fixture has no figure to repeat")
+    return _FAVORITES_PAGE[:start], figure.group(), _FAVORITES_PAGE[end:], view.group(1)
+
+
+_HEAD, _FIGURE_TEMPLATE, _TAIL, _TEMPLATE_VIEW = _split_gallery()
+
+
+def favorites_page(favorites: int = 72, *, offset: int = 0) -> str:
+    """Return a favorites page listing `favorites` distinct submissions."""
+    figures = [
+        _FIGURE_TEMPLATE.replace(_TEMPLATE_VIEW, str(10_000_000 + offset + idx))
+        for idx in range(favorites)
+    ]
+    return _HEAD + "\n".join(figures) + _TAIL
+
+
+def view_page(description_lines: int = 0, *, download: bool = True) -> str:
+    """Return a view page with a description padded by extra lines of markup."""
+    page = _VIEW_PAGE
+    if not download:
+        page = _DOWNLOAD.sub("", page)
+    body_end = page.rindex("</body>")
+    return page[:body_end] + _DESCRIPTION_LINE * description_lines + page[body_end:]
+
+
+def pathological_pages() -> dict[str, str]:
+    """Return pages built to make the parsers backtrack or scan without matches."""
+    near_miss = (
+        "<figcaption>\n<p>\n"
+        '            <a href="/view/1/" title="unterminated title' + "x" * 200 + "\n"
+    )
+    return {
+        "no_newlines": favorites_page(72).replace("\n", " "),
+        "near_miss_figcaptions": _HEAD + near_miss * 5_000 + _TAIL,
+        "angle_brackets": "<" * 1_000_000,
+        "huge_favorites": favorites_page(1_000),
+    }
+
+
+def populated_datastore(rows: int, *, path: str = ":memory:") -> Datastore:
+    """
+    Return a datastore holding `rows` favorites in every state of the work queue.
+
+    A quarter of the rows are unresolved, a quarter have a download link to
+    process, and the rest are downloaded with a filename and hash.
+    """
+    datastore = Datastore(path)
+    dbconn: sqlite3.Connection = datastore._dbconn
+
+    def generate() -> Iterator[tuple[str | None, ...]]:
+        for idx in range(rows):
+            view = f"/view/{idx}/"
+            state = idx % 4
+            download = None if state == 0 else f"https://d.furaffinity.net/art/a/{idx}.png"
+            filename = f"author{idx % 1000}-title{idx}.png" if state >= 2 else None
+            sha256 = f"{idx:064x}" if state >= 2 else None
+            yield (
+                view,
+                f"title{idx}",
+                f"author{idx % 1000}",
+                "2024-05-17 10:11:12.131415+00:00",
+                download,
+                "2024-05-18 10:11:12.131415+00:00" if download else None,
+                filename,
+                sha256,
+                "png" if filename else None,
+                ("discovered", "resolved", "downloaded", "downloaded")[state],
+            )
+
+    dbconn.executemany(
+        "INSERT INTO downloads (view, title, author, view_date, download, download_date, "
+        "filename, sha256, filetype, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        generate(),
+    )
+    dbconn.commit()
+    return datastore
@@ -26,6 +26,7 @@ CLEANABLE_TARGETS = [
     "./.coverage.*",
     "./coverage.json",
     "./htmlcov",
+    "./.benchmarks",
     "./**/.mypy_cache",
     "./**/.pytest_cache",
     "./**/__pycache__",
@@ -91,6 +92,14 @@ def run_tests_with_coverage(session: nox.Session) -> None:
         coverage("html")
 
 
+@nox.session(name="benchmark", python=PYTHON_VERSION)
+def run_benchmarks(session: nox.Session) -> None:
+    """Run the benchmarks, writing JSON results to .benchmarks. Extra arguments passed to the runner."""
+    session.run_install("uv", "sync", *UV_ARGS)
+
+    session.run("uv", "run", *UV_ARGS, "python", "-m", "benchmarks", *session.posargs)
+
+
 @nox.session(name="combine", python=PYTHON_VERSION)
 def combine_coverage(session: nox.Session) -> None:
     """Combine parallel-mode coverage files and produce reports."""
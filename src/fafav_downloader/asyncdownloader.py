@@ -0,0 +1,283 @@
+"""
+Concurrent asyncio variants of the download stages.
+
+Opt-in alternative to the blocking loops in fadownloader. Work is handed to
+a bounded pool of workers while requests in flight to the site and to the
+file CDN are limited separately, so the CDN downloads are bound by
+bandwidth instead of by item count.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Iterable
+from typing import Any
+from typing import TypeVar
+
+import httpx
+
+from . import fadownloader
+from .datastore import Datastore
+from .fadownloader import BASE_URL
+from .fadownloader import CDN_CONCURRENCY
+from .fadownloader import CHUNK_SIZE
+from .fadownloader import DUPLICATE_MODE
+from .fadownloader import INCOMPLETE_ERROR
+from .fadownloader import SITE_CONCURRENCY
+from .fadownloader import SITE_HOST
+from .fadownloader import WORKER_COUNT
+from .fadownloader import _describe_error
+from .fadownloader import _store_download
+from .fadownloader import get_download_url
+from .filenames import FilenameIndex
+from .layout import DEFAULT_LAYOUT
+from .metrics import METRICS
+from .metrics import Progress
+from .pagecache import PageCache
+from .ratelimit import AdaptiveRateLimiter
+from .ratelimit import BandwidthLimiter
+from .resume import RANGE_ATTEMPTS
+from .resume import LeaseLostError
+from .resume import PartialDownload
+from .transport import CDN_POOL
+from .transport import HTTP2_AVAILABLE
+from .transport import SITE_POOL
+from .transport import PoolConfig
+from .transport import build_async_client
+
+_T = TypeVar("_T")
+
+log = logging.getLogger()
+
+
+class HostLimits:
+    """Separate concurrency limits for site page fetches and file CDN downloads."""
+
+    def __init__(
+        self,
+        site_concurrency: int = SITE_CONCURRENCY,
+        cdn_concurrency: int = CDN_CONCURRENCY,
+    ) -> None:
+        """Provide the number of requests allowed in flight per host group."""
+        self.site = asyncio.Semaphore(site_concurrency)
+        self.cdn = asyncio.Semaphore(cdn_concurrency)
+
+    def for_url(self, url: str) -> asyncio.Semaphore:
+        """Return the semaphore guarding requests to the host of the given URL."""
+        return self.site if httpx.URL(url).host == SITE_HOST else self.cdn
+
+
+async def get_page(url: str, http_client: httpx.AsyncClient, limits: HostLimits) -> str:
+    """Get a page from the given URL."""
+    async with limits.for_url(url):
+        results = await http_client.get(url)
+
+    if not results.is_success:
+        log.error("Request failed: status %s (%s)", results.status_code, results.text)
+    return results.text if results.is_success else ""
+
+
+async def save_download_links(
+    http_client: httpx.AsyncClient,
+    datastore: Datastore,
+    *,
+    workers: int = WORKER_COUNT,
+    limits: HostLimits | None = None,
+) -> None:
+    """Save all download links for given view links to datastore."""
+    limits = limits or HostLimits()
+    progress = Progress("resolve", datastore.count_views_to_download())
+
+    async def resolve(idx: int, view: str) -> None:
+        log.info("%s Fetching download link of %s", progress.advance(), view)
+        await resolve_download_link(view, http_client, datastore, limits)
+
+    view_links = datastore.iter_views_to_download()
+    await _run_workers(enumerate(view_links, start=1), resolve, workers)
+
+
+async def download_favorite_files(
+    http_client: httpx.AsyncClient,
+    datastore: Datastore,
+    *,
+    workers: int = WORKER_COUNT,
+    limits: HostLimits | None = None,
+    chunk_size: int = CHUNK_SIZE,
+    duplicates: str = DUPLICATE_MODE,
+    layout: str = DEFAULT_LAYOUT,
+) -> None:
+    """Download all favorite files and update datastore with filenames."""
+    fadownloader.DOWNLOAD_PATH.mkdir(parents=True, exist_ok=True)
+    limits = limits or HostLimits()
+    names = FilenameIndex.from_datastore(datastore, fadownloader.DOWNLOAD_PATH)
+    progress = Progress("download", datastore.count_downloads_to_process())
+
+    async def download(idx: int, row: tuple[str, str, str, str]) -> None:
+        log.info("%s Downloading %s", progress.advance(), row[3])
+        await download_file(
+            row,
+            http_client,
+            datastore,
+            limits,
+            names,
+            chunk_size=chunk_size,
+            duplicates=duplicates,
+            layout=layout,
+        )
+
+    to_download = datastore.iter_downloads_to_process()
+    await _run_workers(enumerate(to_download, start=1), download, workers)
+
+
+async def resolve_download_link(
+    view: str,
+    http_client: httpx.AsyncClient,
+    datastore: Datastore,
+    limits: HostLimits,
+) -> str | None:
+    """
+    Fetch the view page, save its download link to datastore, and return it.
+
+    Nothing is saved when the page couldn't be fetched.
+    """
+    page = await get_page(f"{BASE_URL}{view}", http_client, limits)
+    if not page:
+        return None
+
+    download_link = get_download_url(page)
+    datastore.save_download(view, download_link)
+    return download_link
+
+
+async def download_file(
+    row: tuple[str, str, str, str],
+    http_client: httpx.AsyncClient,
+    datastore: Datastore,
+    limits: HostLimits,
+    names: FilenameIndex,
+    *,
+    chunk_size: int = CHUNK_SIZE,
+    duplicates: str = DUPLICATE_MODE,
+    layout: str = DEFAULT_LAYOUT,
+) -> bool:
+    """
+    Stream a single view, title, author, download link row to disk. Returns success.
+
+    An earlier attempt at the same row is resumed where possible.
+    """
+    view, _, _, download_link = row
+
+    async with limits.for_url(download_link):
+        try:
+            with PartialDownload(fadownloader.DOWNLOAD_PATH, datastore, view) as partial:
+                for _ in range(RANGE_ATTEMPTS):
+                    async with http_client.stream(
+                        "GET", download_link, headers=partial.headers()
+                    ) as response:
+                        if partial.needs_full_request(response):
+                            continue
+
+                        if not response.is_success:
+                            log.error(
+                                "Download of %s failed: %s", download_link, response.status_code
+                            )
+                            datastore.save_failure(
+                                view, response.reason_phrase, response.status_code
+                            )
+                            return False
+
+                        partial.start(response)
+                        async for chunk in response.aiter_bytes(chunk_size):
+                            partial.write(chunk)
+
+                        if not partial.complete():
+                            datastore.save_failure(view, INCOMPLETE_ERROR)
+                            return False
+
+                        _store_download(partial.sink, datastore, row, names, duplicates, layout)
+                        return True
+
+        except httpx.HTTPError as err:
+            datastore.save_failure(view, _describe_error(err))
+            raise
+
+        except LeaseLostError as err:
+            log.warning("Leaving download of %s: %s", download_link, err)
+
+    return False
+
+
+def run_stage(
+    stage: Callable[..., Awaitable[None]],
+    headers: dict[str, str],
+    datastore: Datastore,
+    *,
+    site_concurrency: int = SITE_CONCURRENCY,
+    cdn_concurrency: int = CDN_CONCURRENCY,
+    limiter: AdaptiveRateLimiter | None = None,
+    site_pool: PoolConfig = SITE_POOL,
+    cdn_pool: PoolConfig = CDN_POOL,
+    http2: bool = HTTP2_AVAILABLE,
+    cache: PageCache | None = None,
+    bandwidth: BandwidthLimiter | None = None,
+    **stage_kwargs: Any,
+) -> None:
+    """Run an async stage to completion from synchronous code."""
+    http_client = build_async_client(
+        headers,
+        limiter or AdaptiveRateLimiter(),
+        pools={SITE_HOST: site_pool},
+        default_pool=cdn_pool,
+        http2=http2,
+        cache=cache,
+        bandwidth=bandwidth,
+    )
+
+    async def _run() -> None:
+        limits = HostLimits(site_concurrency, cdn_concurrency)
+        async with http_client:
+            await stage(http_client, datastore, limits=limits, **stage_kwargs)
+
+    asyncio.run(_run())
+
+
+async def _run_workers(
+    items: Iterable[tuple[int, _T]],
+    handler: Callable[[int, _T], Awaitable[None]],
+    workers: int,
+) -> None:
+    """Feed items through a bounded queue to a fixed pool of worker tasks."""
+    queue: asyncio.Queue[tuple[int, _T]] = asyncio.Queue(maxsize=workers * 2)
+    tasks = [asyncio.create_task(consume(queue, handler)) for _ in range(max(1, workers))]
+
+    for entry in items:
+        await queue.put(entry)
+
+    await queue.join()
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def consume(
+    queue: asyncio.Queue[tuple[int, _T]],
+    handler: Callable[[int, _T], Awaitable[Any]],
+) -> None:
+    """Worker loop handling queued items until cancelled."""
+    while "there is work to be done":
+        idx, item = await queue.get()
+        try:
+            await handler(idx, item)
+        except (httpx.HTTPError, OSError) as err:
+            METRICS.inc("stage_errors_total")
+            log.error("Failed to process %s: %s", item, err)
+        except Exception:
+            # A worker that died would leave the producer blocked on the full queue
+            METRICS.inc("stage_errors_total")
+            log.exception("Unexpected error processing %s", item)
+        finally:
+            queue.task_done()
@@ -3,16 +3,73 @@
 from __future__ import annotations
 
 import csv
+import json
+import logging
+import os
+import socket
 import sqlite3
+import time
+from collections.abc import Callable
 from collections.abc import Generator
+from collections.abc import Iterator
 from contextlib import contextmanager
 from datetime import datetime
 from datetime import timezone
+from pathlib import Path
+from types import TracebackType
 from typing import TYPE_CHECKING
+from typing import Any
+from typing import TextIO
+
+from .metrics import METRICS
 
 if TYPE_CHECKING:
     from sqlite3 import Cursor
 
+# A queued update, with the warning to log if it matches no row
+_Update = tuple[str, tuple[Any, ...], str | None]
+
+# Write-behind defaults used by the command line. A batch size of one
+# commits every update as it is made.
+WRITE_BATCH_SIZE = 200
+WRITE_FLUSH_MS = 1000
+
+# Rows fetched per query by the work queue iterators
+ITER_BATCH_SIZE = 500
+
+# Rows fetched per round trip when exporting, and pages copied per backup step
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = ("csv", "jsonl")
+BACKUP_PAGES = 1024
+
+# Failed downloads are retried after a backoff doubling from the base per
+# attempt, up to the cap. Responses in PERMANENT_STATUSES are never retried.
+RETRY_BASE_SECONDS = 15 * 60
+RETRY_MAX_SECONDS = 7 * 24 * 60 * 60
+PERMANENT_STATUSES = (404, 410)
+
+# Condition of downloads the work queue hands out, taking the current time
+RETRY_READY_SQL = "COALESCE(next_retry_at, 0) <= ?"
+
+# Rows of the work queue are claimed by one worker process at a time, for
+# a lease renewed while the worker runs. Rows of a worker that stops without
+# releasing them are claimable again once the lease has expired. Seconds to
+# wait for the write lock held by another process before giving up.
+LEASE_SECONDS = 15 * 60
+BUSY_TIMEOUT = 30.0
+
+# Condition of rows a worker may claim, taking its id and the current time
+CLAIMABLE_SQL = "(claimed_by IS NULL OR claimed_by = ? OR lease_expires <= ?)"
+
+# Status of a row: its view was discovered by a scan, then resolved to a
+# download link or found unavailable, then downloaded or failed for good.
+STATUSES = ("discovered", "resolved", "unavailable", "downloaded", "failed")
+
+PRAGMA_SQL = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+"""
+
 TABLE_SQL = """
     CREATE TABLE IF NOT EXISTS downloads (
         view TEXT NOT NULL,
@@ -24,30 +81,248 @@ TABLE_SQL = """
         filename TEXT
     );
     CREATE UNIQUE INDEX IF NOT EXISTS viewkey on downloads(view);
+    CREATE INDEX IF NOT EXISTS filenamekey on downloads(filename)
+        WHERE filename IS NOT NULL;
+    CREATE TABLE IF NOT EXISTS favorites (
+        username TEXT NOT NULL,
+        view TEXT NOT NULL,
+        PRIMARY KEY (username, view)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS verified (
+        filename TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        sha256 TEXT
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID;
 """
 
+# Columns added after the original table. Missing columns are added to the
+# table when a database is opened, then ADDED_INDEX_SQL is run.
+ADDED_COLUMNS = {
+    "sha256": "TEXT",
+    "filetype": "TEXT",
+    "change_seq": "INTEGER",
+    "part_offset": "INTEGER",
+    "part_length": "INTEGER",
+    "part_validator": "TEXT",
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "last_status": "INTEGER",
+    "last_error": "TEXT",
+    "next_retry_at": "REAL",
+    "status": "TEXT NOT NULL DEFAULT 'discovered'",
+    "size": "INTEGER",
+    "claimed_by": "TEXT",
+    "lease_expires": "REAL",
+}
+
+# Columns whose updates count as changes of a row. Claiming a row isn't one.
+TRACKED_COLUMNS = [
+    column
+    for column in ("view", "title", "author", "view_date", "download", "download_date", "filename")
+    + tuple(ADDED_COLUMNS)
+    if column not in ("change_seq", "claimed_by", "lease_expires")
+]
+
+# Status of rows saved before it was recorded, inferred from their columns.
+# Views resolved to no download link can't be told from unresolved ones.
+STATUS_MIGRATION_SQL = f"""
+    UPDATE downloads SET status = CASE
+        WHEN filename IS NOT NULL THEN 'downloaded'
+        WHEN last_status IN ({", ".join(map(str, PERMANENT_STATUSES))}) THEN 'failed'
+        WHEN download IS NOT NULL THEN 'resolved'
+        ELSE 'discovered'
+    END
+"""
+
+ADDED_INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS sha256key on downloads(sha256)
+        WHERE sha256 IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS unknown_filetype on downloads(filename)
+        WHERE filename IS NOT NULL AND filetype IS NULL;
+    CREATE INDEX IF NOT EXISTS changes on downloads(change_seq);
+    CREATE INDEX IF NOT EXISTS work_queue on downloads(status, view, next_retry_at);
+    -- Replaced by the work_queue index
+    DROP INDEX IF EXISTS to_resolve;
+    DROP INDEX IF EXISTS to_download;
+"""
+
+# Every inserted or updated row takes the next change sequence number, which
+# incremental exports use as their watermark. The trigger's own update sets
+# change_seq, so the WHEN clause keeps it from counting as another change.
+# The update trigger is recreated on open when it doesn't follow TRACKED_COLUMNS.
+TRACKED_UPDATE_SQL = f"UPDATE OF {', '.join(TRACKED_COLUMNS)} ON downloads"
+CHANGE_TRACKING_SQL = f"""
+    CREATE TRIGGER IF NOT EXISTS track_insert AFTER INSERT ON downloads
+    BEGIN
+        UPDATE downloads
+        SET change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM downloads)
+        WHERE rowid = NEW.rowid;
+    END;
+    CREATE TRIGGER IF NOT EXISTS track_update AFTER {TRACKED_UPDATE_SQL}
+        WHEN NEW.change_seq IS OLD.change_seq
+    BEGIN
+        UPDATE downloads
+        SET change_seq = (SELECT COALESCE(MAX(change_seq), 0) + 1 FROM downloads)
+        WHERE rowid = NEW.rowid;
+    END;
+"""
+
+log = logging.getLogger()
+
 
 class Datastore:
-    """Store data about downloads in an SQLite3 database."""
+    """
+    Store data about downloads in an SQLite3 database.
 
-    def __init__(self, database: str = ":memory:") -> None:
+    Updates of download links and filenames can be written behind: they are
+    held until `batch_size` rows are pending or `flush_ms` milliseconds have
+    passed since the first of them, then committed in one transaction. Any
+    other use of the database flushes pending updates first, so reads always
+    see them. Use as a context manager, or call `close()`, to flush on exit.
+
+    Several processes may work on one database. The work queue iterators
+    claim the rows they yield for `worker_id`, so no two workers are handed
+    the same row. Claims are released as rows are saved, and the rest on
+    close. Leases are renewed while the iterators are consumed.
+    """
+
+    def __init__(
+        self,
+        database: str = ":memory:",
+        *,
+        batch_size: int = 1,
+        flush_ms: int = WRITE_FLUSH_MS,
+        clock: Callable[[], float] = time.time,
+        worker_id: str | None = None,
+        lease_seconds: float = LEASE_SECONDS,
+    ) -> None:
         """Provide a target database file, in-memory is default."""
-        self._dbconn = sqlite3.connect(database)
+        self._dbconn = sqlite3.connect(database, timeout=BUSY_TIMEOUT)
+        self._dbconn.executescript(PRAGMA_SQL)
+        self._batch_size = batch_size
+        self._flush_seconds = flush_ms / 1000
+        self._clock = clock
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self._renewed_at = clock()
+        # Views claimed or renewed by this worker, and when
+        self._claimed_at: dict[str, float] = {}
+        self._pending: list[_Update] = []
+        # Filenames by content hash of the downloads among the pending updates
+        self._pending_hashes: dict[str, str] = {}
+        self._pending_since = 0.0
         self._create_table()
 
+    def __enter__(self) -> Datastore:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Flush pending updates, release claimed rows, and close the database connection."""
+        self.release_claims()
+        self._dbconn.close()
+
+    def flush(self) -> None:
+        """Commit all pending updates in a single transaction."""
+        if not self._pending:
+            return
+
+        with METRICS.timer("db_commit_seconds"):
+            self._apply_pending()
+            self._dbconn.commit()
+
+    def _apply_pending(self) -> list[_Update]:
+        """Execute pending updates in the open transaction, returning them uncommitted."""
+        pending, self._pending = self._pending, []
+        self._pending_hashes.clear()
+        if not pending:
+            return pending
+
+        cursor = self._dbconn.cursor()
+        try:
+            for sql, parameters, unmatched in pending:
+                cursor.execute(sql, parameters)
+                if unmatched is not None and cursor.rowcount == 0:
+                    log.warning(unmatched)
+            METRICS.inc("db_rows_written_total", len(pending))
+        finally:
+            cursor.close()
+        return pending
+
+    def _write_behind(
+        self,
+        sql: str,
+        parameters: tuple[Any, ...],
+        *,
+        unmatched: str | None = None,
+    ) -> None:
+        """
+        Queue an update, flushing when the batch is full or has waited long enough.
+
+        When given, unmatched is logged if the update matches no row.
+        """
+        now = time.monotonic()
+        if not self._pending:
+            self._pending_since = now
+
+        self._pending.append((sql, parameters, unmatched))
+
+        if (
+            len(self._pending) >= self._batch_size
+            or now - self._pending_since >= self._flush_seconds
+        ):
+            self.flush()
+
     def _create_table(self) -> None:
-        """Create table in database, if not exists."""
+        """Create table in database, if not exists, adding any missing columns."""
         with self.cursor(commit_on_exit=True) as cursor:
             cursor.executescript(TABLE_SQL)
 
+            cursor.execute("PRAGMA table_info(downloads)")
+            existing = {row[1] for row in cursor.fetchall()}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in existing:
+                    cursor.execute(f"ALTER TABLE downloads ADD COLUMN {column} {column_type}")
+
+            if "change_seq" not in existing:
+                # Number rows saved before changes were tracked in insertion order
+                cursor.execute("UPDATE downloads SET change_seq = rowid")
+
+            if "status" not in existing:
+                cursor.execute(STATUS_MIGRATION_SQL)
+
+            cursor.executescript(ADDED_INDEX_SQL)
+
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'track_update'")
+            trigger = cursor.fetchone()
+            if trigger is not None and TRACKED_UPDATE_SQL not in trigger[0]:
+                cursor.execute("DROP TRIGGER IF EXISTS track_update")
+            cursor.executescript(CHANGE_TRACKING_SQL)
+
     def row_count(self) -> int:
         """Return the number of rows in the database."""
         with self.cursor() as cursor:
             cursor.execute("SELECT COUNT(*) FROM downloads")
             return cursor.fetchone()[0]
 
-    def save_views(self, data: list[tuple[str, str, str]]) -> None:
-        """Save a list of view link, title, author to the database."""
+    def save_views(self, data: list[tuple[str, str, str]], username: str | None = None) -> None:
+        """
+        Save a list of view link, title, author to the database.
+
+        Views already saved are left unchanged. When given, username is
+        recorded as a favoriter of every view.
+        """
         now = str(datetime.now(tz=timezone.utc))
         with self.cursor(commit_on_exit=True) as cursor:
             sql = """\
@@ -63,70 +338,688 @@ class Datastore:
             values = [[view, title, author, now] for view, title, author in data]
             cursor.executemany(sql, values)
 
+            if username is not None:
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO favorites (username, view) VALUES (?, ?)",
+                    [(username, view) for view, _, _ in data],
+                )
+
     def save_view(self, view: tuple[str, str, str]) -> None:
         """Save a view to the databse."""
         self.save_views([view])
 
+    def filter_new_views(
+        self,
+        data: list[tuple[str, str, str]],
+        username: str | None = None,
+    ) -> list[tuple[str, str, str]]:
+        """
+        Return the view link, title, author entries not yet saved to the database.
+
+        When username is given, return the entries not yet saved as favorites
+        of that user instead.
+        """
+        if not data:
+            return []
+
+        views = [view for view, _, _ in data]
+        placeholders = ",".join("?" * len(views))
+        # Pending updates never add views or favorites, so they can wait
+        with self.cursor(flush=False) as cursor:
+            if username is None:
+                cursor.execute(f"SELECT view FROM downloads WHERE view IN ({placeholders})", views)
+            else:
+                cursor.execute(
+                    f"SELECT view FROM favorites WHERE username=? AND view IN ({placeholders})",
+                    [username, *views],
+                )
+            known = {row[0] for row in cursor.fetchall()}
+
+        return [entry for entry in data if entry[0] not in known]
+
     def save_download(self, view: str, download: str | None) -> None:
-        """Save the download URL of a view."""
+        """Save the download URL of a view, marking it unavailable when there is none."""
         now = str(datetime.now(tz=timezone.utc))
-        with self.cursor(commit_on_exit=True) as cursor:
+        status = "resolved" if download is not None else "unavailable"
+        self._claimed_at.pop(view, None)
+        self._write_behind(
+            "UPDATE downloads SET download=?, download_date=?, status=?, "
+            "claimed_by=NULL, lease_expires=NULL WHERE view=?",
+            (download, now, status, view),
+        )
+
+    def save_filename(
+        self,
+        view: str,
+        filename: str,
+        *,
+        sha256: str | None = None,
+        filetype: str | None = None,
+        size: int | None = None,
+    ) -> None:
+        """
+        Save the filename, and optionally the content hash, file type, and size, of a download.
+
+        A row claimed by another worker in the meantime is left to that
+        worker, and a warning logged once the update is written.
+        """
+        self._claimed_at.pop(view, None)
+        if sha256 is not None:
+            self._pending_hashes.setdefault(sha256, filename)
+        self._write_behind(
+            "UPDATE downloads SET filename=?, sha256=?, filetype=?, size=?, status='downloaded', "
+            "part_offset=NULL, part_length=NULL, part_validator=NULL, "
+            "last_status=NULL, last_error=NULL, next_retry_at=NULL, "
+            f"claimed_by=NULL, lease_expires=NULL WHERE view=? AND {CLAIMABLE_SQL}",
+            (filename, sha256, filetype, size, view, self.worker_id, self._clock()),
+            unmatched=f"{view} was claimed by another worker, leaving {filename} unrecorded",
+        )
+
+    def save_failure(self, view: str, error: str, status: int | None = None) -> None:
+        """
+        Record a failed download attempt, with the response status if there was one.
+
+        The download is left out of the work queue until its backoff has
+        passed, or marked failed for good when the status is in
+        PERMANENT_STATUSES.
+        """
+        sql = """\
+            UPDATE downloads
+            SET attempts = attempts + 1,
+                last_status = ?,
+                last_error = ?,
+                status = CASE WHEN ? THEN 'failed' ELSE status END,
+                next_retry_at = CASE WHEN ? THEN NULL
+                    ELSE ? + MIN(? * (1 << MIN(attempts, 30)), ?) END,
+                claimed_by = NULL,
+                lease_expires = NULL
+            WHERE view = ?
+        """
+        permanent = status in PERMANENT_STATUSES
+        self._claimed_at.pop(view, None)
+        parameters = (
+            status,
+            error,
+            permanent,
+            permanent,
+            self._clock(),
+            RETRY_BASE_SECONDS,
+            RETRY_MAX_SECONDS,
+            view,
+        )
+        self._write_behind(sql, parameters)
+
+    def get_failure(self, view: str) -> tuple[int, int | None, str | None, float | None] | None:
+        """Return the attempts, last status, last error, and next retry time of a download."""
+        with self.cursor() as cursor:
             cursor.execute(
-                "UPDATE downloads SET download=?, download_date=? WHERE view=?",
-                (download, now, view),
+                "SELECT attempts, last_status, last_error, next_retry_at FROM downloads "
+                "WHERE view=?",
+                (view,),
             )
+            return cursor.fetchone()
 
-    def save_filename(self, view: str, filename: str) -> None:
-        """Save the filename of a download."""
-        with self.cursor(commit_on_exit=True) as cursor:
+    def save_partial(
+        self,
+        view: str,
+        offset: int | None,
+        length: int | None = None,
+        validator: str | None = None,
+    ) -> None:
+        """Save the bytes on disk of an unfinished download, its length, and validator."""
+        self._write_behind(
+            "UPDATE downloads SET part_offset=?, part_length=?, part_validator=? WHERE view=?",
+            (offset, length, validator, view),
+        )
+
+    def get_partial(self, view: str) -> tuple[int, int | None, str | None] | None:
+        """Return the offset, length, and validator of an unfinished download, if any."""
+        with self.cursor() as cursor:
             cursor.execute(
-                "UPDATE downloads SET filename=? WHERE view=?",
-                (filename, view),
+                "SELECT part_offset, part_length, part_validator FROM downloads "
+                "WHERE view=? AND part_offset IS NOT NULL",
+                (view,),
             )
+            return cursor.fetchone()
 
-    def get_views_to_download(self) -> list[str]:
-        """Return a list of views that have not been downloaded."""
+    def get_filename_by_hash(self, sha256: str) -> str | None:
+        """
+        Return the filename of a download with the given content hash, if any.
+
+        Downloads saved since the last flush are looked up in memory, so the
+        lookup made for every download doesn't commit pending updates. A
+        pending rename may not be seen yet, callers check the file exists.
+        """
+        pending = self._pending_hashes.get(sha256)
+        if pending is not None:
+            return pending
+
+        with self.cursor(flush=False) as cursor:
+            cursor.execute(
+                "SELECT filename FROM downloads WHERE sha256=? AND filename IS NOT NULL LIMIT 1",
+                (sha256,),
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def has_filename(self, filename: str) -> bool:
+        """Return True if a download is saved under filename."""
         with self.cursor() as cursor:
-            cursor.execute("SELECT view FROM downloads WHERE download IS NULL")
-            return [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT 1 FROM downloads WHERE filename=? LIMIT 1", (filename,))
+            return cursor.fetchone() is not None
+
+    def get_views_to_download(self) -> list[str]:
+        """Claim and return a list of views that have not been downloaded."""
+        return list(self.iter_views_to_download())
 
     def get_downloads_to_process(self) -> list[tuple[str, str, str, str]]:
-        """Return a list of view, title, author, and download link that have not been processed."""
+        """Claim and return a list of view, title, author, and download link not processed."""
+        return list(self.iter_downloads_to_process())
+
+    def count_views_to_download(self) -> int:
+        """Return the number of views that have not been downloaded."""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM downloads WHERE status='discovered'")
+            return cursor.fetchone()[0]
+
+    def count_downloads_to_process(self) -> int:
+        """Return the number of download links that have not been processed."""
         with self.cursor() as cursor:
             cursor.execute(
-                "SELECT view, title, author, download FROM downloads "
-                "WHERE download IS NOT NULL AND filename IS NULL"
+                f"SELECT COUNT(*) FROM downloads WHERE status='resolved' AND {RETRY_READY_SQL}",
+                (self._clock(),),
+            )
+            return cursor.fetchone()[0]
+
+    def claim_views(self, limit: int, *, after: str = "") -> list[str]:
+        """Claim up to limit views that have not been resolved, in order, after the given one."""
+        rows = self._claim("view", "status = 'discovered' AND view > ?", (after,), limit)
+        return [row[0] for row in rows]
+
+    def claim_downloads(
+        self,
+        limit: int,
+        *,
+        after: str = "",
+        resolved_before: str | None = None,
+    ) -> list[tuple[str, str, str, str]]:
+        """
+        Claim up to limit view, title, author, and download link rows that have not been processed.
+
+        Rows are claimed in order of view, after the given one. When
+        `resolved_before` is given only rows whose download link was saved
+        before that date are claimed. Failed downloads are skipped until
+        their backoff has passed.
+        """
+        where = f"status = 'resolved' AND view > ? AND download_date < ? AND {RETRY_READY_SQL}"
+        # Dates are stored as text, "~" sorts after any of them
+        parameters = (after, resolved_before or "~", self._clock())
+        return self._claim("view, title, author, download", where, parameters, limit)
+
+    def iter_views_to_download(self, batch_size: int = ITER_BATCH_SIZE) -> Iterator[str]:
+        """Lazily claim and yield views that have not been downloaded, one batch per query."""
+        last_view = ""
+        while "there are rows left":
+            views = self.claim_views(batch_size, after=last_view)
+            if not views:
+                return
+
+            last_view = views[-1]
+            for view in views:
+                self._renew_leases_when_due()
+                yield view
+
+    def iter_downloads_to_process(
+        self,
+        batch_size: int = ITER_BATCH_SIZE,
+        *,
+        resolved_before: str | None = None,
+    ) -> Iterator[tuple[str, str, str, str]]:
+        """
+        Lazily claim and yield view, title, author, and download link that have not been processed.
+
+        Rows are claimed one batch per query, as by `claim_downloads`.
+        """
+        last_view = ""
+        while "there are rows left":
+            rows = self.claim_downloads(
+                batch_size, after=last_view, resolved_before=resolved_before
+            )
+            if not rows:
+                return
+
+            last_view = rows[-1][0]
+            for row in rows:
+                self._renew_leases_when_due()
+                yield row
+
+    def get_download_to_process(self, view: str) -> tuple[str, str, str, str] | None:
+        """Claim and return the view, title, author, and download link of a view if not processed."""
+        rows = self._claim(
+            "view, title, author, download",
+            f"view = ? AND status = 'resolved' AND {RETRY_READY_SQL}",
+            (view, self._clock()),
+            1,
+        )
+        return rows[0] if rows else None
+
+    def keep_claim(self, view: str) -> bool:
+        """
+        Claim a row for this worker, or extend the lease it already holds.
+
+        Returns False when another worker has claimed the row, or the row
+        is no longer queued for download, in which case this worker must
+        leave it alone.
+        """
+        now = self._clock()
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute(
+                "UPDATE downloads SET claimed_by=?, lease_expires=? "
+                f"WHERE view=? AND status='resolved' AND {CLAIMABLE_SQL}",
+                (self.worker_id, now + self.lease_seconds, view, self.worker_id, now),
             )
-            return cursor.fetchall()
+            kept = cursor.rowcount == 1
+
+        if kept:
+            self._claimed_at[view] = now
+        else:
+            self._claimed_at.pop(view, None)
+        return kept
+
+    def claim_is_fresh(self, view: str) -> bool:
+        """
+        Return True if this worker claimed or renewed a view less than half a lease ago.
+
+        Other workers only take over expired leases, so a fresh claim can be
+        relied on without asking the database.
+        """
+        claimed_at = self._claimed_at.get(view)
+        return claimed_at is not None and self._clock() - claimed_at < self.lease_seconds / 2
+
+    def renew_leases(self) -> None:
+        """Extend the lease of every row claimed by this worker."""
+        now = self._clock()
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute(
+                "UPDATE downloads SET lease_expires=? WHERE claimed_by=?",
+                (now + self.lease_seconds, self.worker_id),
+            )
+        self._renewed_at = now
+        self._claimed_at = dict.fromkeys(self._claimed_at, now)
+
+    def release_claims(self) -> None:
+        """Release every row claimed by this worker, for other workers to claim."""
+        with self.cursor(commit_on_exit=True) as cursor:
+            cursor.execute(
+                "UPDATE downloads SET claimed_by=NULL, lease_expires=NULL WHERE claimed_by=?",
+                (self.worker_id,),
+            )
+        self._claimed_at.clear()
+
+    def _claim(
+        self,
+        columns: str,
+        where: str,
+        parameters: tuple[Any, ...],
+        limit: int,
+    ) -> list[Any]:
+        """
+        Claim up to limit rows matching where, in order of view, returning their columns.
 
-    def update_filename(self, old_name: str, new_name: str) -> None:
-        """Update a row's filename, found by filename."""
+        The columns start with the view, which is remembered as claimed.
+
+        The write lock is taken before the rows are chosen, so rows claimed
+        by another worker at the same time are never chosen twice.
+        """
+        now = self._clock()
+        sql = f"""\
+            UPDATE downloads SET claimed_by = ?, lease_expires = ?
+            WHERE rowid IN (
+                SELECT rowid FROM downloads
+                WHERE {where} AND {CLAIMABLE_SQL}
+                ORDER BY view
+                LIMIT ?
+            )
+            RETURNING {columns}
+        """
+        claim = (self.worker_id, now + self.lease_seconds)
+        claimable = (self.worker_id, now)
+        with self.cursor(flush=False) as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            applied: list[_Update] = []
+            try:
+                # Pending updates may resolve the rows, and are committed with the claim
+                applied = self._apply_pending()
+                cursor.execute(sql, (*claim, *parameters, *claimable, limit))
+                rows = cursor.fetchall()
+            except BaseException:
+                self._dbconn.rollback()
+                self._pending[:0] = applied
+                raise
+            with METRICS.timer("db_commit_seconds"):
+                self._dbconn.commit()
+
+        self._claimed_at.update((row[0], now) for row in rows)
+        METRICS.inc("db_rows_claimed_total", len(rows))
+        # RETURNING yields rows in no particular order
+        return sorted(rows)
+
+    def _renew_leases_when_due(self) -> None:
+        """Renew the leases of this worker once half of their time has passed."""
+        if self._clock() - self._renewed_at >= self.lease_seconds / 2:
+            self.renew_leases()
+
+    def get_view_date(self, view: str) -> str | None:
+        """Return the date a view was first saved, if known."""
+        with self.cursor() as cursor:
+            cursor.execute("SELECT view_date FROM downloads WHERE view=?", (view,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def update_filename(self, old_name: str, new_name: str, *, filetype: str | None = None) -> None:
+        """Update a row's filename, and file type when given, found by filename."""
         sql = """\
             UPDATE downloads
-            SET filename=?
+            SET filename=?, filetype=COALESCE(?, filetype)
             WHERE filename=?;
         """
-        with self.cursor(commit_on_exit=True) as cursor:
-            cursor.execute(sql, (new_name, old_name))
+        self._write_behind(sql, (new_name, filetype, old_name))
+
+    def iter_stored_files(
+        self,
+        batch_size: int = ITER_BATCH_SIZE,
+    ) -> Iterator[tuple[str, str, str, str | None]]:
+        """
+        Lazily yield filename, author, view date, and hash of every downloaded file.
+
+        Rows are paged by rowid, so renaming files while iterating neither
+        skips nor repeats a row.
+        """
+        sql = """\
+            SELECT rowid, filename, author, view_date, sha256 FROM downloads
+            WHERE filename IS NOT NULL AND rowid > ?
+            ORDER BY rowid
+            LIMIT ?
+        """
+        last_rowid = 0
+        while "there are rows left":
+            with self.cursor() as cursor:
+                cursor.execute(sql, (last_rowid, batch_size))
+                rows = cursor.fetchall()
+
+            if not rows:
+                return
+
+            last_rowid = rows[-1][0]
+            yield from (row[1:] for row in rows)
+
+    def iter_filenames(self, batch_size: int = ITER_BATCH_SIZE) -> Iterator[str]:
+        """Lazily yield every saved filename."""
+        sql = """\
+            SELECT DISTINCT filename FROM downloads
+            WHERE filename IS NOT NULL AND filename > ?
+            ORDER BY filename
+            LIMIT ?
+        """
+        last_filename = ""
+        while "there are rows left":
+            with self.cursor() as cursor:
+                cursor.execute(sql, (last_filename, batch_size))
+                rows = cursor.fetchall()
+
+            if not rows:
+                return
+
+            last_filename = rows[-1][0]
+            yield from (row[0] for row in rows)
+
+    def iter_files_to_verify(
+        self,
+        batch_size: int = ITER_BATCH_SIZE,
+    ) -> Iterator[tuple[str, str | None, int | None, tuple[int, int, str | None] | None]]:
+        """
+        Lazily yield filename, hash, size, and verify cache entry of every downloaded file.
+
+        The cache entry is the size, mtime in nanoseconds, and hash the file
+        had when it was last found intact, or None.
+        """
+        sql = """\
+            SELECT downloads.filename, downloads.sha256, downloads.size,
+                verified.size, verified.mtime_ns, verified.sha256
+            FROM downloads LEFT JOIN verified USING (filename)
+            WHERE downloads.status = 'downloaded' AND downloads.filename > ?
+            GROUP BY downloads.filename
+            ORDER BY downloads.filename
+            LIMIT ?
+        """
+        last_filename = ""
+        while "there are rows left":
+            with self.cursor() as cursor:
+                cursor.execute(sql, (last_filename, batch_size))
+                rows = cursor.fetchall()
+
+            if not rows:
+                return
+
+            last_filename = rows[-1][0]
+            for filename, sha256, size, cached_size, cached_mtime_ns, cached_sha256 in rows:
+                cached = None
+                if cached_size is not None:
+                    cached = (cached_size, cached_mtime_ns, cached_sha256)
+                yield filename, sha256, size, cached
+
+    def save_verified(self, filename: str, size: int, mtime_ns: int, sha256: str | None) -> None:
+        """Remember that a file with the given size, mtime, and hash was found intact."""
+        self._write_behind(
+            "INSERT OR REPLACE INTO verified (filename, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+            (filename, size, mtime_ns, sha256),
+        )
+
+    def requeue_download(self, filename: str, error: str) -> None:
+        """Put the downloads stored under a damaged or missing filename back in the work queue."""
+        self._write_behind(
+            "UPDATE downloads SET status='resolved', filename=NULL, sha256=NULL, filetype=NULL, "
+            "size=NULL, last_status=NULL, last_error=?, next_retry_at=NULL "
+            "WHERE filename=? AND status='downloaded'",
+            (error, filename),
+        )
+        self._write_behind("DELETE FROM verified WHERE filename=?", (filename,))
+
+    def iter_unknown_filetypes(self, batch_size: int = ITER_BATCH_SIZE) -> Iterator[str]:
+        """Lazily yield filenames of downloads without a recorded file type."""
+        sql = """\
+            SELECT DISTINCT filename FROM downloads
+            WHERE filename IS NOT NULL AND filetype IS NULL AND filename > ?
+            ORDER BY filename
+            LIMIT ?
+        """
+        last_filename = ""
+        while "there are rows left":
+            with self.cursor() as cursor:
+                cursor.execute(sql, (last_filename, batch_size))
+                rows = cursor.fetchall()
+
+            if not rows:
+                return
+
+            last_filename = rows[-1][0]
+            yield from (row[0] for row in rows)
 
     def export_as_csv(self, filename: str) -> None:
         """Export the database as a CSV file."""
+        self.export(filename)
+
+    def export(
+        self,
+        filename: str,
+        *,
+        export_format: str = "csv",
+        incremental: bool = False,
+        batch_size: int = EXPORT_BATCH_SIZE,
+    ) -> int:
+        """
+        Stream the database to a CSV or JSON Lines file, returning the rows written.
+
+        Rows are fetched `batch_size` at a time from a single read, which sees
+        one consistent state of the database without blocking writers. A full
+        export replaces the file atomically. An incremental export appends
+        only the rows inserted or changed since the last export to the same
+        file, so a changed row appears again and the last line of each view
+        is current. It falls back to a full export when the file is missing
+        or its CSV header no longer matches the columns.
+        """
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {export_format}")
+
+        path = Path(filename)
+        watermark_key = f"export:{path.resolve()}"
+
         with self.cursor() as cursor:
-            cursor.execute("SELECT * FROM downloads")
+            cursor.execute("SELECT * FROM downloads LIMIT 0")
             fieldnames = [description[0] for description in cursor.description]
-            with open(filename, "w", encoding="utf-8") as csvfile:
-                writer = csv.writer(csvfile, lineterminator="\n")
-                writer.writerow(fieldnames)
-                writer.writerows(cursor.fetchall())
+
+            high = cursor.execute("SELECT COALESCE(MAX(change_seq), 0) FROM downloads").fetchone()[
+                0
+            ]
+            since = self._get_meta(cursor, watermark_key) if incremental else None
+            if since is not None and not _can_append(path, export_format, fieldnames):
+                since = None
+
+            if since is None:
+                # The unary plus keeps the bound from using the index, a table scan is faster
+                cursor.execute("SELECT * FROM downloads WHERE +change_seq <= ?", (high,))
+                written = _write_export(cursor, path, export_format, fieldnames, batch_size)
+            else:
+                cursor.execute(
+                    "SELECT * FROM downloads WHERE change_seq > ? AND change_seq <= ? "
+                    "ORDER BY change_seq",
+                    (since, high),
+                )
+                written = _append_export(cursor, path, export_format, fieldnames, batch_size)
+
+        with self.cursor(commit_on_exit=True) as cursor:
+            self._set_meta(cursor, watermark_key, high)
+
+        return written
+
+    def backup(self, filename: str, *, pages: int = BACKUP_PAGES) -> None:
+        """
+        Write a consistent snapshot of the database to another database file.
+
+        Uses SQLite's online backup API, copying `pages` pages per step so
+        the database is never locked for the whole copy.
+        """
+        self.flush()
+        target = sqlite3.connect(filename)
+        try:
+            self._dbconn.backup(target, pages=pages)
+        finally:
+            target.close()
+
+    @staticmethod
+    def _get_meta(cursor: Cursor, key: str) -> int | None:
+        """Return a value of the meta table, if set."""
+        row = cursor.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _set_meta(cursor: Cursor, key: str, value: int) -> None:
+        """Set a value of the meta table."""
+        cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
 
     @contextmanager
-    def cursor(self, *, commit_on_exit: bool = False) -> Generator[Cursor, None, None]:
-        """Context manager for cursor creation and cleanup."""
+    def cursor(
+        self,
+        *,
+        commit_on_exit: bool = False,
+        flush: bool = True,
+    ) -> Generator[Cursor, None, None]:
+        """
+        Context manager for cursor creation and cleanup.
+
+        Pending updates are flushed first, or for a cursor committing on exit,
+        executed in its transaction and committed with it. Reads that pending
+        updates can't change pass flush=False and leave them pending.
+        """
+        if flush and commit_on_exit:
+            self._apply_pending()
+        elif flush:
+            self.flush()
         try:
             cursor = self._dbconn.cursor()
             yield cursor
 
         finally:
             if commit_on_exit:
-                self._dbconn.commit()
+                with METRICS.timer("db_commit_seconds"):
+                    self._dbconn.commit()
             cursor.close()
+
+
+def default_worker_id() -> str:
+    """Return an id of this process unique among the hosts sharing a database."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _can_append(path: Path, export_format: str, fieldnames: list[str]) -> bool:
+    """Return True if an export file exists and, for CSV, has a header of the given columns."""
+    if not path.exists():
+        return False
+    if export_format != "csv":
+        return True
+
+    with open(path, encoding="utf-8", newline="") as csvfile:
+        header = next(csv.reader(csvfile), None)
+    return header == fieldnames
+
+
+def _write_export(
+    cursor: Cursor,
+    path: Path,
+    export_format: str,
+    fieldnames: list[str],
+    batch_size: int,
+) -> int:
+    """Write the rows of a cursor to a new export file, replacing path once complete."""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline="") as outfile:
+            if export_format == "csv":
+                csv.writer(outfile, lineterminator="\n").writerow(fieldnames)
+            written = _write_rows(cursor, outfile, export_format, fieldnames, batch_size)
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return written
+
+
+def _append_export(
+    cursor: Cursor,
+    path: Path,
+    export_format: str,
+    fieldnames: list[str],
+    batch_size: int,
+) -> int:
+    """Append the rows of a cursor to an export file."""
+    with open(path, "a", encoding="utf-8", newline="") as outfile:
+        return _write_rows(cursor, outfile, export_format, fieldnames, batch_size)
+
+
+def _write_rows(
+    cursor: Cursor,
+    outfile: TextIO,
+    export_format: str,
+    fieldnames: list[str],
+    batch_size: int,
+) -> int:
+    """Write rows fetched batch_size at a time as CSV rows or JSON lines."""
+    writer = csv.writer(outfile, lineterminator="\n")
+    written = 0
+    while rows := cursor.fetchmany(batch_size):
+        if export_format == "csv":
+            writer.writerows(rows)
+        else:
+            outfile.writelines(json.dumps(dict(zip(fieldnames, row))) + "\n" for row in rows)
+        written += len(rows)
+    return written
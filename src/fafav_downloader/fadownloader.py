@@ -8,30 +8,99 @@ details.
 
 from __future__ import annotations
 
+import argparse
+import functools
+import hashlib
 import logging
 import os
 import re
 import shutil
-import sys
-import time
-from io import BytesIO
+import threading
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Any
 
 import httpx
 
+from .datastore import EXPORT_FORMATS
+from .datastore import LEASE_SECONDS
+from .datastore import WRITE_BATCH_SIZE
 from .datastore import Datastore
+from .extractor import extract_page
+from .filenames import FilenameIndex
+from .filesink import SNIFF_LENGTH
+from .filesink import FileSink
+from .layout import DEFAULT_LAYOUT
+from .layout import LAYOUTS
+from .layout import join_path
+from .layout import shard_directory
+from .layout import split_path
+from .metrics import METRICS
+from .metrics import WRITE_INTERVAL
+from .metrics import MetricsWriter
+from .metrics import Progress
+from .pagecache import MAX_BYTES
+from .pagecache import PAGE_CACHE_FILE
+from .pagecache import TTL_SECONDS
+from .pagecache import PageCache
+from .ratelimit import AdaptiveRateLimiter
+from .ratelimit import BandwidthLimiter
+from .ratelimit import parse_rate
+from .ratelimit import parse_window
+from .resume import RANGE_ATTEMPTS
+from .resume import LeaseLostError
+from .resume import PartialDownload
+from .transport import CDN_POOL
+from .transport import HTTP2_AVAILABLE
+from .transport import SITE_POOL
+from .transport import PoolConfig
+from .transport import build_client
+from .watch import WATCH_INTERVAL
+from .watch import WATCH_JITTER
+from .watch import StopSignal
+from .watch import watch
 
 BASE_URL = "https://www.furaffinity.net"
+SITE_HOST = httpx.URL(BASE_URL).host
 COOKIE_FILE = "cookie"
-SLEEP_SECONDS_PER_ACTION = 1
+EXPORT_FILE = "fa_download"
 DOWNLOAD_PATH = Path("downloads")
+CHUNK_SIZE = 64 * 1024
+KNOWN_PAGES_BEFORE_STOP = 2
+DUPLICATE_MODES = ("hardlink", "skip")
+DUPLICATE_MODE = "hardlink"
 
+# Limits of the opt-in async engine
+WORKER_COUNT = 8
+SITE_CONCURRENCY = 2
+CDN_CONCURRENCY = 4
+
+# Patterns matched against the start of a file, first match wins
 FILE_SIGNATURES = {
-    b"\x89PNG\r\n\x1a\n": "png",
-    b"GIF87a": "gif",
-    b"GIF89a": "gif",
-    b"\xff\xd8": "jpg",
+    rb"\x89PNG\r\n\x1a\n": "png",
+    rb"GIF8[79]a": "gif",
+    rb"\xff\xd8": "jpg",
+    rb"RIFF.{4}WEBP": "webp",
+    rb".{4}ftypqt  ": "mov",
+    rb".{4}ftyp": "mp4",
+    rb"\x1a\x45\xdf\xa3": "webm",
+    rb"[FCZ]WS": "swf",
+    rb"%PDF-": "pdf",
+    rb"\{\\rtf": "rtf",
+    rb"ID3|\xff[\xfb\xf3\xf2]": "mp3",
+    rb"OggS": "ogg",
 }
+SIGNATURE_PATTERNS = [
+    (re.compile(signature, re.DOTALL), extension)
+    for signature, extension in FILE_SIGNATURES.items()
+]
+# Error recorded for a download whose body is shorter than announced
+INCOMPLETE_ERROR = "Incomplete download"
+
+TEXT_EXTENSION = "txt"
 
 log = logging.getLogger()
 
@@ -71,48 +140,52 @@ def get_page(url: str, http_client: httpx.Client) -> str:
 
 def get_favorite_data(page_body: str) -> set[tuple[str, str, str]]:
     """Extract the view link, title, and author name from page."""
-    pattern = r"<figcaption>\n.+\n\s+<a\shref=\"(\/view\/\d+\/)\"\s+title=\"(.+)\".+\n.+\n.+\n.+<a\shref=\"\/user\/(.+)\/\""
-    search = re.findall(pattern, page_body, re.I)
-    return set((s[0], s[1], s[2]) for s in search)
+    return extract_page(page_body).favorites
 
 
 def get_next_page(page_body: str, username: str) -> str | None:
     """Pull the next page link from a favorites page."""
-    search = re.search(rf"\/favorites\/{username}\/[0-9]{{1,}}\/next", page_body, re.I)
-    return search.group() if search is not None else None
+    return extract_page(page_body, username).next_page
 
 
 def get_download_url(page_body: str) -> str | None:
     """Pull the download link from a view page."""
-    search = re.search(r'<div class="download">(.+?)</div>', page_body, re.I | re.S)
-    line = search.group() if search is not None else ""
-    line = re.sub(r"\s+", " ", line)
-    line = re.sub(r'<div class="download">\s?<a href="', "", line)
-    line = re.sub(r'">Download</a>\s?</div>', "", line)
-    return f"https:{line}" if line.startswith("//") else None
+    return extract_page(page_body).download_url
 
 
 def save_view_links(
     username: str,
     http_client: httpx.Client,
     datastore: Datastore,
+    *,
+    known_pages: int | None = KNOWN_PAGES_BEFORE_STOP,
+    stop: threading.Event | None = None,
 ) -> None:
-    """Save all view links for given username to datastore."""
+    """
+    Save view links for given username to datastore.
+
+    Favorites are listed newest first. The scan stops after `known_pages`
+    consecutive pages without a view not yet saved as a favorite of the
+    user. Set to None to walk every page. The scan also stops after the
+    current page once `stop` is set.
+    """
     url = f"{BASE_URL}/favorites/{username}/"
-
-    view_link_data: set[tuple[str, str, str]] = set()
+    known_streak = 0
 
     while "the fires of passion burn brightly":
 
         page_body = get_page(url, http_client)
-        fav_data = get_favorite_data(page_body)
-        next_link = get_next_page(page_body, username)
+        fav_data, next_link, _ = extract_page(page_body, username)
 
-        view_link_data.update(fav_data)
+        new_data = datastore.filter_new_views(list(fav_data), username)
+        datastore.save_views(new_data, username)
+        known_streak = 0 if new_data else known_streak + 1
+        METRICS.inc("stage_items_total", stage="scan")
 
         log.info(
-            "Found %d favorite links on '%s'. More is %s",
+            "Found %d favorite links (%d new) on '%s'. More is %s",
             len(fav_data),
+            len(new_data),
             url,
             bool(next_link),
         )
@@ -122,84 +195,389 @@ def save_view_links(
         if next_link is None:
             break
 
-        time.sleep(SLEEP_SECONDS_PER_ACTION)
+        if known_pages is not None and known_streak >= known_pages:
+            log.info("No new favorites on the last %d pages, stopping scan.", known_streak)
+            break
 
-    datastore.save_views(list(view_link_data))
+        if _stop_requested(stop):
+            break
 
 
 def save_download_links(
     http_client: httpx.Client,
     datastore: Datastore,
+    *,
+    stop: threading.Event | None = None,
 ) -> None:
-    """Save all download links for given view links to datastore."""
-    view_links = datastore.get_views_to_download()
+    """
+    Save all download links for given view links to datastore.
+
+    A view page without a download link marks the view unavailable, so it
+    isn't fetched again. A view whose page couldn't be fetched is left for
+    the next run, as are the views left once `stop` is set.
+    """
+    progress = Progress("resolve", datastore.count_views_to_download())
 
-    for idx, view in enumerate(view_links, start=1):
-        log.info("(%d / %d) Fetching download link of %s", idx, len(view_links), view)
+    for view in datastore.iter_views_to_download():
+        if _stop_requested(stop):
+            break
+        log.info("%s Fetching download link of %s", progress.advance(), view)
         page = get_page(f"{BASE_URL}{view}", http_client)
-        download_link = get_download_url(page)
-        datastore.save_download(view, download_link)
-        time.sleep(SLEEP_SECONDS_PER_ACTION)
+        if page:
+            datastore.save_download(view, get_download_url(page))
 
 
-def download_favorite_files(http_client: httpx.Client, datastore: Datastore) -> None:
-    """Download all favorite files and update datastore with filenames."""
+def download_favorite_files(
+    http_client: httpx.Client,
+    datastore: Datastore,
+    *,
+    chunk_size: int = CHUNK_SIZE,
+    duplicates: str = DUPLICATE_MODE,
+    layout: str = DEFAULT_LAYOUT,
+    stop: threading.Event | None = None,
+    names: FilenameIndex | None = None,
+) -> None:
+    """
+    Download all favorite files and update datastore with filenames.
+
+    Files with the same content as an earlier download are hardlinked to it
+    when `duplicates` is "hardlink", or only recorded under the existing
+    filename when it is "skip". New files are placed as set by `layout`.
+    Once `stop` is set, the file in progress is the last one downloaded.
+    The index of taken filenames is built from the library unless given.
+    """
     DOWNLOAD_PATH.mkdir(parents=True, exist_ok=True)
 
-    to_download = datastore.get_downloads_to_process()
+    if names is None:
+        names = FilenameIndex.from_datastore(datastore, DOWNLOAD_PATH)
+    progress = Progress("download", datastore.count_downloads_to_process())
+
+    for row in datastore.iter_downloads_to_process():
+        if _stop_requested(stop):
+            break
+
+        download_link = row[3]
+        log.info("%s Downloading %s", progress.advance(), download_link)
+
+        try:
+            _download_file(row, http_client, datastore, names, chunk_size, duplicates, layout)
+        except httpx.HTTPError as err:
+            log.error("Download of %s failed: %s", download_link, err)
+            datastore.save_failure(row[0], _describe_error(err))
+        except LeaseLostError as err:
+            log.warning("Leaving download of %s: %s", download_link, err)
+
+
+def _download_file(
+    row: tuple[str, str, str, str],
+    http_client: httpx.Client,
+    datastore: Datastore,
+    names: FilenameIndex,
+    chunk_size: int = CHUNK_SIZE,
+    duplicates: str = DUPLICATE_MODE,
+    layout: str = DEFAULT_LAYOUT,
+) -> bool:
+    """Stream a single row to disk, resuming an earlier attempt if possible. Returns success."""
+    view, _, _, download_link = row
+
+    with PartialDownload(DOWNLOAD_PATH, datastore, view) as partial:
+        for _ in range(RANGE_ATTEMPTS):
+            with http_client.stream("GET", download_link, headers=partial.headers()) as response:
+                if partial.needs_full_request(response):
+                    continue
+
+                if not response.is_success:
+                    log.error("Download of %s failed: %s", download_link, response.status_code)
+                    datastore.save_failure(view, response.reason_phrase, response.status_code)
+                    return False
+
+                partial.start(response)
+                for chunk in response.iter_bytes(chunk_size):
+                    partial.write(chunk)
 
-    for idx, (view, title, author, download_link) in enumerate(to_download, start=1):
-        log.info("(%d / %d) Downloading %s", idx, len(to_download), download_link)
+                if not partial.complete():
+                    datastore.save_failure(view, INCOMPLETE_ERROR)
+                    return False
 
-        extension = f'.{download_link.split(".")[-1]}'
-        filename = f"{author}-{title}{extension}"
-        filename = _sanitize_filename(filename)
-        filename = _uniquify_filename(filename, extension)
+                _store_download(partial.sink, datastore, row, names, duplicates, layout)
+                return True
 
-        response = http_client.get(download_link)
+    return False
 
-        if not response.is_success:
-            log.error("Download of %s failed: %s", download_link, response.status_code)
+
+def sniff_extension(header: bytes) -> str | None:
+    """Return the file extension matching the leading bytes of a file, if known."""
+    for pattern, extension in SIGNATURE_PATTERNS:
+        if pattern.match(header):
+            return extension
+
+    return TEXT_EXTENSION if _looks_like_text(header) else None
+
+
+def correct_file_extensions(
+    datastore: Datastore,
+    *,
+    stop: threading.Event | None = None,
+    names: FilenameIndex | None = None,
+) -> None:
+    """Detect the type of downloaded files with no recorded type and fix their extensions."""
+    if names is None:
+        names = FilenameIndex.from_datastore(datastore, DOWNLOAD_PATH)
+
+    for filename in datastore.iter_unknown_filetypes():
+        if _stop_requested(stop):
+            break
+
+        path = DOWNLOAD_PATH / filename
+        if not path.exists():
+            continue
+
+        with open(path, "rb") as infile:
+            extension = sniff_extension(infile.read(SNIFF_LENGTH))
+
+        if extension is None:
             continue
 
-        with open(DOWNLOAD_PATH / filename, "wb") as out_file:
-            shutil.copyfileobj(BytesIO(response.content), out_file)
-        del response
+        new_name = filename
+        if not filename.endswith(f".{extension}"):
+            new_name = names.allocate(f"{filename.rsplit('.', 1)[0]}.{extension}", f".{extension}")
+            shutil.move(src=path, dst=DOWNLOAD_PATH / new_name)
+            names.rename(filename, new_name)
+            log.info("Renamed %s to %s", filename, new_name)
 
-        datastore.save_filename(view, filename)
+        datastore.update_filename(filename, new_name, filetype=extension)
 
-        time.sleep(SLEEP_SECONDS_PER_ACTION)
 
+def _stop_requested(stop: threading.Event | None) -> bool:
+    """Return True if a stop was requested, ending the running stage early."""
+    if stop is None or not stop.is_set():
+        return False
 
-def correct_file_extensions(datastore: Datastore) -> None:
-    """Scan download directory and correct file extensions when possible."""
-    read_length = max(map(len, FILE_SIGNATURES.keys()))
+    log.info("Stop requested, leaving the rest of the stage for the next run.")
+    return True
 
-    to_rename: list[tuple[str, str, str]] = []
-    for dirpath, _, filenames in os.walk(DOWNLOAD_PATH):
-        for filename in filenames:
-            with open(os.path.join(dirpath, filename), "rb") as infile:
-                header = infile.read(read_length)
-                for key, value in FILE_SIGNATURES.items():
-                    if header.startswith(key):
-                        extention = value
-                        break
-                else:
-                    continue
 
-                if filename.endswith("." + extention):
-                    continue
+def migrate_layout(datastore: Datastore, layout: str) -> None:
+    """
+    Move downloaded files into the directory layout given, updating the datastore.
+
+    The rows of each file are committed as soon as it is moved, so an
+    interrupted migration leaves at most the file in flight with a stale
+    row. A file that is missing but found at its new place, as left then,
+    only has its rows updated.
+    """
+    names = FilenameIndex.from_datastore(datastore, DOWNLOAD_PATH)
+    # Filenames moved, whose other rows may still be yielded under the old name
+    moved: dict[str, str] = {}
+    count = 0
+
+    for filename, author, view_date, sha256 in datastore.iter_stored_files():
+        if filename in moved:
+            continue
+
+        _, basename = split_path(filename)
+        target = join_path(
+            shard_directory(layout, basename, _sanitize_filename(author), view_date),
+            basename,
+        )
+        if target == filename:
+            continue
+
+        extension = f".{basename.rsplit('.', 1)[1]}" if "." in basename else ""
+        source = DOWNLOAD_PATH / filename
+        if not source.exists():
+            found = _find_moved_file(datastore, target, extension, sha256)
+            if found is not None:
+                names.rename(filename, found)
+                datastore.update_filename(filename, found)
+                datastore.flush()
+                moved[filename] = found
+            else:
+                log.warning("Unable to move %s, file is missing", filename)
+            continue
+
+        new_name = names.allocate(target, extension)
+        (DOWNLOAD_PATH / new_name).parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source, DOWNLOAD_PATH / new_name)
+        names.rename(filename, new_name)
+        datastore.update_filename(filename, new_name)
+        datastore.flush()
+        moved[filename] = new_name
+        count += 1
+
+    _remove_empty_directories(DOWNLOAD_PATH)
+    log.info("Moved %d files into the %s layout", count, layout)
+
+
+def _find_moved_file(
+    datastore: Datastore,
+    target: str,
+    extension: str,
+    sha256: str | None,
+) -> str | None:
+    """
+    Return where an interrupted migration moved a file to, if it can be told.
+
+    The target and its postfixed variants are searched for a file no row is
+    saved under, which has the content hash of the row when one is recorded.
+    """
+    stem = target.removesuffix(extension)
+    candidate = target
+    postfix = 1
+    while (DOWNLOAD_PATH / candidate).exists():
+        if not datastore.has_filename(candidate) and (
+            sha256 is None or _file_sha256(DOWNLOAD_PATH / candidate) == sha256
+        ):
+            return candidate
+
+        candidate = f"{stem}-{postfix:04d}{extension}"
+        postfix += 1
+
+    return None
 
-                newfile_name = filename.rsplit(".", 1)[0] + "." + extention
-                to_rename.append((dirpath, filename, newfile_name))
 
-        for dirpath, old_name, new_name in to_rename:
-            datastore.update_filename(old_name, new_name)
-            shutil.move(
-                src=os.path.join(dirpath, old_name),
-                dst=os.path.join(dirpath, new_name),
+def _file_sha256(path: Path) -> str:
+    """Return the SHA-256 hex digest of the content of a file."""
+    with open(path, "rb") as infile:
+        return hashlib.file_digest(infile, "sha256").hexdigest()
+
+
+def _store_download(
+    sink: FileSink,
+    datastore: Datastore,
+    row: tuple[str, str, str, str],
+    names: FilenameIndex,
+    duplicates: str = DUPLICATE_MODE,
+    layout: str = DEFAULT_LAYOUT,
+) -> str:
+    """
+    Place a completed download and save its filename, hash, and type. Returns the filename.
+
+    The extension is taken from the sniffed file type, falling back to the
+    one of the download link when the type is unknown. The file is placed in
+    the directory chosen by `layout`. When the content hash is already known
+    the existing file is reused as set by `duplicates`. A hardlink falls back
+    to a copy if the filesystem refuses it.
+    """
+    view, title, author, download_link = row
+    sha256 = sink.sha256
+    filetype = sniff_extension(sink.header)
+    view_date = datastore.get_view_date(view) if layout == "date" else None
+    existing = datastore.get_filename_by_hash(sha256)
+
+    if existing is not None and (DOWNLOAD_PATH / existing).exists():
+        if duplicates == "skip":
+            log.info("Skipping %s, same content as %s", download_link, existing)
+            sink.abort()
+            datastore.save_filename(
+                view, existing, sha256=sha256, filetype=filetype, size=sink.size
             )
-            log.info("Renamed %s to %s", old_name, new_name)
+            return existing
+
+        filename = _build_filename(author, title, download_link, names, filetype, layout, view_date)
+        try:
+            filename = _link(existing, filename, names)
+        except OSError as err:
+            log.warning("Unable to hardlink %s to %s, keeping a copy: %s", filename, existing, err)
+            filename = _commit(sink, filename, names)
+        else:
+            log.info("Linked %s to %s, same content", filename, existing)
+            sink.abort()
+
+        datastore.save_filename(view, filename, sha256=sha256, filetype=filetype, size=sink.size)
+        return filename
+
+    filename = _build_filename(author, title, download_link, names, filetype, layout, view_date)
+    filename = _commit(sink, filename, names)
+    datastore.save_filename(view, filename, sha256=sha256, filetype=filetype, size=sink.size)
+    return filename
+
+
+def _commit(sink: FileSink, filename: str, names: FilenameIndex) -> str:
+    """
+    Commit a download under filename, returning the name it was placed under.
+
+    Another process sharing the download directory may have taken the name
+    since the index was seeded, the next free variant is used then.
+    """
+    _, basename = split_path(filename)
+    extension = f".{basename.rsplit('.', 1)[1]}" if "." in basename else ""
+    while "the name is taken":
+        try:
+            sink.commit(filename)
+            break
+        except FileExistsError:
+            taken, filename = filename, names.allocate(filename, extension)
+            log.info("%s was taken by another worker, using %s", taken, filename)
+    return filename
+
+
+def _link(existing: str, filename: str, names: FilenameIndex) -> str:
+    """
+    Hardlink filename to an existing download, returning the name it was placed under.
+
+    A name taken by another process since the index was seeded is replaced
+    by the next free variant, as when committing.
+    """
+    _, basename = split_path(filename)
+    extension = f".{basename.rsplit('.', 1)[1]}" if "." in basename else ""
+    (DOWNLOAD_PATH / filename).parent.mkdir(parents=True, exist_ok=True)
+    while "the name is taken":
+        try:
+            os.link(DOWNLOAD_PATH / existing, DOWNLOAD_PATH / filename)
+            break
+        except FileExistsError:
+            taken, filename = filename, names.allocate(filename, extension)
+            log.info("%s was taken by another worker, using %s", taken, filename)
+    return filename
+
+
+def _build_filename(
+    author: str,
+    title: str,
+    download_link: str,
+    names: FilenameIndex,
+    filetype: str | None = None,
+    layout: str = DEFAULT_LAYOUT,
+    view_date: str | None = None,
+) -> str:
+    """Build a unique, sanitized filename for a download, preferring the detected filetype."""
+    extension = _sanitize_filename(f'.{filetype or download_link.split(".")[-1]}')
+    filename = f"{author}-{title}{extension}"
+    filename = _sanitize_filename(filename)
+    directory = shard_directory(layout, filename, _sanitize_filename(author), view_date)
+    return names.allocate(join_path(directory, filename), extension)
+
+
+def _describe_error(err: Exception) -> str:
+    """Describe an error for the datastore, some httpx errors have no message."""
+    return f"{type(err).__name__}: {err}" if str(err) else type(err).__name__
+
+
+def _remove_empty_directories(directory: Path) -> None:
+    """Remove empty subdirectories left behind below directory."""
+    for dirpath, _, _ in sorted(os.walk(directory), reverse=True):
+        if Path(dirpath) != directory:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+
+
+def _looks_like_text(header: bytes) -> bool:
+    """Guess if the leading bytes of a file are plain UTF-8 text."""
+    if not header:
+        return False
+
+    try:
+        # A multibyte character may be cut off at the end of the header
+        text = header.decode("utf-8", errors="strict")
+    except UnicodeDecodeError as err:
+        if err.start < len(header) - 3:
+            return False
+        text = header[: err.start].decode("utf-8")
+
+    return all(char.isprintable() or char in "\t\n\r\f" for char in text)
 
 
 def _sanitize_filename(filename: str) -> str:
@@ -210,42 +588,525 @@ def _sanitize_filename(filename: str) -> str:
     return re.sub(r"_-_", "-", filename).lower()
 
 
-def _uniquify_filename(filename: str, extention: str) -> str:
-    """Ensure filename is unique."""
-    postfix = 0
-    unique_name = filename
-    while (DOWNLOAD_PATH / unique_name).exists():
-        postfix += 1
-        unique_name = f"{filename.removesuffix(extention)}-{postfix:04d}{extention}"
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="fadownload",
+        description=__doc__.splitlines()[1],
+        fromfile_prefix_chars="@",
+    )
+    parser.add_argument(
+        "usernames",
+        nargs="*",
+        metavar="username",
+        help="FurAffinity usernames to collect favorites of, or @file with one per line. "
+        "Required by --watch and --pipeline",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Scan every favorites page instead of stopping at already known favorites",
+    )
+    parser.add_argument(
+        "--known-pages",
+        type=int,
+        default=KNOWN_PAGES_BEFORE_STOP,
+        help="Stop scanning after this many pages without new favorites (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Collect download links and download files concurrently",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Scan, collect download links, and download in one overlapping async run",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Run scan, download, and file type detection unattended on an interval",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=WATCH_INTERVAL,
+        help="Seconds between the start of sync cycles in watch mode (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=WATCH_JITTER,
+        help="Random seconds added to or taken from the interval (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKER_COUNT,
+        help="Number of concurrent workers in async mode (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--site-concurrency",
+        type=int,
+        default=SITE_CONCURRENCY,
+        help="Concurrent page requests to the site in async mode (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cdn-concurrency",
+        type=int,
+        default=CDN_CONCURRENCY,
+        help="Concurrent file downloads from the CDN in async mode (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--http2",
+        action=argparse.BooleanOptionalAction,
+        default=HTTP2_AVAILABLE,
+        help="Multiplex requests over HTTP/2, needs the http2 extra (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--site-connections",
+        type=int,
+        default=SITE_POOL.max_connections,
+        help="Size of the connection pool to the site (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cdn-connections",
+        type=int,
+        default=CDN_POOL.max_connections,
+        help="Size of the connection pool to the file CDN (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--keepalive-expiry",
+        type=float,
+        help="Seconds idle connections are kept open for reuse "
+        f"(default: {SITE_POOL.keepalive_expiry})",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        help=f"Seconds to wait for a connection (default: {SITE_POOL.connect_timeout})",
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        help="Seconds to wait for data, site and CDN "
+        f"(default: {SITE_POOL.read_timeout} and {CDN_POOL.read_timeout})",
+    )
+    parser.add_argument(
+        "--page-cache",
+        nargs="?",
+        const=PAGE_CACHE_FILE,
+        metavar="FILE",
+        help=f"Cache pages on disk, revalidating them on later runs (default: {PAGE_CACHE_FILE})",
+    )
+    parser.add_argument(
+        "--page-cache-size",
+        type=int,
+        default=MAX_BYTES // (1024 * 1024),
+        help="Size of the page cache in MiB (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--page-cache-ttl",
+        type=float,
+        default=TTL_SECONDS,
+        help="Seconds a cached view page is used without revalidating (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        metavar="FILE",
+        help="Write run metrics to FILE, in the Prometheus text format if it ends in .prom "
+        "and as JSON otherwise",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=WRITE_INTERVAL,
+        help="Seconds between metrics snapshots (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--export-format",
+        choices=EXPORT_FORMATS,
+        default="csv",
+        help=f"Format of the {EXPORT_FILE}.* export (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--incremental-export",
+        action="store_true",
+        help="Append only the rows changed since the last export instead of rewriting it",
+    )
+    parser.add_argument(
+        "--snapshot",
+        metavar="FILE",
+        help="Copy the database to FILE with SQLite's online backup API on exit",
+    )
+    parser.add_argument(
+        "--duplicates",
+        choices=DUPLICATE_MODES,
+        default=DUPLICATE_MODE,
+        help="Hardlink or skip files whose content was already downloaded (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default=DEFAULT_LAYOUT,
+        help="Directory layout of new downloads (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--migrate-layout",
+        action="store_true",
+        help="Move existing downloads into the directory layout set by --layout and exit",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check downloaded files for damage, queue damaged or missing ones again, and exit",
+    )
+    parser.add_argument(
+        "--verify-workers",
+        type=int,
+        default=None,
+        help="Processes checking files with --verify (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--bandwidth-limit",
+        type=_argument(parse_rate),
+        default=None,
+        metavar="RATE",
+        help="Cap on the bytes per second of all downloads together, like 500K or 2M "
+        "(default: unlimited)",
+    )
+    parser.add_argument(
+        "--bandwidth-schedule",
+        type=_argument(parse_window),
+        action="append",
+        default=[],
+        metavar="HH:MM-HH:MM=RATE",
+        help="Bandwidth cap during a daily window of local time, overriding --bandwidth-limit. "
+        "RATE may be 'unlimited'. Repeat for more windows, the first matching one applies",
+    )
+    parser.add_argument(
+        "--worker-id",
+        default=None,
+        help="Name claiming rows of the database for this process when several share it "
+        "(default: host name and process id)",
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=LEASE_SECONDS,
+        help="Seconds claimed rows stay with this process unless renewed, after which other "
+        "processes may take them over (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help="Bytes read per chunk when streaming downloads to disk (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+    if args.watch and (args.use_async or args.pipeline):
+        parser.error(
+            "--watch runs the blocking stages and can't be combined with --async or --pipeline"
+        )
+    if not args.usernames and (args.watch or args.pipeline):
+        parser.error("--watch and --pipeline scan favorites, give at least one username")
+    if args.full:
+        args.known_pages = None
+    return args
 
-    return unique_name
+
+def _argument(parse: Callable[[str], Any]) -> Callable[[str], Any]:
+    """Wrap a parser of an option value, reporting its errors as argparse ones."""
+
+    def parse_argument(value: str) -> Any:
+        try:
+            return parse(value)
+        except ValueError as err:
+            raise argparse.ArgumentTypeError(str(err)) from err
+
+    return parse_argument
 
 
 def main(database: str = "fa_download.db") -> int:
     """Main entry point for the script."""
     logging.basicConfig(level="INFO")
-    if len(sys.argv) < 2:
-        logging.error("Usage: fadownload [FA_USERNAME]")
-        return 1
-    username = sys.argv[1]
-    datastore = Datastore(database)
-    http_client = httpx.Client(headers=build_headers(get_cookie(COOKIE_FILE)))
+    args = parse_args()
+
+    datastore = Datastore(
+        database,
+        batch_size=WRITE_BATCH_SIZE,
+        worker_id=args.worker_id,
+        lease_seconds=args.lease_seconds,
+    )
+    with _metrics_writer(args), datastore:
+        if args.migrate_layout:
+            migrate_layout(datastore, args.layout)
+        elif args.verify:
+            from .verify import verify_library
+
+            verify_library(datastore, DOWNLOAD_PATH, workers=args.verify_workers)
+        else:
+            with _page_cache(args) as cache:
+                if args.watch:
+                    _run_watch(args, datastore, cache)
+                else:
+                    _run_interactive(args, datastore, cache)
+
+    return 0
+
 
-    if input("Scan for new favorites? [y/N] ").lower() == "y":
-        save_view_links(username, http_client, datastore)
+def _export(args: argparse.Namespace, datastore: Datastore) -> None:
+    """Export the datastore, and write a snapshot of it, as set on the command line."""
+    filename = f"{EXPORT_FILE}.{args.export_format}"
+    written = datastore.export(
+        filename,
+        export_format=args.export_format,
+        incremental=args.incremental_export,
+    )
+    log.info("Exported %d rows to %s", written, filename)
+
+    if args.snapshot:
+        datastore.backup(args.snapshot)
+        log.info("Wrote a snapshot of the database to %s", args.snapshot)
+
+
+@contextmanager
+def _metrics_writer(args: argparse.Namespace) -> Iterator[None]:
+    """Write metrics to the file set on the command line, if any, periodically and on exit."""
+    if args.metrics is None:
+        yield None
+        return
+
+    with MetricsWriter(args.metrics, interval=args.metrics_interval):
+        yield None
+
+
+@contextmanager
+def _page_cache(args: argparse.Namespace) -> Iterator[PageCache | None]:
+    """Open the page cache set on the command line, if any, and report its hit rate on exit."""
+    if args.page_cache is None:
+        yield None
+        return
+
+    cache = PageCache(
+        args.page_cache,
+        max_bytes=args.page_cache_size * 1024 * 1024,
+        ttl=args.page_cache_ttl,
+    )
+    try:
+        yield cache
+    finally:
+        cache.log_stats()
+        cache.close()
 
-    if input("Collect missing download links? [y/N] ").lower() == "y":
-        save_download_links(http_client, datastore)
 
-    if input("Download missing files? [y/N] ").lower() == "y":
-        download_favorite_files(http_client, datastore)
+def _run_interactive(
+    args: argparse.Namespace,
+    datastore: Datastore,
+    cache: PageCache | None = None,
+) -> None:
+    """Prompt for and run each stage against the datastore."""
+    headers = build_headers(get_cookie(COOKIE_FILE))
+    limiter = AdaptiveRateLimiter()
+    bandwidth = _bandwidth_limiter(args)
+    http_client = _build_client(args, headers, limiter, cache, bandwidth)
+
+    if args.pipeline:
+        _run_async_stage(
+            "pipeline",
+            args,
+            headers,
+            datastore,
+            limiter,
+            cache,
+            bandwidth,
+            usernames=args.usernames,
+            known_pages=args.known_pages,
+            chunk_size=args.chunk_size,
+            duplicates=args.duplicates,
+            layout=args.layout,
+        )
 
-    if input("Correct file extensions of downloaded files? [y/N]").lower() == "y":
+    else:
+        if not args.usernames:
+            log.info("No usernames given, skipping the favorites scan.")
+        elif input("Scan for new favorites? [y/N] ").lower() == "y":
+            for username in args.usernames:
+                save_view_links(username, http_client, datastore, known_pages=args.known_pages)
+
+        if input("Collect missing download links? [y/N] ").lower() == "y":
+            if args.use_async:
+                _run_async_stage(
+                    "save_download_links", args, headers, datastore, limiter, cache, bandwidth
+                )
+            else:
+                save_download_links(http_client, datastore)
+
+        if input("Download missing files? [y/N] ").lower() == "y":
+            if args.use_async:
+                _run_async_stage(
+                    "download_favorite_files",
+                    args,
+                    headers,
+                    datastore,
+                    limiter,
+                    cache,
+                    bandwidth,
+                    chunk_size=args.chunk_size,
+                    duplicates=args.duplicates,
+                    layout=args.layout,
+                )
+            else:
+                download_favorite_files(
+                    http_client,
+                    datastore,
+                    chunk_size=args.chunk_size,
+                    duplicates=args.duplicates,
+                    layout=args.layout,
+                )
+
+    if input("Detect file types of downloads with an unknown type? [y/N]").lower() == "y":
         correct_file_extensions(datastore)
 
-    datastore.export_as_csv("fa_download.csv")
+    _export(args, datastore)
 
-    return 0
+
+def _run_watch(
+    args: argparse.Namespace,
+    datastore: Datastore,
+    cache: PageCache | None = None,
+) -> None:
+    """Run every stage unattended on an interval until stopped by a signal."""
+    headers = build_headers(get_cookie(COOKIE_FILE))
+    http_client = _build_client(
+        args, headers, AdaptiveRateLimiter(), cache, _bandwidth_limiter(args)
+    )
+
+    # Kept up to date by the stages, so the library is only scanned once
+    names = FilenameIndex.from_datastore(datastore, DOWNLOAD_PATH)
+
+    with http_client, StopSignal() as stop:
+
+        def cycle() -> None:
+            stages: list[Callable[[], None]] = [
+                *(
+                    functools.partial(
+                        save_view_links,
+                        username,
+                        http_client,
+                        datastore,
+                        known_pages=args.known_pages,
+                        stop=stop.event,
+                    )
+                    for username in args.usernames
+                ),
+                functools.partial(save_download_links, http_client, datastore, stop=stop.event),
+                functools.partial(
+                    download_favorite_files,
+                    http_client,
+                    datastore,
+                    chunk_size=args.chunk_size,
+                    duplicates=args.duplicates,
+                    layout=args.layout,
+                    stop=stop.event,
+                    names=names,
+                ),
+                functools.partial(correct_file_extensions, datastore, stop=stop.event, names=names),
+            ]
+            try:
+                for stage in stages:
+                    if stop.is_set():
+                        break
+                    stage()
+            finally:
+                # Nothing is written while sleeping, so pending updates would wait
+                datastore.flush()
+
+        cycles = watch(cycle, stop.event, interval=args.interval, jitter=args.jitter)
+
+    log.info("Stopped watching after %d sync cycles.", cycles)
+    _export(args, datastore)
+
+
+def _build_client(
+    args: argparse.Namespace,
+    headers: dict[str, str],
+    limiter: AdaptiveRateLimiter,
+    cache: PageCache | None = None,
+    bandwidth: BandwidthLimiter | None = None,
+) -> httpx.Client:
+    """Build the HTTP client with the connection pools set on the command line."""
+    site_pool, cdn_pool = _pool_configs(args)
+    return build_client(
+        headers,
+        limiter,
+        pools={SITE_HOST: site_pool},
+        default_pool=cdn_pool,
+        http2=args.http2,
+        cache=cache,
+        bandwidth=bandwidth,
+    )
+
+
+def _bandwidth_limiter(args: argparse.Namespace) -> BandwidthLimiter | None:
+    """Return the limiter of the bandwidth cap set on the command line, if any."""
+    if args.bandwidth_limit is None and not args.bandwidth_schedule:
+        return None
+    return BandwidthLimiter(args.bandwidth_limit, schedule=args.bandwidth_schedule)
+
+
+def _run_async_stage(
+    stage_name: str,
+    args: argparse.Namespace,
+    headers: dict[str, str],
+    datastore: Datastore,
+    limiter: AdaptiveRateLimiter,
+    cache: PageCache | None = None,
+    bandwidth: BandwidthLimiter | None = None,
+    **stage_kwargs: Any,
+) -> None:
+    """Run the named stage of the async engine with the configured limits."""
+    # Imported here as the async engine builds on the helpers of this module
+    from . import asyncdownloader
+    from . import pipeline
+
+    stages: dict[str, Callable[..., Awaitable[None]]] = {
+        "save_download_links": asyncdownloader.save_download_links,
+        "download_favorite_files": asyncdownloader.download_favorite_files,
+        "pipeline": pipeline.run_pipeline,
+    }
+    site_pool, cdn_pool = _pool_configs(args)
+
+    asyncdownloader.run_stage(
+        stages[stage_name],
+        headers,
+        datastore,
+        workers=args.workers,
+        site_concurrency=args.site_concurrency,
+        cdn_concurrency=args.cdn_concurrency,
+        limiter=limiter,
+        site_pool=site_pool,
+        cdn_pool=cdn_pool,
+        http2=args.http2,
+        cache=cache,
+        bandwidth=bandwidth,
+        **stage_kwargs,
+    )
+
+
+def _pool_configs(args: argparse.Namespace) -> tuple[PoolConfig, PoolConfig]:
+    """Return the site and CDN connection pool configurations set on the command line."""
+    overrides = {
+        field: getattr(args, field)
+        for field in ("keepalive_expiry", "connect_timeout", "read_timeout")
+        if getattr(args, field) is not None
+    }
+    site_pool = SITE_POOL._replace(max_connections=args.site_connections, **overrides)
+    cdn_pool = CDN_POOL._replace(max_connections=args.cdn_connections, **overrides)
+    return site_pool, cdn_pool
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+"""Hand out unique filenames in the download directory without touching the disk."""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+from collections.abc import Iterable
+from collections.abc import Iterator
+from pathlib import Path
+
+from .datastore import Datastore
+
+_POSTFIXED = re.compile(r"^(?P<stem>.+)-(?P<postfix>\d{4})(?P<extension>\.[^.]*)?$")
+
+
+class FilenameIndex:
+    """
+    In-process index of taken filenames with the next free postfix per stem.
+
+    Seed it once from the datastore and the download directory, after which
+    allocating a unique name is a set lookup. Allocation is guarded by a
+    lock, so concurrent workers are never handed the same name.
+    """
+
+    def __init__(self, taken: Iterable[str] = ()) -> None:
+        """Provide the filenames already in use."""
+        self._taken: set[str] = set()
+        self._next_postfix: dict[tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        for filename in taken:
+            self._add(filename)
+
+    @classmethod
+    def from_datastore(cls, datastore: Datastore, directory: Path) -> FilenameIndex:
+        """Seed an index from the filenames in datastore and a scan of directory."""
+        index = cls(datastore.iter_filenames())
+        for filename in _scan_directory(directory):
+            index._add(filename)
+        return index
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self._taken
+
+    def allocate(self, filename: str, extension: str) -> str:
+        """Reserve and return filename, or the first free postfixed variant of it."""
+        with self._lock:
+            stem = filename.removesuffix(extension)
+            key = (stem, extension)
+            unique_name = filename
+            postfix = self._next_postfix.get(key, 1)
+
+            while unique_name in self._taken:
+                unique_name = f"{stem}-{postfix:04d}{extension}"
+                postfix += 1
+
+            if unique_name != filename:
+                self._next_postfix[key] = postfix
+
+            self._taken.add(unique_name)
+            return unique_name
+
+    def rename(self, old_name: str, new_name: str) -> None:
+        """Record that a file has been renamed."""
+        with self._lock:
+            self._taken.discard(old_name)
+            self._add(new_name)
+
+    def _add(self, filename: str) -> None:
+        """Mark filename as taken, moving the postfix counter of its stem past it."""
+        self._taken.add(filename)
+
+        match = _POSTFIXED.match(filename)
+        if match is not None:
+            key = (match["stem"], match["extension"] or "")
+            postfix = int(match["postfix"]) + 1
+            self._next_postfix[key] = max(self._next_postfix.get(key, 1), postfix)
+
+
+def _scan_directory(directory: Path, prefix: str = "") -> Iterator[str]:
+    """Yield the paths, relative to directory and separated by "/", of all files below it."""
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _scan_directory(Path(entry.path), f"{prefix}{entry.name}/")
+        else:
+            yield f"{prefix}{entry.name}"
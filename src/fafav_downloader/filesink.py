@@ -0,0 +1,151 @@
+"""Write streamed downloads to disk without holding them in memory."""
+
+from __future__ import annotations
+
+import errno
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from types import TracebackType
+from typing import BinaryIO
+
+from .metrics import METRICS
+
+# Leading bytes of a download kept for file type detection
+SNIFF_LENGTH = 64
+
+# Bytes read per chunk when rehashing the kept part of a resumed file
+RESUME_READ_SIZE = 1024 * 1024
+
+
+class FileSink:
+    """
+    Write a streamed download to a temporary file in the target directory.
+
+    The file is only moved to its final name by `commit()` once the body is
+    complete. Leaving the context without committing removes the temporary
+    file, so an interrupted download never appears as a finished file. A
+    SHA-256 of the content is computed while it is written and the leading
+    bytes are kept in `header` for file type detection.
+
+    Given a `part_name`, the temporary file has that name instead of a random
+    one and the first `offset` bytes of an earlier attempt are kept. Leaving
+    the context on an error then keeps the file, so it can be resumed.
+    """
+
+    def __init__(self, directory: Path, part_name: str | None = None, offset: int = 0) -> None:
+        """Provide the directory the finished file will be placed in."""
+        self.directory = directory
+        self.size = 0
+        self.header = b""
+        self._hash = hashlib.sha256()
+        self.resumable = part_name is not None
+        self.closed = False
+
+        self._file: BinaryIO
+        if part_name is None:
+            fd, name = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+            self.temp_path = Path(name)
+            self._file = os.fdopen(fd, "wb")
+        else:
+            self.temp_path = directory / part_name
+            self._file = open(self.temp_path, "a+b")
+            self._keep(offset)
+
+    def __enter__(self) -> FileSink:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if self.closed:
+            return
+        if exc_type is not None and self.resumable:
+            self.suspend()
+        else:
+            self.abort()
+
+    def write(self, chunk: bytes) -> None:
+        """Append a chunk of the body to the temporary file."""
+        self._file.write(chunk)
+        self._update(chunk)
+        METRICS.inc("download_bytes_total", len(chunk))
+
+    @property
+    def sha256(self) -> str:
+        """Hex digest of the content written so far."""
+        return self._hash.hexdigest()
+
+    def commit(self, filename: str) -> Path:
+        """
+        Atomically move the completed file to its final name, relative to the directory.
+
+        An existing file is never replaced, as another process sharing the
+        directory may have just placed it. FileExistsError is raised instead
+        and the file can be committed under another name.
+        """
+        self._file.close()
+        target = self.directory / filename
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            # Linking fails if the name is taken, where a rename would replace it
+            os.link(self.temp_path, target)
+        except FileExistsError:
+            raise
+        except OSError:
+            # Filesystems without hardlinks can only check before moving
+            if target.exists():
+                raise FileExistsError(errno.EEXIST, "File exists", str(target)) from None
+            os.replace(self.temp_path, target)
+        else:
+            self.temp_path.unlink()
+        self.closed = True
+        return target
+
+    def abort(self) -> None:
+        """Discard the temporary file."""
+        self._file.close()
+        self.temp_path.unlink(missing_ok=True)
+        self.closed = True
+
+    def sync(self) -> None:
+        """Make sure everything written so far is on disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def suspend(self) -> None:
+        """Close the temporary file, keeping it on disk for a later attempt."""
+        self.sync()
+        self._file.close()
+        self.closed = True
+
+    def restart(self) -> None:
+        """Throw away everything written, starting the file over."""
+        self._file.truncate(0)
+        self.size = 0
+        self.header = b""
+        self._hash = hashlib.sha256()
+
+    def _keep(self, offset: int) -> None:
+        """Keep up to offset bytes already in the file, hashing them, and drop the rest."""
+        self._file.seek(0)
+        while self.size < offset:
+            chunk = self._file.read(min(offset - self.size, RESUME_READ_SIZE))
+            if not chunk:
+                break
+            self._update(chunk)
+
+        # Only truncate when needed, ext4 flushes files truncated to zero on close
+        if os.fstat(self._file.fileno()).st_size > self.size:
+            self._file.truncate(self.size)
+
+    def _update(self, chunk: bytes) -> None:
+        """Account for a chunk of the content in the hash, header, and size."""
+        self._hash.update(chunk)
+        if len(self.header) < SNIFF_LENGTH:
+            self.header += chunk[: SNIFF_LENGTH - len(self.header)]
+        self.size += len(chunk)
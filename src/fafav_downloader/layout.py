@@ -0,0 +1,63 @@
+"""
+Directory layouts of the download library.
+
+A layout places each file in a subdirectory of the download path so no
+single directory grows to tens of thousands of entries. Filenames saved to
+the datastore are paths relative to the download path, always separated by
+"/", so a library can be moved between layouts without losing track of it.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+
+LAYOUTS = ("flat", "author", "hash", "date")
+DEFAULT_LAYOUT = "flat"
+
+# Fallback directory of files whose author or date is missing
+UNKNOWN_DIRECTORY = "unknown"
+
+# Postfix added to a basename that is already taken, as in "author-title-0001.png"
+_POSTFIX = re.compile(r"-\d{4}(?=\.[^.]*$|$)")
+
+
+def shard_directory(layout: str, basename: str, author: str, view_date: str | None) -> str:
+    """
+    Return the directory, relative to the download path, a file belongs in.
+
+    "flat" keeps every file at the top level, "author" groups files by the
+    sanitized author, "hash" spreads them over two levels named after the
+    hash of their basename without any postfix ("ab/cd"), and "date" groups
+    them by the year and month their view was first saved ("2024/05").
+    """
+    if layout == "flat":
+        return ""
+
+    if layout == "author":
+        return author or UNKNOWN_DIRECTORY
+
+    if layout == "hash":
+        # Files postfixed to a unique name share the directory of the first
+        digest = hashlib.sha256(_POSTFIX.sub("", basename).encode("utf-8")).hexdigest()
+        return f"{digest[:2]}/{digest[2:4]}"
+
+    if layout == "date":
+        # Dates are stored as "YYYY-MM-DD HH:MM:SS+00:00"
+        year, _, month = (view_date or "")[:7].partition("-")
+        if not (year.isdigit() and month.isdigit()):
+            return UNKNOWN_DIRECTORY
+        return f"{year}/{month}"
+
+    raise ValueError(f"Unknown layout {layout!r}, expected one of {', '.join(LAYOUTS)}")
+
+
+def join_path(directory: str, basename: str) -> str:
+    """Join a layout directory and a basename into a relative filename."""
+    return f"{directory}/{basename}" if directory else basename
+
+
+def split_path(filename: str) -> tuple[str, str]:
+    """Split a relative filename into its layout directory and basename."""
+    directory, _, basename = filename.rpartition("/")
+    return directory, basename
@@ -0,0 +1,290 @@
+"""
+Counters and latency histograms for every stage of a run.
+
+Instrumented code records into the process wide `METRICS` registry. A
+`MetricsWriter` snapshots the registry to a file periodically and on exit,
+as a Prometheus textfile (for the node exporter textfile collector) when
+the file ends in ".prom" and as JSON otherwise. `Progress` turns stage
+counts into live items/s and ETA for the progress logs.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+PREFIX = "fadownload"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+WRITE_INTERVAL = 15.0
+
+_Key = tuple[str, tuple[tuple[str, str], ...]]
+
+log = logging.getLogger()
+
+
+class _Histogram:
+    """Cumulative bucket counts, sum, and count of observed values."""
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """Return (upper bound, count of values at or below it) pairs, ending with +Inf."""
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        running = 0
+        pairs = []
+        for bound, count in zip(bounds, self.counts):
+            running += count
+            pairs.append((bound, running))
+        return pairs
+
+
+class Metrics:
+    """Thread safe registry of labelled counters and histograms."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """Provide the upper bounds of histogram buckets."""
+        self.buckets = buckets
+        self._counters: dict[_Key, float] = {}
+        self._histograms: dict[_Key, _Histogram] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Add value to a counter."""
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Record a value, usually seconds, in a histogram."""
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = _Histogram(self.buckets)
+            self._histograms[key].observe(value)
+
+    def timer(self, name: str, **labels: str) -> _Timer:
+        """Return a context manager observing the seconds spent inside it."""
+        return _Timer(self, name, labels)
+
+    def value(self, name: str, **labels: str) -> float:
+        """Return the current value of a counter."""
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def reset(self) -> None:
+        """Forget everything recorded."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return everything recorded as a JSON serializable dict."""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "buckets": dict(histogram.cumulative()),
+                    "sum": histogram.sum,
+                    "count": histogram.count,
+                }
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+        return {"timestamp": time.time(), "counters": counters, "histograms": histograms}
+
+    def to_json(self) -> str:
+        """Render a snapshot as JSON."""
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Render a snapshot in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines: list[str] = []
+        typed: set[str] = set()
+
+        for counter in snapshot["counters"]:
+            name = f"{PREFIX}_{counter['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(counter['labels'])} {counter['value']}")
+
+        for histogram in snapshot["histograms"]:
+            name = f"{PREFIX}_{histogram['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            labels = histogram["labels"]
+            for bound, count in histogram["buckets"].items():
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    """Observe the seconds spent in a block into a histogram."""
+
+    def __init__(self, metrics: Metrics, name: str, labels: dict[str, str]) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self) -> _Timer:
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+
+
+METRICS = Metrics()
+
+
+class MetricsWriter:
+    """
+    Write snapshots of a registry to a file every `interval` seconds and on exit.
+
+    Files ending in ".prom" are written in the Prometheus text format, any
+    other file as JSON. Each snapshot replaces the file atomically, so
+    readers never see a partial one.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        metrics: Metrics = METRICS,
+        interval: float = WRITE_INTERVAL,
+    ) -> None:
+        """Provide the file to write and the seconds between snapshots."""
+        self.path = path
+        self.metrics = metrics
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+
+    def __enter__(self) -> MetricsWriter:
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+    def write(self) -> None:
+        """Write a snapshot of the registry now."""
+        if self.path.suffix == ".prom":
+            content = self.metrics.to_prometheus()
+        else:
+            content = self.metrics.to_json()
+
+        fd, name = tempfile.mkstemp(dir=self.path.parent, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as outfile:
+                outfile.write(content)
+            os.replace(name, self.path)
+        except OSError:
+            Path(name).unlink(missing_ok=True)
+            raise
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as err:
+                log.error("Unable to write metrics to %s: %s", self.path, err)
+
+
+class Progress:
+    """Count the items of a stage, rendering live items/s and ETA for progress logs."""
+
+    def __init__(
+        self,
+        stage: str,
+        total: int | None = None,
+        metrics: Metrics = METRICS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Provide the stage name and its number of items, if known."""
+        self.stage = stage
+        self.total = total
+        self.metrics = metrics
+        self._clock = clock
+        self.started = clock()
+        self.done = 0
+
+    def advance(self) -> str:
+        """Count an item started, returning its progress like "(3 / 10, 1.5/s, ETA 5s)"."""
+        self.done += 1
+        self.metrics.inc("stage_items_total", stage=self.stage)
+
+        elapsed = self._clock() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        if self.total is None:
+            return f"({self.done}, {rate:.1f}/s)"
+
+        if rate > 0:
+            eta = _format_seconds((self.total - self.done) / rate)
+        else:
+            eta = "?"
+        return f"({self.done} / {self.total}, {rate:.1f}/s, ETA {eta})"
+
+
+def _key(name: str, labels: dict[str, str]) -> _Key:
+    return name, tuple(sorted(labels.items()))
+
+
+def _labels(labels: dict[str, str]) -> str:
+    """Render labels as {name="value",...} with Prometheus escaping."""
+    if not labels:
+        return ""
+    rendered = ",".join(
+        '{}="{}"'.format(name, value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels.items()
+    )
+    return "{" + rendered + "}"
+
+
+def _format_seconds(seconds: float) -> str:
+    """Format a duration as 1h02m, 3m05s, or 7s."""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
@@ -0,0 +1,287 @@
+"""
+On-disk cache of HTML pages with conditional revalidation.
+
+Pages are stored zlib compressed in an SQLite database keyed by URL, along
+with their ETag and Last-Modified validators. A page younger than the TTL
+is served from disk. An older page, or one whose path always needs
+revalidating such as the favorites lists, is requested again with
+If-None-Match / If-Modified-Since so an unchanged page costs a 304 instead
+of a full transfer. The cache is bounded in size by evicting the least
+recently used pages. Caching is applied by wrapping the httpx transport.
+"""
+
+from __future__ import annotations
+
+import logging
+import sqlite3
+import time
+import zlib
+from collections.abc import Callable
+from typing import NamedTuple
+
+import httpx
+
+from .metrics import METRICS
+
+PAGE_CACHE_FILE = "fa_cache.db"
+MAX_BYTES = 64 * 1024 * 1024
+TTL_SECONDS = 24 * 60 * 60
+
+# Paths of pages that change without their URL changing, always revalidated
+ALWAYS_REVALIDATE = ("/favorites/",)
+
+CACHE_SQL = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    CREATE TABLE IF NOT EXISTS pages (
+        url TEXT PRIMARY KEY,
+        body BLOB NOT NULL,
+        content_type TEXT NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        stored_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        size INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS lru on pages(accessed_at);
+"""
+
+log = logging.getLogger()
+
+
+class CacheEntry(NamedTuple):
+    """A cached page with its validators."""
+
+    body: bytes
+    content_type: str
+    etag: str | None
+    last_modified: str | None
+    stored_at: float
+
+
+class PageCache:
+    """
+    Size bounded SQLite store of HTML pages keyed by URL.
+
+    Counts fresh hits, revalidated hits, and full transfers for `hit_rate()`.
+    """
+
+    def __init__(
+        self,
+        database: str = ":memory:",
+        *,
+        max_bytes: int = MAX_BYTES,
+        ttl: float = TTL_SECONDS,
+        always_revalidate: tuple[str, ...] = ALWAYS_REVALIDATE,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """Provide a cache database file, the size bound in bytes, and the TTL in seconds."""
+        self._dbconn = sqlite3.connect(database)
+        self._dbconn.executescript(CACHE_SQL)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.always_revalidate = always_revalidate
+        self._clock = clock
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def close(self) -> None:
+        """Close the cache database."""
+        self._dbconn.close()
+
+    def get(self, url: str) -> CacheEntry | None:
+        """Return the cached page of url, marking it as recently used."""
+        row = self._dbconn.execute(
+            "SELECT body, content_type, etag, last_modified, stored_at FROM pages WHERE url=?",
+            (url,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        with self._dbconn:
+            self._dbconn.execute("UPDATE pages SET accessed_at=? WHERE url=?", (self._clock(), url))
+
+        body, content_type, etag, last_modified, stored_at = row
+        return CacheEntry(zlib.decompress(body), content_type, etag, last_modified, stored_at)
+
+    def is_fresh(self, url: str, entry: CacheEntry) -> bool:
+        """Return True if entry may be served without asking the server."""
+        if httpx.URL(url).path.startswith(self.always_revalidate):
+            return False
+        return self._clock() - entry.stored_at < self.ttl
+
+    def store(self, url: str, headers: httpx.Headers, body: bytes) -> None:
+        """Cache the body of a page, evicting least recently used pages over the size bound."""
+        compressed = zlib.compress(body)
+        now = self._clock()
+        with self._dbconn:
+            self._dbconn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    compressed,
+                    headers.get("content-type", "text/html"),
+                    headers.get("etag"),
+                    headers.get("last-modified"),
+                    now,
+                    now,
+                    len(compressed),
+                ),
+            )
+            self._evict()
+
+    def refresh(self, url: str, headers: httpx.Headers) -> None:
+        """Mark a page as revalidated, taking any new validators of the 304 response."""
+        with self._dbconn:
+            self._dbconn.execute(
+                "UPDATE pages SET stored_at=?, etag=COALESCE(?, etag), "
+                "last_modified=COALESCE(?, last_modified) WHERE url=?",
+                (self._clock(), headers.get("etag"), headers.get("last-modified"), url),
+            )
+
+    def hit_rate(self) -> float:
+        """Return the share of requests answered without a full transfer."""
+        total = self.hits + self.revalidated + self.misses
+        return (self.hits + self.revalidated) / total if total else 0.0
+
+    def log_stats(self) -> None:
+        """Log the hit rate of the cache."""
+        log.info(
+            "Page cache: %d fresh hits, %d revalidated, %d transfers (%.0f%% hit rate)",
+            self.hits,
+            self.revalidated,
+            self.misses,
+            self.hit_rate() * 100,
+        )
+
+    def _evict(self) -> None:
+        """Remove least recently used pages until the cache fits its size bound."""
+        (total,) = self._dbconn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()
+        if total <= self.max_bytes:
+            return
+
+        rows = self._dbconn.execute("SELECT url, size FROM pages ORDER BY accessed_at")
+        evict = []
+        for url, size in rows:
+            if total <= self.max_bytes:
+                break
+            evict.append((url,))
+            total -= size
+
+        self._dbconn.executemany("DELETE FROM pages WHERE url=?", evict)
+
+
+class CachingTransport(httpx.BaseTransport):
+    """Answer GET requests for pages from a cache, revalidating stale pages."""
+
+    def __init__(self, transport: httpx.BaseTransport, cache: PageCache) -> None:
+        self.transport = transport
+        self.cache = cache
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "GET":
+            return self.transport.handle_request(request)
+
+        url = str(request.url)
+        entry = self.cache.get(url)
+        if entry is not None and self.cache.is_fresh(url, entry):
+            self.cache.hits += 1
+            METRICS.inc("page_cache_requests_total", result="hit")
+            return _cached_response(entry)
+
+        _add_validators(request, entry)
+        response = self.transport.handle_request(request)
+
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            self.cache.refresh(url, response.headers)
+            self.cache.revalidated += 1
+            METRICS.inc("page_cache_requests_total", result="revalidated")
+            return _cached_response(entry)
+
+        self.cache.misses += 1
+        METRICS.inc("page_cache_requests_total", result="transfer")
+        if not _is_cacheable(response):
+            return response
+
+        body = response.read()
+        response.close()
+        self.cache.store(url, response.headers, body)
+        return _decoded_response(response, body)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncCachingTransport(httpx.AsyncBaseTransport):
+    """Answer async GET requests for pages from a cache, revalidating stale pages."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, cache: PageCache) -> None:
+        self.transport = transport
+        self.cache = cache
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "GET":
+            return await self.transport.handle_async_request(request)
+
+        url = str(request.url)
+        entry = self.cache.get(url)
+        if entry is not None and self.cache.is_fresh(url, entry):
+            self.cache.hits += 1
+            METRICS.inc("page_cache_requests_total", result="hit")
+            return _cached_response(entry)
+
+        _add_validators(request, entry)
+        response = await self.transport.handle_async_request(request)
+
+        if response.status_code == 304 and entry is not None:
+            await response.aclose()
+            self.cache.refresh(url, response.headers)
+            self.cache.revalidated += 1
+            METRICS.inc("page_cache_requests_total", result="revalidated")
+            return _cached_response(entry)
+
+        self.cache.misses += 1
+        METRICS.inc("page_cache_requests_total", result="transfer")
+        if not _is_cacheable(response):
+            return response
+
+        body = await response.aread()
+        await response.aclose()
+        self.cache.store(url, response.headers, body)
+        return _decoded_response(response, body)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def _add_validators(request: httpx.Request, entry: CacheEntry | None) -> None:
+    """Make request conditional on the validators of a cached page."""
+    if entry is None:
+        return
+    if entry.etag and "if-none-match" not in request.headers:
+        request.headers["if-none-match"] = entry.etag
+    if entry.last_modified and "if-modified-since" not in request.headers:
+        request.headers["if-modified-since"] = entry.last_modified
+
+
+def _is_cacheable(response: httpx.Response) -> bool:
+    """Return True for successful HTML responses."""
+    content_type = response.headers.get("content-type", "")
+    return response.status_code == 200 and content_type.startswith("text/html")
+
+
+def _cached_response(entry: CacheEntry) -> httpx.Response:
+    """Build a response from a cached page."""
+    return httpx.Response(200, headers={"content-type": entry.content_type}, content=entry.body)
+
+
+def _decoded_response(response: httpx.Response, body: bytes) -> httpx.Response:
+    """Rebuild a response that was read by the cache around its decoded body."""
+    headers = [
+        (name, value)
+        for name, value in response.headers.multi_items()
+        if name not in ("content-encoding", "content-length", "transfer-encoding")
+    ]
+    return httpx.Response(response.status_code, headers=headers, content=body)
@@ -0,0 +1,173 @@
+"""
+Overlapping scan, resolve, and download stages connected by bounded queues.
+
+Views flow from the favorites scan into download link resolution and from
+there into the downloaders while the earlier stages are still running. A
+view favorited by several of the scanned users is queued only once. The
+datastore is written before anything is queued, so an interrupted pipeline
+picks up the same backlog from the database on its next run.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+from collections.abc import AsyncIterator
+from collections.abc import Sequence
+from datetime import datetime
+from datetime import timezone
+
+import httpx
+
+from . import fadownloader
+from .asyncdownloader import HostLimits
+from .asyncdownloader import consume
+from .asyncdownloader import download_file
+from .asyncdownloader import get_page
+from .asyncdownloader import resolve_download_link
+from .datastore import Datastore
+from .extractor import extract_page
+from .fadownloader import BASE_URL
+from .fadownloader import CHUNK_SIZE
+from .fadownloader import DUPLICATE_MODE
+from .fadownloader import KNOWN_PAGES_BEFORE_STOP
+from .fadownloader import WORKER_COUNT
+from .filenames import FilenameIndex
+from .layout import DEFAULT_LAYOUT
+from .metrics import METRICS
+from .metrics import Progress
+
+QUEUE_SIZE = 64
+
+log = logging.getLogger()
+
+
+async def run_pipeline(
+    http_client: httpx.AsyncClient,
+    datastore: Datastore,
+    *,
+    usernames: Sequence[str],
+    known_pages: int | None = KNOWN_PAGES_BEFORE_STOP,
+    workers: int = WORKER_COUNT,
+    limits: HostLimits | None = None,
+    chunk_size: int = CHUNK_SIZE,
+    duplicates: str = DUPLICATE_MODE,
+    layout: str = DEFAULT_LAYOUT,
+    queue_size: int = QUEUE_SIZE,
+) -> None:
+    """Scan favorites of usernames, resolve download links, and download files concurrently."""
+    fadownloader.DOWNLOAD_PATH.mkdir(parents=True, exist_ok=True)
+    limits = limits or HostLimits()
+    names = FilenameIndex.from_datastore(datastore, fadownloader.DOWNLOAD_PATH)
+
+    resolve_queue: asyncio.Queue[tuple[int, str]] = asyncio.Queue(maxsize=queue_size)
+    download_queue: asyncio.Queue[tuple[int, tuple[str, str, str, str]]]
+    download_queue = asyncio.Queue(maxsize=queue_size)
+    resolved = itertools.count(1)
+    downloaded = itertools.count(1)
+
+    # Download links resolved by this run are queued by the resolvers, the
+    # backlog only covers those left behind by earlier runs.
+    started = str(datetime.now(tz=timezone.utc))
+
+    resolve_progress = Progress("resolve")
+    download_progress = Progress("download")
+
+    async def resolve(idx: int, view: str) -> None:
+        log.info("%s Fetching download link of %s", resolve_progress.advance(), view)
+        download_link = await resolve_download_link(view, http_client, datastore, limits)
+        if download_link is not None:
+            row = datastore.get_download_to_process(view)
+            if row is not None:
+                await download_queue.put((next(downloaded), row))
+
+    async def download(idx: int, row: tuple[str, str, str, str]) -> None:
+        log.info("%s Downloading %s", download_progress.advance(), row[3])
+        await download_file(
+            row,
+            http_client,
+            datastore,
+            limits,
+            names,
+            chunk_size=chunk_size,
+            duplicates=duplicates,
+            layout=layout,
+        )
+
+    async def scan() -> None:
+        # The backlog is drained before scanning adds rows that would match it
+        for view in datastore.iter_views_to_download():
+            await resolve_queue.put((next(resolved), view))
+
+        for username in usernames:
+            scan = scan_favorites(username, http_client, datastore, limits, known_pages=known_pages)
+            async for new_views in scan:
+                for view, _, _ in new_views:
+                    await resolve_queue.put((next(resolved), view))
+
+    async def seed_downloads() -> None:
+        for row in datastore.iter_downloads_to_process(resolved_before=started):
+            await download_queue.put((next(downloaded), row))
+
+    resolvers = [asyncio.create_task(consume(resolve_queue, resolve)) for _ in range(workers)]
+    downloaders = [asyncio.create_task(consume(download_queue, download)) for _ in range(workers)]
+
+    try:
+        await asyncio.gather(scan(), seed_downloads())
+        await resolve_queue.join()
+        await download_queue.join()
+
+    finally:
+        for task in resolvers + downloaders:
+            task.cancel()
+        await asyncio.gather(*resolvers, *downloaders, return_exceptions=True)
+
+
+async def scan_favorites(
+    username: str,
+    http_client: httpx.AsyncClient,
+    datastore: Datastore,
+    limits: HostLimits,
+    *,
+    known_pages: int | None = KNOWN_PAGES_BEFORE_STOP,
+) -> AsyncIterator[list[tuple[str, str, str]]]:
+    """
+    Save each favorites page of username to datastore, yielding the views that are new.
+
+    Only views new to the datastore are yielded, a view already saved for
+    another user is only recorded as a favorite of this one. Stops after
+    `known_pages` consecutive pages without a new favorite of the user, or
+    walks every page when None.
+    """
+    url = f"{BASE_URL}/favorites/{username}/"
+    known_streak = 0
+
+    while "the fires of passion burn brightly":
+        page_body = await get_page(url, http_client, limits)
+        fav_data, next_link, _ = extract_page(page_body, username)
+
+        new_favorites = datastore.filter_new_views(list(fav_data), username)
+        new_views = datastore.filter_new_views(new_favorites)
+        datastore.save_views(new_favorites, username)
+        known_streak = 0 if new_favorites else known_streak + 1
+        METRICS.inc("stage_items_total", stage="scan")
+
+        log.info(
+            "Found %d favorite links (%d new) on '%s'. More is %s",
+            len(fav_data),
+            len(new_favorites),
+            url,
+            bool(next_link),
+        )
+
+        yield new_views
+
+        if next_link is None:
+            break
+
+        if known_pages is not None and known_streak >= known_pages:
+            log.info("No new favorites on the last %d pages, stopping scan.", known_streak)
+            break
+
+        url = f"{BASE_URL}{next_link}"
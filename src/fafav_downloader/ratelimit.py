@@ -0,0 +1,413 @@
+"""
+Adaptive per-host rate limiting and a global bandwidth cap for all HTTP traffic.
+
+Each host gets a token bucket whose refill rate grows additively while the
+host answers quickly and successfully, and shrinks multiplicatively when
+it is slow or pushes back with 429/503. A `Retry-After` header pauses the
+host entirely. The limiter is applied by wrapping the httpx transport, so
+every request made through a client is paced without the callers knowing.
+
+Bytes are shaped separately by a `BandwidthLimiter`, a bucket of bytes
+shared by every response body streamed through its clients. Each chunk
+read takes its size from the bucket and waits until the bucket refills, so
+concurrent downloads together stay under the cap while using all of it. The
+cap may change with the time of day following a schedule of windows.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import logging
+import re
+import threading
+import time
+from collections.abc import AsyncIterator
+from collections.abc import Callable
+from collections.abc import Iterator
+from collections.abc import Sequence
+from datetime import datetime
+from datetime import time as Time
+from datetime import timezone
+from typing import NamedTuple
+
+import httpx
+
+from .metrics import METRICS
+
+INITIAL_RATE = 1.0
+MIN_RATE = 0.05
+MAX_RATE = 4.0
+BURST = 1.0
+ADDITIVE_INCREASE = 0.1
+MULTIPLICATIVE_DECREASE = 0.5
+SLOW_DECREASE = 0.9
+LATENCY_TARGET = 2.0
+MAX_RETRIES = 3
+
+# Seconds of transfer at the full bandwidth cap that may be taken in a burst
+BANDWIDTH_BURST = 0.5
+
+THROTTLE_STATUSES = frozenset({429, 503})
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_RATE = re.compile(r"(?P<number>\d+(?:\.\d+)?)(?P<unit>[KMG]?)", re.IGNORECASE)
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+UNLIMITED = "unlimited"
+
+log = logging.getLogger()
+
+
+class TokenBucket:
+    """Token bucket handing out reservations that may be waited for."""
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        """Provide the refill rate in tokens per second and the bucket capacity."""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def reserve(self, now: float, tokens: float = 1.0) -> float:
+        """Take tokens, returning the seconds to wait until they may be used."""
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+        self.tokens -= tokens
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class AdaptiveRateLimiter:
+    """Token buckets per host with additive-increase, multiplicative-decrease rates."""
+
+    def __init__(
+        self,
+        *,
+        initial_rate: float = INITIAL_RATE,
+        min_rate: float = MIN_RATE,
+        max_rate: float = MAX_RATE,
+        burst: float = BURST,
+        latency_target: float = LATENCY_TARGET,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Rates are requests per second, latency target is in seconds."""
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.latency_target = latency_target
+        self._clock = clock
+        self._buckets: dict[str, TokenBucket] = {}
+        self._blocked_until: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def rate(self, host: str) -> float:
+        """Return the current request rate allowed for host."""
+        with self._lock:
+            return self._bucket(host).rate
+
+    def reserve(self, host: str) -> float:
+        """Reserve a request slot for host, returning the seconds to wait before sending."""
+        with self._lock:
+            now = self._clock()
+            delay = self._bucket(host).reserve(now)
+            blocked = self._blocked_until.get(host, now) - now
+            wait = max(delay, blocked)
+
+        METRICS.observe("ratelimit_wait_seconds", wait, host=host)
+        return wait
+
+    def observe(
+        self,
+        host: str,
+        status_code: int,
+        latency: float,
+        retry_after: str | None = None,
+    ) -> None:
+        """Adjust the rate of host from the outcome of a request."""
+        METRICS.observe("http_request_seconds", latency, host=host)
+        METRICS.inc("http_responses_total", host=host, status=str(status_code))
+
+        with self._lock:
+            bucket = self._bucket(host)
+
+            if status_code in THROTTLE_STATUSES:
+                bucket.rate = max(self.min_rate, bucket.rate * MULTIPLICATIVE_DECREASE)
+                pause = parse_retry_after(retry_after) if retry_after else None
+                if pause is not None:
+                    self._blocked_until[host] = self._clock() + pause
+                log.warning(
+                    "%s responded %d, slowing to %.2f requests/s (retry after %s)",
+                    host,
+                    status_code,
+                    bucket.rate,
+                    retry_after,
+                )
+
+            elif status_code >= 500 or latency > self.latency_target:
+                bucket.rate = max(self.min_rate, bucket.rate * SLOW_DECREASE)
+
+            else:
+                bucket.rate = min(self.max_rate, bucket.rate + ADDITIVE_INCREASE)
+
+    def _bucket(self, host: str) -> TokenBucket:
+        """Return the bucket of host, creating it on first use. Caller holds the lock."""
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.initial_rate, self.burst, self._clock())
+        return self._buckets[host]
+
+
+class BandwidthWindow(NamedTuple):
+    """A daily window of time with its own bandwidth cap, in bytes per second or None."""
+
+    start: Time
+    end: Time
+    rate: float | None
+
+    def contains(self, moment: Time) -> bool:
+        """Return True if the window covers a time of day, wrapping past midnight."""
+        if self.start <= self.end:
+            return self.start <= moment < self.end
+        return moment >= self.start or moment < self.end
+
+
+class BandwidthLimiter:
+    """
+    Byte token bucket capping the aggregate transfer rate of every stream sharing it.
+
+    The cap is `rate` bytes per second, or the rate of the first window of
+    `schedule` covering the local time of day. A cap of None is unlimited.
+    """
+
+    def __init__(
+        self,
+        rate: float | None = None,
+        *,
+        schedule: Sequence[BandwidthWindow] = (),
+        burst: float = BANDWIDTH_BURST,
+        clock: Callable[[], float] = time.monotonic,
+        wallclock: Callable[[], datetime] = datetime.now,
+    ) -> None:
+        """Provide the default cap in bytes per second and the seconds of burst allowed."""
+        self.rate = rate
+        self.schedule = tuple(schedule)
+        self.burst = burst
+        self._clock = clock
+        self._wallclock = wallclock
+        self._bucket: TokenBucket | None = None
+        self._lock = threading.Lock()
+
+    def current_rate(self) -> float | None:
+        """Return the cap in effect now, in bytes per second or None when unlimited."""
+        if self.schedule:
+            moment = self._wallclock().time()
+            for window in self.schedule:
+                if window.contains(moment):
+                    return window.rate
+        return self.rate
+
+    def reserve(self, size: int) -> float:
+        """Take size bytes from the bucket, returning the seconds to wait before reading on."""
+        rate = self.current_rate()
+        if rate is None:
+            return 0.0
+
+        with self._lock:
+            now = self._clock()
+            if self._bucket is None:
+                self._bucket = TokenBucket(rate, rate * self.burst, now)
+            elif self._bucket.rate != rate:
+                # Settle the bytes taken at the old rate before switching over
+                self._bucket.reserve(now, 0)
+                self._bucket.rate = rate
+                self._bucket.capacity = rate * self.burst
+            wait = self._bucket.reserve(now, size)
+
+        METRICS.inc("bandwidth_bytes_total", size)
+        METRICS.observe("bandwidth_wait_seconds", wait)
+        return wait
+
+
+class _ShapedStream(httpx.SyncByteStream):
+    """Wait on a bandwidth limiter after each chunk of a response body."""
+
+    def __init__(self, stream: httpx.SyncByteStream, limiter: BandwidthLimiter) -> None:
+        self.stream = stream
+        self.limiter = limiter
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self.stream:
+            yield chunk
+            time.sleep(self.limiter.reserve(len(chunk)))
+
+    def close(self) -> None:
+        self.stream.close()
+
+
+class _AsyncShapedStream(httpx.AsyncByteStream):
+    """Wait on a bandwidth limiter after each chunk of an async response body."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, limiter: BandwidthLimiter) -> None:
+        self.stream = stream
+        self.limiter = limiter
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+            await asyncio.sleep(self.limiter.reserve(len(chunk)))
+
+    async def aclose(self) -> None:
+        await self.stream.aclose()
+
+
+class BandwidthLimitedTransport(httpx.BaseTransport):
+    """Shape the response bodies of a wrapped transport to a bandwidth cap."""
+
+    def __init__(self, transport: httpx.BaseTransport, limiter: BandwidthLimiter) -> None:
+        self.transport = transport
+        self.limiter = limiter
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        response = self.transport.handle_request(request)
+        assert isinstance(response.stream, httpx.SyncByteStream)
+        response.stream = _ShapedStream(response.stream, self.limiter)
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncBandwidthLimitedTransport(httpx.AsyncBaseTransport):
+    """Shape the response bodies of a wrapped async transport to a bandwidth cap."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: BandwidthLimiter) -> None:
+        self.transport = transport
+        self.limiter = limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        assert isinstance(response.stream, httpx.AsyncByteStream)
+        response.stream = _AsyncShapedStream(response.stream, self.limiter)
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """Pace requests of a wrapped transport, retrying throttled and failed responses."""
+
+    def __init__(
+        self,
+        transport: httpx.BaseTransport,
+        limiter: AdaptiveRateLimiter,
+        max_retries: int = MAX_RETRIES,
+    ) -> None:
+        self.transport = transport
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.limiter.reserve(host))
+
+            started = time.monotonic()
+            response = self.transport.handle_request(request)
+            latency = time.monotonic() - started
+
+            self.limiter.observe(
+                host,
+                response.status_code,
+                latency,
+                response.headers.get("retry-after"),
+            )
+
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                break
+
+            METRICS.inc("http_retries_total", host=host)
+            response.close()
+
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """Pace requests of a wrapped async transport, retrying throttled and failed responses."""
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        limiter: AdaptiveRateLimiter,
+        max_retries: int = MAX_RETRIES,
+    ) -> None:
+        self.transport = transport
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self.limiter.reserve(host))
+
+            started = time.monotonic()
+            response = await self.transport.handle_async_request(request)
+            latency = time.monotonic() - started
+
+            self.limiter.observe(
+                host,
+                response.status_code,
+                latency,
+                response.headers.get("retry-after"),
+            )
+
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                break
+
+            METRICS.inc("http_retries_total", host=host)
+            await response.aclose()
+
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def parse_retry_after(value: str) -> float | None:
+    """Parse a Retry-After header of delay-seconds or HTTP-date into seconds from now."""
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (when - datetime.now(tz=timezone.utc)).total_seconds())
+
+
+def parse_rate(value: str) -> float | None:
+    """Parse a bandwidth like "500K" or "2.5M" into bytes per second, or "unlimited" into None."""
+    if value.strip().lower() == UNLIMITED:
+        return None
+
+    match = _RATE.fullmatch(value.strip())
+    if match is None or float(match["number"]) <= 0:
+        raise ValueError(f"Invalid bandwidth {value!r}, expected a size like 500K or 2M")
+    return float(match["number"]) * _UNITS[match["unit"].upper()]
+
+
+def parse_window(value: str) -> BandwidthWindow:
+    """Parse a schedule window like "08:00-18:00=1M" into a BandwidthWindow."""
+    times, separator, rate = value.partition("=")
+    start, dash, end = times.partition("-")
+    if not separator or not dash:
+        raise ValueError(f"Invalid bandwidth window {value!r}, expected HH:MM-HH:MM=RATE")
+    return BandwidthWindow(Time.fromisoformat(start), Time.fromisoformat(end), parse_rate(rate))
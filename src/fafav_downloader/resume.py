@@ -0,0 +1,236 @@
+"""
+Resume interrupted downloads from .part files with HTTP Range requests.
+
+A download is written to a .part file named after its view. The bytes
+safely on disk are recorded in the datastore every `checkpoint_bytes` and
+when an attempt fails, along with the total length and the validator (ETag
+or Last-Modified) of the file. The next attempt asks only for the rest with
+a Range request, made conditional on the validator by If-Range, so a file
+that changed in the meantime is sent whole. A server that ignores the range
+sends the whole file too, and the .part file starts over. A range response
+that doesn't continue at the recorded offset is thrown away and the whole
+file requested again. A finished file is only stored when its length
+matches the Content-Length or Content-Range of the response.
+
+The .part file of a view is shared by every worker process, so a download
+only touches it while its row is claimed by this worker. The claim is
+checked before resuming and storing, and its lease renewed while writing,
+unless this worker claimed the row recently enough that no other could
+have taken it. A download whose claim was taken over raises LeaseLostError
+and leaves the .part file to the new owner.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+from pathlib import Path
+from types import TracebackType
+
+import httpx
+
+from .datastore import Datastore
+from .filesink import FileSink
+
+# Bytes written between recording the progress of a download
+CHECKPOINT_BYTES = 8 * 1024 * 1024
+
+# Requests made for a download when a range response can't be used
+RANGE_ATTEMPTS = 2
+
+_CONTENT_RANGE = re.compile(r"bytes (?P<start>\d+)-\d+/(?P<length>\d+|\*)")
+
+log = logging.getLogger()
+
+
+class LeaseLostError(Exception):
+    """The row of a download was claimed, or processed already, by another worker."""
+
+
+class PartialDownload:
+    """
+    Resumable download of a view into a .part file in the download directory.
+
+    Use as a context manager around the requests of one attempt. Leaving it
+    without storing the file records the progress for the next attempt.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        datastore: Datastore,
+        view: str,
+        *,
+        checkpoint_bytes: int = CHECKPOINT_BYTES,
+    ) -> None:
+        """
+        Provide the download directory and the view, resuming progress recorded for it.
+
+        Raises LeaseLostError if the view is claimed by another worker.
+        """
+        self.datastore = datastore
+        self.view = view
+        self.checkpoint_bytes = checkpoint_bytes
+        self._confirm_claim()
+
+        name = part_name(view)
+        # Without a .part file there is nothing to resume, and no need to ask the datastore
+        state = datastore.get_partial(view) if (directory / name).exists() else None
+        offset, self.length, self.validator = state or (0, None, None)
+        self.sink = FileSink(directory, name, offset)
+        self.resumable = True
+        self._recorded = self.sink.size
+
+    def __enter__(self) -> PartialDownload:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if self.sink.closed:
+            return
+
+        if exc_type is LeaseLostError:
+            # The .part file belongs to the worker holding the claim now
+            self.sink.suspend()
+        elif self.resumable and self.sink.size:
+            self.sink.suspend()
+            self._record(self.sink.size)
+        else:
+            self.sink.abort()
+            if self._recorded:
+                self._record(None)
+
+    def headers(self) -> dict[str, str]:
+        """Return the headers asking for the rest of the file, when some of it is on disk."""
+        if not self.sink.size:
+            return {}
+
+        headers = {"range": f"bytes={self.sink.size}-"}
+        if self.validator:
+            headers["if-range"] = self.validator
+        return headers
+
+    def needs_full_request(self, response: httpx.Response) -> bool:
+        """
+        Return True if a response to a range request can't be used to resume.
+
+        The .part file is started over and the whole file should be requested.
+        """
+        offset = self.sink.size
+        if not offset or response.status_code not in (206, 416):
+            return False
+
+        match = _CONTENT_RANGE.fullmatch(response.headers.get("content-range", ""))
+        usable = (
+            response.status_code == 206
+            and not _is_encoded(response)
+            and match is not None
+            and int(match["start"]) == offset
+            and self.length in (None, _length(match["length"]))
+        )
+        if usable:
+            return False
+
+        log.warning("Unable to resume %s at byte %d, downloading it again", response.url, offset)
+        self._restart()
+        return True
+
+    def start(self, response: httpx.Response) -> None:
+        """Take the length and validator of a successful response, starting over on a full one."""
+        if response.status_code == 206:
+            log.info("Resuming %s at byte %d", response.url, self.sink.size)
+            match = _CONTENT_RANGE.fullmatch(response.headers["content-range"])
+            self.length = _length(match["length"]) if match else None
+            self.validator = _validator(response) or self.validator
+            return
+
+        if self.sink.size:
+            log.info("Server sent all of %s, starting it over", response.url)
+            self._restart()
+
+        # Ranges and lengths count encoded bytes, the file holds decoded ones
+        self.resumable = not _is_encoded(response)
+        content_length = response.headers.get("content-length")
+        if self.resumable and content_length and content_length.isdigit():
+            self.length = int(content_length)
+        self.validator = _validator(response)
+
+    def write(self, chunk: bytes) -> None:
+        """
+        Append a chunk of the body, recording the progress every `checkpoint_bytes`.
+
+        The claim on the view is renewed once half of its lease has passed.
+        """
+        self._confirm_claim()
+        self.sink.write(chunk)
+        if self.resumable and self.sink.size - self._recorded >= self.checkpoint_bytes:
+            self.sink.sync()
+            self._record(self.sink.size)
+
+    def complete(self) -> bool:
+        """
+        Return True if the whole file is on disk. A file longer than announced starts over.
+
+        Raises LeaseLostError if the view was claimed by another worker, so
+        the file is never stored twice.
+        """
+        if self.length is None or self.sink.size == self.length:
+            self._confirm_claim()
+            return True
+
+        if self.sink.size > self.length:
+            log.error(
+                "Download of %s is longer than its %d bytes, discarding it", self.view, self.length
+            )
+            self._restart()
+        else:
+            log.error(
+                "Download of %s ended at byte %d of %d", self.view, self.sink.size, self.length
+            )
+        return False
+
+    def _confirm_claim(self) -> None:
+        """Claim the view or renew the claim held, raising LeaseLostError if another has it."""
+        if self.datastore.claim_is_fresh(self.view):
+            return
+
+        if not self.datastore.keep_claim(self.view):
+            raise LeaseLostError(f"{self.view} was claimed or processed by another worker")
+
+    def _restart(self) -> None:
+        self.sink.restart()
+        self.length = None
+        self.validator = None
+
+    def _record(self, offset: int | None) -> None:
+        """Record the bytes on disk, or forget the progress when offset is None."""
+        if offset is None:
+            self.datastore.save_partial(self.view, None)
+        else:
+            self.datastore.save_partial(self.view, offset, self.length, self.validator)
+        self._recorded = offset or 0
+
+
+def part_name(view: str) -> str:
+    """Return the name of the .part file of the download of a view."""
+    return f".{view.strip('/').replace('/', '-')}.part"
+
+
+def _is_encoded(response: httpx.Response) -> bool:
+    return response.headers.get("content-encoding", "identity") != "identity"
+
+
+def _length(value: str) -> int | None:
+    return int(value) if value.isdigit() else None
+
+
+def _validator(response: httpx.Response) -> str | None:
+    """Return the ETag of a response if it is strong, as If-Range needs, or Last-Modified."""
+    etag = response.headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("last-modified")
@@ -0,0 +1,182 @@
+"""
+Tuned connection pools per host group for the HTTP clients.
+
+Pages of the site and file bytes from the CDN have different needs: few
+small requests against one host versus many large transfers. Each host
+group gets its own pool with its own connection limits, keep-alive, and
+timeouts, so concurrent requests reuse warm connections instead of paying a
+new TLS handshake. HTTP/2 is used where the optional `h2` package is
+installed, multiplexing concurrent requests over a single connection.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import logging
+from collections.abc import Mapping
+from typing import NamedTuple
+
+import httpx
+
+from .pagecache import AsyncCachingTransport
+from .pagecache import CachingTransport
+from .pagecache import PageCache
+from .ratelimit import AdaptiveRateLimiter
+from .ratelimit import AsyncBandwidthLimitedTransport
+from .ratelimit import AsyncRateLimitedTransport
+from .ratelimit import BandwidthLimitedTransport
+from .ratelimit import BandwidthLimiter
+from .ratelimit import RateLimitedTransport
+
+KEEPALIVE_EXPIRY = 30.0
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 30.0
+
+# HTTP/2 needs the "http2" extra, installing the h2 package
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+log = logging.getLogger()
+
+
+class PoolConfig(NamedTuple):
+    """Connection limits and timeouts of the pool of one host group, in seconds."""
+
+    max_connections: int
+    keepalive_expiry: float = KEEPALIVE_EXPIRY
+    connect_timeout: float = CONNECT_TIMEOUT
+    read_timeout: float = READ_TIMEOUT
+
+    def limits(self) -> httpx.Limits:
+        """Return the pool limits, keeping every connection alive for reuse."""
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self) -> httpx.Timeout:
+        """
+        Return the request timeouts of the pool.
+
+        Waiting for a free connection never times out, concurrency is
+        bounded by the callers instead.
+        """
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout, pool=None)
+
+
+SITE_POOL = PoolConfig(max_connections=4)
+CDN_POOL = PoolConfig(max_connections=8, read_timeout=60.0)
+
+
+class PoolTransport(httpx.BaseTransport):
+    """Send requests through the pool of a host group, applying its timeouts."""
+
+    def __init__(self, transport: httpx.BaseTransport, config: PoolConfig) -> None:
+        self.transport = transport
+        self.timeout = config.timeout().as_dict()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["timeout"] = self.timeout
+        return self.transport.handle_request(request)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncPoolTransport(httpx.AsyncBaseTransport):
+    """Send async requests through the pool of a host group, applying its timeouts."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, config: PoolConfig) -> None:
+        self.transport = transport
+        self.timeout = config.timeout().as_dict()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["timeout"] = self.timeout
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def build_client(
+    headers: dict[str, str],
+    limiter: AdaptiveRateLimiter,
+    *,
+    pools: Mapping[str, PoolConfig],
+    default_pool: PoolConfig = CDN_POOL,
+    http2: bool = HTTP2_AVAILABLE,
+    cache: PageCache | None = None,
+    bandwidth: BandwidthLimiter | None = None,
+) -> httpx.Client:
+    """
+    Build a rate limited client with a pool per host in `pools`.
+
+    Requests to any other host share the default pool. Pages of the hosts in
+    `pools` are cached in `cache` when given. Response bodies of every host
+    share the bandwidth cap of `bandwidth` when given.
+    """
+    http2 = use_http2(http2)
+
+    def transport(config: PoolConfig) -> httpx.BaseTransport:
+        pool: httpx.BaseTransport = PoolTransport(
+            httpx.HTTPTransport(http2=http2, limits=config.limits()), config
+        )
+        if bandwidth is not None:
+            pool = BandwidthLimitedTransport(pool, bandwidth)
+        return RateLimitedTransport(pool, limiter)
+
+    def cached(config: PoolConfig) -> httpx.BaseTransport:
+        host_transport = transport(config)
+        return CachingTransport(host_transport, cache) if cache is not None else host_transport
+
+    return httpx.Client(
+        headers=headers,
+        transport=transport(default_pool),
+        mounts={f"all://{host}": cached(config) for host, config in pools.items()},
+    )
+
+
+def build_async_client(
+    headers: dict[str, str],
+    limiter: AdaptiveRateLimiter,
+    *,
+    pools: Mapping[str, PoolConfig],
+    default_pool: PoolConfig = CDN_POOL,
+    http2: bool = HTTP2_AVAILABLE,
+    cache: PageCache | None = None,
+    bandwidth: BandwidthLimiter | None = None,
+) -> httpx.AsyncClient:
+    """
+    Build a rate limited async client with a pool per host in `pools`.
+
+    Requests to any other host share the default pool. Pages of the hosts in
+    `pools` are cached in `cache` when given. Response bodies of every host
+    share the bandwidth cap of `bandwidth` when given.
+    """
+    http2 = use_http2(http2)
+
+    def transport(config: PoolConfig) -> httpx.AsyncBaseTransport:
+        pool: httpx.AsyncBaseTransport = AsyncPoolTransport(
+            httpx.AsyncHTTPTransport(http2=http2, limits=config.limits()), config
+        )
+        if bandwidth is not None:
+            pool = AsyncBandwidthLimitedTransport(pool, bandwidth)
+        return AsyncRateLimitedTransport(pool, limiter)
+
+    def cached(config: PoolConfig) -> httpx.AsyncBaseTransport:
+        host_transport = transport(config)
+        return AsyncCachingTransport(host_transport, cache) if cache is not None else host_transport
+
+    return httpx.AsyncClient(
+        headers=headers,
+        transport=transport(default_pool),
+        mounts={f"all://{host}": cached(config) for host, config in pools.items()},
+    )
+
+
+def use_http2(requested: bool) -> bool:
+    """Return whether HTTP/2 can be used, warning when it is requested but not installed."""
+    if requested and not HTTP2_AVAILABLE:
+        log.warning("HTTP/2 requires the h2 package, install the http2 extra. Using HTTP/1.1.")
+        return False
+    return requested
@@ -0,0 +1,161 @@
+"""
+Verify the integrity of downloaded files in a process pool.
+
+Every file the datastore has a filename for is checked for existence, its
+recorded size and hash, and, for JPEG, PNG, and GIF files with no recorded
+hash, the trailer marking the end of a complete file. Checks are spread over worker processes, since
+hashing a large library is bound by CPU as much as by disk. Files found
+intact are remembered with their size and mtime, and skipped by later runs
+until either changes. Damaged files are moved aside to `<name>.corrupt` and
+missing or damaged ones are put back in the download queue.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+from typing import NamedTuple
+
+from .datastore import Datastore
+from .fadownloader import sniff_extension
+from .filesink import SNIFF_LENGTH
+from .metrics import METRICS
+from .metrics import Progress
+
+# Bytes read per chunk when hashing a file
+READ_SIZE = 1024 * 1024
+
+# Bytes at the end of a file searched for its trailer
+TRAILER_LENGTH = 1024
+
+# Checks submitted to the pool per worker, bounding the memory of queued work
+QUEUE_PER_WORKER = 4
+
+CORRUPT_SUFFIX = ".corrupt"
+
+log = logging.getLogger()
+
+
+class FileCheck(NamedTuple):
+    """Result of checking a file, with the size and mtime it had when checked."""
+
+    problem: str | None
+    size: int
+    mtime_ns: int
+
+
+def check_file(path: str, size: int | None, sha256: str | None) -> FileCheck:
+    """
+    Check a file against its recorded size and hash, or the trailer of its format.
+
+    A matching hash proves the file is the complete download, which may
+    have bytes past its trailer, so the trailer is only checked without one.
+    Runs in a worker process, so it only takes and returns picklable values.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return FileCheck("missing", 0, 0)
+
+    if size is not None and stat.st_size != size:
+        return FileCheck(f"size is {stat.st_size}, expected {size}", stat.st_size, stat.st_mtime_ns)
+
+    with open(path, "rb") as infile:
+        if sha256:
+            digest = hashlib.sha256()
+            while chunk := infile.read(READ_SIZE):
+                digest.update(chunk)
+            problem = None if digest.hexdigest() == sha256 else "hash mismatch"
+            return FileCheck(problem, stat.st_size, stat.st_mtime_ns)
+
+        head = infile.read(SNIFF_LENGTH)
+        infile.seek(max(stat.st_size - TRAILER_LENGTH, 0))
+        tail = infile.read(TRAILER_LENGTH)
+
+    problem = None if has_trailer(sniff_extension(head), tail) else "truncated"
+    return FileCheck(problem, stat.st_size, stat.st_mtime_ns)
+
+
+def has_trailer(extension: str | None, tail: bytes) -> bool:
+    """Return True if the end of a file holds the trailer of its format, or it has none known."""
+    if extension == "jpg":
+        # Some encoders pad the image after the EOI marker
+        return b"\xff\xd9" in tail
+    if extension == "png":
+        return tail.endswith(b"IEND\xaeB`\x82")
+    if extension == "gif":
+        return tail.rstrip(b"\x00").endswith(b";")
+    return True
+
+
+def verify_library(datastore: Datastore, directory: Path, *, workers: int | None = None) -> int:
+    """
+    Verify every downloaded file in directory, returning the number requeued.
+
+    Files unchanged since they were last found intact are skipped without
+    being read.
+    """
+    workers = workers or os.cpu_count() or 1
+    progress = Progress("verify")
+    checked = skipped = requeued = 0
+
+    # Forking would copy the locks of threads such as the metrics writer mid-use
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as executor:
+        pending: dict[concurrent.futures.Future[FileCheck], tuple[str, str | None]] = {}
+
+        def collect(return_when: str) -> None:
+            nonlocal checked, requeued
+            done, _ = concurrent.futures.wait(pending, return_when=return_when)
+            for future in done:
+                filename, sha256 = pending.pop(future)
+                result = future.result()
+                checked += 1
+                if result.problem is None:
+                    datastore.save_verified(filename, result.size, result.mtime_ns, sha256)
+                    continue
+
+                log.warning(
+                    "%s is damaged (%s), queueing it for download", filename, result.problem
+                )
+                if result.problem != "missing":
+                    os.replace(directory / filename, directory / f"{filename}{CORRUPT_SUFFIX}")
+                datastore.requeue_download(filename, f"Verify: {result.problem}")
+                METRICS.inc("verify_failures_total")
+                requeued += 1
+
+        for filename, sha256, size, cached in datastore.iter_files_to_verify():
+            path = directory / filename
+            if cached is not None and cached[2] == sha256 and _unchanged(path, cached[:2]):
+                skipped += 1
+                continue
+
+            log.debug("Verifying %s %s", filename, progress.advance())
+            future = executor.submit(check_file, str(path), size, sha256)
+            pending[future] = (filename, sha256)
+            if len(pending) >= workers * QUEUE_PER_WORKER:
+                collect(concurrent.futures.FIRST_COMPLETED)
+
+        collect(concurrent.futures.ALL_COMPLETED)
+
+    datastore.flush()
+    log.info(
+        "Verified %d files, skipped %d unchanged, queued %d for download",
+        checked,
+        skipped,
+        requeued,
+    )
+    return requeued
+
+
+def _unchanged(path: Path, cached: tuple[int, int]) -> bool:
+    """Return True if a file has the size and mtime in nanoseconds it was verified with."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return False
+    return (stat.st_size, stat.st_mtime_ns) == cached
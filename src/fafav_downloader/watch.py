@@ -0,0 +1,110 @@
+"""
+Unattended scheduling of repeated sync cycles.
+
+A watch runs a sync cycle, sleeps for the interval with some random jitter
+so many installs don't hit the site in lockstep, and repeats until it is
+told to stop. SIGINT and SIGTERM request a graceful stop: the running stage
+ends after the item in progress and the caller gets to flush and close. A
+second signal interrupts immediately.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import signal
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from types import FrameType
+from types import TracebackType
+from typing import Any
+
+import httpx
+
+WATCH_INTERVAL = 15 * 60
+WATCH_JITTER = 60
+STOP_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+log = logging.getLogger()
+
+
+class StopSignal:
+    """
+    Context manager turning stop signals into a set event.
+
+    The previous handlers are restored on exit. A signal received while the
+    event is already set raises KeyboardInterrupt.
+    """
+
+    def __init__(self, signals: tuple[signal.Signals, ...] = STOP_SIGNALS) -> None:
+        """Provide the signals that request a stop."""
+        self.signals = signals
+        self.event = threading.Event()
+        self._previous: dict[signal.Signals, Any] = {}
+
+    def __enter__(self) -> StopSignal:
+        for signum in self.signals:
+            self._previous[signum] = signal.signal(signum, self._handle)
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        for signum, handler in self._previous.items():
+            signal.signal(signum, handler)
+        self._previous.clear()
+
+    def is_set(self) -> bool:
+        """Return True once a stop was requested."""
+        return self.event.is_set()
+
+    def _handle(self, signum: int, frame: FrameType | None) -> None:
+        if self.event.is_set():
+            raise KeyboardInterrupt()
+
+        log.info("Received %s, stopping after the current item.", signal.Signals(signum).name)
+        self.event.set()
+
+
+def watch(
+    cycle: Callable[[], None],
+    stop: threading.Event,
+    *,
+    interval: float = WATCH_INTERVAL,
+    jitter: float = WATCH_JITTER,
+    clock: Callable[[], float] = time.monotonic,
+) -> int:
+    """
+    Run cycle every `interval` seconds, give or take `jitter`, until stop is set.
+
+    A cycle failing on a network or file error, or on a database locked by
+    another process, is logged and retried on the next interval. Returns the
+    number of cycles run.
+    """
+    cycles = 0
+    while not stop.is_set():
+        started = clock()
+        try:
+            cycle()
+        except (httpx.HTTPError, OSError, sqlite3.OperationalError) as err:
+            log.error("Sync failed, retrying on the next interval: %s", err)
+        cycles += 1
+
+        if stop.is_set():
+            break
+
+        delay = next_delay(interval, jitter, clock() - started)
+        log.info("Next sync in %.0f seconds", delay)
+        stop.wait(delay)
+
+    return cycles
+
+
+def next_delay(interval: float, jitter: float, elapsed: float) -> float:
+    """Return the seconds to sleep so cycles start `interval` apart, give or take `jitter`."""
+    return max(0.0, interval - elapsed + random.uniform(-jitter, jitter))
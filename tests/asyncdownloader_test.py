@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
+
+from fafav_downloader import asyncdownloader
+from fafav_downloader import fadownloader
+from fafav_downloader.datastore import Datastore
+from fafav_downloader.metrics import METRICS
+
+VIEW_PAGE = Path("tests/fixtures/view_page.html").read_text(encoding="utf-8")
+
+
+@pytest.fixture
+def download_path(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> Path:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    return tmp_path
+
+
+def test_host_limits_separates_site_and_cdn() -> None:
+    limits = asyncdownloader.HostLimits(1, 3)
+
+    site = limits.for_url("https://www.furaffinity.net/view/1/")
+    cdn = limits.for_url("https://d.furaffinity.net/art/some/file.png")
+
+    assert site is limits.site
+    assert cdn is limits.cdn
+
+
+def test_get_page_failure() -> None:
+    transport = httpx.MockTransport(lambda request: httpx.Response(503, text="busy"))
+
+    async def run() -> str:
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await asyncdownloader.get_page(
+                "https://www.furaffinity.net/view/1/",
+                client,
+                asyncdownloader.HostLimits(),
+            )
+
+    assert asyncio.run(run()) == ""
+
+
+def test_run_workers_survives_unexpected_errors() -> None:
+    METRICS.reset()
+    handled = []
+
+    async def handler(idx: int, item: str) -> None:
+        if item == "bad":
+            raise ValueError(item)
+        handled.append(item)
+
+    items = [(0, "bad"), (1, "bad"), (2, "good"), (3, "good"), (4, "good")]
+    asyncio.run(asyncio.wait_for(asyncdownloader._run_workers(items, handler, 1), 5))
+
+    assert handled == ["good", "good", "good"]
+    assert METRICS.value("stage_errors_total") == 2
+
+
+def test_save_download_links(datastore: Datastore) -> None:
+    requested: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(request.url.path)
+        return httpx.Response(200, text=VIEW_PAGE)
+
+    async def run() -> None:
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            await asyncdownloader.save_download_links(client, datastore, workers=2)
+
+    asyncio.run(run())
+
+    assert sorted(requested) == ["/view/1", "/view/2"]
+    assert not datastore.get_views_to_download()
+
+
+def test_download_favorite_files(datastore: Datastore, download_path: Path) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=b"\x89PNG\r\n\x1a\nimage bytes")
+
+    async def run() -> None:
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            await asyncdownloader.download_favorite_files(client, datastore, workers=4)
+
+    asyncio.run(run())
+
+    files = {path.name for path in download_path.iterdir()}
+    assert files == {"author-title.png", "author-title-0001.png"}
+    assert not datastore.get_downloads_to_process()
+
+
+def test_download_favorite_files_failure_is_recorded(
+    datastore: Datastore,
+    download_path: Path,
+) -> None:
+    transport = httpx.MockTransport(lambda request: httpx.Response(404))
+
+    async def run() -> None:
+        async with httpx.AsyncClient(transport=transport) as client:
+            await asyncdownloader.download_favorite_files(client, datastore)
+
+    asyncio.run(run())
+
+    assert not list(download_path.iterdir())
+    assert datastore.get_download_to_process("/view/3") is None
+    assert datastore.get_failure("/view/3") == (1, 404, "Not Found", None)
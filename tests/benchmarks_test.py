@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from benchmarks import synthetic
+from benchmarks.harness import Benchmark
+from benchmarks.harness import compare
+from benchmarks.harness import run
+from benchmarks.harness import write_results
+from fafav_downloader import fadownloader
+
+
+def test_favorites_page_lists_requested_favorites() -> None:
+    favorites = fadownloader.get_favorite_data(synthetic.favorites_page(100))
+
+    assert len(favorites) == 100
+    assert len({view for view, _, _ in favorites}) == 100
+
+
+def test_view_page_without_download() -> None:
+    assert fadownloader.get_download_url(synthetic.view_page(10)) is not None
+    assert fadownloader.get_download_url(synthetic.view_page(download=False)) is None
+
+
+def test_populated_datastore_has_every_state() -> None:
+    datastore = synthetic.populated_datastore(100)
+
+    assert datastore.count_views_to_download() == 25
+    assert datastore.count_downloads_to_process() == 25
+
+
+def test_run_and_compare_results(tmp_path: Path) -> None:
+    calls: list[int] = []
+    bench = Benchmark("group", "name", lambda param: lambda: calls.append(param), (1, 2), 5)
+    baseline = tmp_path / "baseline.json"
+
+    results = run([bench], quick=True)
+    write_results(results, baseline)
+    lines = compare(run([bench]), baseline)
+
+    assert [result.key for result in results] == ["group.name[1]"]
+    assert results[0].rounds == 3
+    assert json.loads(baseline.read_text())["results"][0]["key"] == "group.name[1]"
+    assert lines[0].startswith("group.name[1]: ")
+    assert lines[1].startswith("group.name[2]: ") and lines[1].endswith("(new)")
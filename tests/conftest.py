@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+from pathlib import Path
+
 import pytest
 
+from fafav_downloader.datastore import STATUS_MIGRATION_SQL
 from fafav_downloader.datastore import Datastore
 
 ROWS = [
@@ -80,6 +83,31 @@ def datastore() -> Datastore:
     store = Datastore()
     cursor = store._dbconn.cursor()
     cursor.executemany(sql, ROWS)
+    cursor.execute(STATUS_MIGRATION_SQL)
     cursor.close()
     store._dbconn.commit()
     return store
+
+
+class FakeClock:
+    """Clock returning the time set on it, for tests to move it forward."""
+
+    def __init__(self, now: float = 1000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def shared_datastores(tmp_path: Path, clock: FakeClock) -> tuple[Datastore, Datastore]:
+    """Two workers, "first" and "second", sharing a database file and the clock."""
+    database = str(tmp_path / "shared.db")
+    first = Datastore(database, worker_id="first", clock=clock)
+    second = Datastore(database, worker_id="second", clock=clock)
+    return first, second
@@ -1,11 +1,22 @@
 from __future__ import annotations
 
+import csv
+import json
 import os
+import sqlite3
 import tempfile
+import threading
 from pathlib import Path
 
+import pytest
+
+from fafav_downloader.datastore import LEASE_SECONDS
+from fafav_downloader.datastore import RETRY_BASE_SECONDS
+from fafav_downloader.datastore import RETRY_MAX_SECONDS
+from fafav_downloader.datastore import RETRY_READY_SQL
 from fafav_downloader.datastore import Datastore
 from tests.conftest import ROWS
+from tests.conftest import FakeClock
 
 EXPECTED_COLUMNS = {
     "view",
@@ -15,6 +26,20 @@ EXPECTED_COLUMNS = {
     "download",
     "download_date",
     "filename",
+    "sha256",
+    "filetype",
+    "change_seq",
+    "part_offset",
+    "part_length",
+    "part_validator",
+    "attempts",
+    "last_status",
+    "last_error",
+    "next_retry_at",
+    "status",
+    "size",
+    "claimed_by",
+    "lease_expires",
 }
 
 
@@ -145,3 +170,581 @@ def test_update_filename(datastore: Datastore) -> None:
         result = cursor.fetchone()[0]
 
     assert result == new_name
+
+
+def test_filter_new_views(datastore: Datastore) -> None:
+    data = [
+        ("/view/1", "title", "author"),
+        ("/view/99", "title", "author"),
+    ]
+
+    results = datastore.filter_new_views(data)
+
+    assert results == [("/view/99", "title", "author")]
+
+
+def test_get_download_to_process(datastore: Datastore) -> None:
+    assert datastore.get_download_to_process("/view/3") == (
+        "/view/3",
+        "title",
+        "author",
+        "https://...",
+    )
+    assert datastore.get_download_to_process("/view/1") is None
+    assert datastore.get_download_to_process("/view/5") is None
+
+
+def test_write_behind_holds_updates_until_batch_is_full() -> None:
+    store = Datastore(batch_size=2, flush_ms=60_000)
+    store.save_views([("/view/1", "title", "author"), ("/view/2", "title", "author")])
+    raw_cursor = store._dbconn.cursor()
+
+    store.save_download("/view/1", "https://...")
+    raw_cursor.execute("SELECT COUNT(*) FROM downloads WHERE download IS NOT NULL")
+    before_flush = raw_cursor.fetchone()[0]
+
+    store.save_download("/view/2", "https://...")
+    raw_cursor.execute("SELECT COUNT(*) FROM downloads WHERE download IS NOT NULL")
+    after_flush = raw_cursor.fetchone()[0]
+
+    assert before_flush == 0
+    assert after_flush == 2
+
+
+def test_write_behind_flushes_after_interval() -> None:
+    store = Datastore(batch_size=100, flush_ms=0)
+    store.save_view(("/view/1", "title", "author"))
+
+    store.save_filename("/view/1", "somefile.png")
+
+    assert not store._pending
+
+
+def test_reads_see_pending_updates() -> None:
+    store = Datastore(batch_size=100, flush_ms=60_000)
+    store.save_view(("/view/1", "title", "author"))
+
+    store.save_download("/view/1", "https://...")
+
+    assert store._pending
+    assert store.get_views_to_download() == []
+
+
+def test_pipeline_reads_commit_pending_updates_once(tmp_path: Path) -> None:
+    database = str(tmp_path / "test.db")
+    store = Datastore(database, batch_size=100, flush_ms=60_000, worker_id="first")
+    store.save_views([("/view/1", "title", "author"), ("/view/2", "title", "author")])
+    other = Datastore(database, worker_id="second")
+
+    store.save_download("/view/1", "https://...")
+    new_views = store.filter_new_views([("/view/2", "title", "author")])
+
+    assert new_views == []
+    assert store._pending
+    assert other.count_downloads_to_process() == 0
+
+    assert store.get_download_to_process("/view/1") is not None
+    assert not store._pending
+    assert other.get_download_to_process("/view/1") is None
+
+
+def test_close_flushes_pending_updates(tmp_path: Path) -> None:
+    database = str(tmp_path / "test.db")
+    with Datastore(database, batch_size=100, flush_ms=60_000) as store:
+        store.save_view(("/view/1", "title", "author"))
+        store.save_download("/view/1", "https://...")
+
+    reopened = Datastore(database)
+
+    assert reopened.get_views_to_download() == []
+
+
+def test_file_database_uses_wal(tmp_path: Path) -> None:
+    store = Datastore(str(tmp_path / "test.db"))
+
+    with store.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode")
+        journal_mode = cursor.fetchone()[0]
+
+    assert journal_mode == "wal"
+
+
+def test_iter_views_to_download_pages_through_batches(datastore: Datastore) -> None:
+    datastore.save_views([(f"/view/1{idx}", "title", "author") for idx in range(5)])
+
+    results = list(datastore.iter_views_to_download(batch_size=2))
+
+    assert sorted(results) == sorted(["/view/1", "/view/2"] + [f"/view/1{i}" for i in range(5)])
+    assert len(results) == datastore.count_views_to_download()
+
+
+def test_iter_views_to_download_survives_updates(datastore: Datastore) -> None:
+    results = []
+    for view in datastore.iter_views_to_download(batch_size=1):
+        datastore.save_download(view, None)
+        results.append(view)
+
+    assert results == ["/view/1", "/view/2"]
+
+
+def test_iter_downloads_to_process(datastore: Datastore) -> None:
+    expected = datastore.get_downloads_to_process()
+
+    results = list(datastore.iter_downloads_to_process(batch_size=1))
+
+    assert results == expected
+    assert datastore.count_downloads_to_process() == 2
+
+
+def test_iter_downloads_to_process_resolved_before(datastore: Datastore) -> None:
+    results = list(datastore.iter_downloads_to_process(resolved_before="2022-12-14"))
+
+    assert results == [("/view/3", "title", "author", "https://...")]
+
+
+def test_work_queries_use_status_index(datastore: Datastore) -> None:
+    with datastore.cursor() as cursor:
+        cursor.execute(
+            "EXPLAIN QUERY PLAN SELECT view FROM downloads "
+            "WHERE status = 'discovered' AND view > ? ORDER BY view",
+            ("",),
+        )
+        resolve_plan = str(cursor.fetchall())
+        cursor.execute(
+            "EXPLAIN QUERY PLAN SELECT view FROM downloads "
+            f"WHERE status = 'resolved' AND view > ? AND {RETRY_READY_SQL} ORDER BY view",
+            ("", 0),
+        )
+        download_plan = str(cursor.fetchall())
+
+    assert "work_queue (status=? AND view>?)" in resolve_plan
+    assert "work_queue (status=? AND view>?)" in download_plan
+    assert "TEMP B-TREE" not in resolve_plan + download_plan
+
+
+def test_open_adds_missing_columns(tmp_path: Path) -> None:
+    database = str(tmp_path / "old.db")
+    conn = sqlite3.connect(database)
+    conn.execute(
+        "CREATE TABLE downloads (view TEXT NOT NULL, title TEXT NOT NULL, author TEXT NOT NULL, "
+        "view_date TEXT NOT NULL, download TEXT, download_date TEXT, filename TEXT)"
+    )
+    conn.execute("INSERT INTO downloads VALUES ('/view/1', 't', 'a', 'date', NULL, NULL, NULL)")
+    conn.commit()
+    conn.close()
+
+    store = Datastore(database)
+
+    with store.cursor() as cursor:
+        cursor.execute("SELECT * FROM downloads")
+        columns = {d[0] for d in cursor.description}
+
+    assert columns == EXPECTED_COLUMNS
+    assert store.row_count() == 1
+    assert store.export(str(tmp_path / "export.csv"), incremental=True) == 1
+
+
+def test_get_filename_by_hash_sees_pending_downloads() -> None:
+    store = Datastore(batch_size=100, flush_ms=60_000)
+    store.save_view(("/view/1", "title", "author"))
+
+    store.save_filename("/view/1", "somefile.png", sha256="abc123")
+
+    assert store.get_filename_by_hash("abc123") == "somefile.png"
+    assert store.get_filename_by_hash("def456") is None
+    assert store._pending
+
+
+def test_get_filename_by_hash(datastore: Datastore) -> None:
+    datastore.save_filename("/view/3", "somefile.png", sha256="abc123")
+
+    assert datastore.get_filename_by_hash("abc123") == "somefile.png"
+    assert datastore.get_filename_by_hash("def456") is None
+
+
+def test_iter_filenames_pages_through_batches(datastore: Datastore) -> None:
+    datastore.save_filename("/view/3", "b.png")
+
+    filenames = list(datastore.iter_filenames(batch_size=1))
+
+    assert filenames == sorted(set(filenames))
+    assert "b.png" in filenames
+
+
+def test_filter_new_views_per_user(datastore: Datastore) -> None:
+    data = [("/view/1", "title", "author"), ("/view/99", "title", "author")]
+
+    datastore.save_views(data[:1], "someuser")
+
+    assert datastore.filter_new_views(data, "someuser") == data[1:]
+    assert datastore.filter_new_views(data, "otheruser") == data
+    assert datastore.filter_new_views(data) == data[1:]
+
+
+def _read_csv(path: Path) -> list[dict[str, str]]:
+    with open(path, encoding="utf-8", newline="") as csvfile:
+        return list(csv.DictReader(csvfile))
+
+
+def test_export_streams_in_batches(datastore: Datastore, tmp_path: Path) -> None:
+    path = tmp_path / "export.csv"
+
+    written = datastore.export(str(path), batch_size=4)
+
+    rows = _read_csv(path)
+    assert written == len(rows) == 6
+    assert [row["view"] for row in rows] == [f"/view/{idx}" for idx in range(1, 7)]
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_incremental_export_appends_changed_rows(datastore: Datastore, tmp_path: Path) -> None:
+    path = tmp_path / "export.csv"
+    datastore.export(str(path), incremental=True)
+
+    datastore.save_download("/view/1", "https://new")
+    datastore.save_views([("/view/7", "title", "author"), ("/view/2", "title", "author")])
+    written = datastore.export(str(path), incremental=True)
+
+    rows = _read_csv(path)
+    assert written == 2
+    assert [row["view"] for row in rows[6:]] == ["/view/1", "/view/7"]
+    assert rows[6]["download"] == "https://new"
+    assert datastore.export(str(path), incremental=True) == 0
+
+
+def test_incremental_export_rewrites_missing_file(datastore: Datastore, tmp_path: Path) -> None:
+    path = tmp_path / "export.csv"
+    datastore.export(str(path), incremental=True)
+    path.unlink()
+
+    assert datastore.export(str(path), incremental=True) == 6
+    assert len(_read_csv(path)) == 6
+
+
+def test_incremental_export_rewrites_mismatched_header(
+    datastore: Datastore,
+    tmp_path: Path,
+) -> None:
+    path = tmp_path / "export.csv"
+    datastore.export(str(path), incremental=True)
+    path.write_text("view,title\n", encoding="utf-8")
+
+    assert datastore.export(str(path), incremental=True) == 6
+
+
+def test_export_watermarks_are_per_file(datastore: Datastore, tmp_path: Path) -> None:
+    datastore.export(str(tmp_path / "one.csv"), incremental=True)
+    datastore.save_download("/view/1", "https://new")
+
+    assert datastore.export(str(tmp_path / "one.csv"), incremental=True) == 1
+    assert datastore.export(str(tmp_path / "two.csv"), incremental=True) == 6
+
+
+def test_export_jsonl(datastore: Datastore, tmp_path: Path) -> None:
+    path = tmp_path / "export.jsonl"
+    datastore.export(str(path), export_format="jsonl", incremental=True)
+    datastore.save_filename("/view/3", "file.png", sha256="abc")
+    datastore.export(str(path), export_format="jsonl", incremental=True)
+
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+    assert len(lines) == 7
+    assert lines[-1]["view"] == "/view/3"
+    assert lines[-1]["sha256"] == "abc"
+    assert set(lines[0]) == EXPECTED_COLUMNS
+
+
+def test_export_unknown_format(datastore: Datastore, tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        datastore.export(str(tmp_path / "export.xml"), export_format="xml")
+
+
+def test_backup_writes_consistent_copy(datastore: Datastore, tmp_path: Path) -> None:
+    datastore._batch_size = 10
+    datastore.save_filename("/view/3", "file.png")
+    target = tmp_path / "snapshot.db"
+
+    datastore.backup(str(target), pages=1)
+
+    with Datastore(str(target)) as copy:
+        assert copy.row_count() == 6
+        assert copy.get_download_to_process("/view/3") is None
+
+
+def test_save_failure_backs_off_exponentially() -> None:
+    now = [1000.0]
+    datastore = Datastore(clock=lambda: now[0])
+    datastore.save_views([("/view/1", "title", "author")])
+    datastore.save_download("/view/1", "https://...")
+
+    datastore.save_failure("/view/1", "Service Unavailable", 503)
+    datastore.save_failure("/view/1", "Service Unavailable", 503)
+
+    assert datastore.get_failure("/view/1") == (
+        2,
+        503,
+        "Service Unavailable",
+        1000 + RETRY_BASE_SECONDS * 2,
+    )
+    assert not datastore.get_downloads_to_process()
+    assert datastore.count_downloads_to_process() == 0
+    assert not list(datastore.iter_downloads_to_process())
+
+    now[0] += RETRY_BASE_SECONDS * 2
+    assert datastore.get_download_to_process("/view/1") is not None
+    assert datastore.count_downloads_to_process() == 1
+
+
+def test_save_failure_backoff_is_capped() -> None:
+    datastore = Datastore(clock=lambda: 0)
+    datastore.save_views([("/view/1", "title", "author")])
+
+    for _ in range(40):
+        datastore.save_failure("/view/1", "ReadError")
+
+    assert datastore.get_failure("/view/1") == (40, None, "ReadError", RETRY_MAX_SECONDS)
+
+
+@pytest.mark.parametrize("status", [404, 410])
+def test_save_failure_permanent_status(datastore: Datastore, status: int) -> None:
+    datastore._clock = lambda: 10**12
+
+    datastore.save_failure("/view/3", "Gone", status)
+
+    assert datastore.get_failure("/view/3") == (1, status, "Gone", None)
+    assert datastore.get_download_to_process("/view/3") is None
+    assert [row[0] for row in datastore.iter_downloads_to_process()] == ["/view/4"]
+
+
+def test_save_filename_clears_failure(datastore: Datastore) -> None:
+    datastore.save_failure("/view/3", "ReadError")
+
+    datastore.save_filename("/view/3", "file.png")
+
+    assert datastore.get_failure("/view/3") == (1, None, None, None)
+
+
+def _status(datastore: Datastore, view: str) -> str:
+    with datastore.cursor() as cursor:
+        cursor.execute("SELECT status FROM downloads WHERE view=?", (view,))
+        return cursor.fetchone()[0]
+
+
+def test_status_follows_each_stage(datastore: Datastore) -> None:
+    datastore.save_views([("/view/7", "title", "author"), ("/view/8", "title", "author")])
+    assert _status(datastore, "/view/7") == "discovered"
+
+    datastore.save_download("/view/7", "https://...")
+    datastore.save_download("/view/8", None)
+    assert _status(datastore, "/view/7") == "resolved"
+    assert _status(datastore, "/view/8") == "unavailable"
+    assert "/view/8" not in datastore.get_views_to_download()
+
+    datastore.save_failure("/view/7", "ReadError")
+    assert _status(datastore, "/view/7") == "resolved"
+    datastore.save_failure("/view/7", "Not Found", 404)
+    assert _status(datastore, "/view/7") == "failed"
+
+    datastore.save_filename("/view/3", "file.png")
+    assert _status(datastore, "/view/3") == "downloaded"
+
+
+def test_open_infers_status_of_old_rows(tmp_path: Path) -> None:
+    database = str(tmp_path / "old.db")
+    conn = sqlite3.connect(database)
+    conn.execute(
+        "CREATE TABLE downloads (view TEXT NOT NULL, title TEXT NOT NULL, author TEXT NOT NULL, "
+        "view_date TEXT NOT NULL, download TEXT, download_date TEXT, filename TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO downloads VALUES (?, 't', 'a', 'date', ?, NULL, ?)",
+        [
+            ("/view/1", None, None),
+            ("/view/2", "https://...", None),
+            ("/view/3", "https://...", "f"),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    store = Datastore(database)
+
+    assert [_status(store, f"/view/{idx}") for idx in (1, 2, 3)] == [
+        "discovered",
+        "resolved",
+        "downloaded",
+    ]
+    assert store.get_views_to_download() == ["/view/1"]
+    with store.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        indexes = {row[0] for row in cursor.fetchall()}
+    assert "work_queue" in indexes
+    assert not indexes & {"to_resolve", "to_download"}
+
+
+def test_verify_cache_and_requeue(datastore: Datastore) -> None:
+    datastore.save_filename("/view/5", "somefauser-someimage.png", sha256="ab", size=3)
+    datastore.save_verified("somefauser-someimage.png", 3, 1000, "ab")
+
+    files = list(datastore.iter_files_to_verify(batch_size=1))
+
+    assert files == [
+        ("somefauser-someimage.png", "ab", 3, (3, 1000, "ab")),
+        ("somefauser-someimage02.png", None, None, None),
+    ]
+
+    datastore.requeue_download("somefauser-someimage.png", "Verify: truncated")
+
+    assert _status(datastore, "/view/5") == "resolved"
+    assert datastore.get_failure("/view/5") == (0, None, "Verify: truncated", None)
+    assert "/view/5" in {row[0] for row in datastore.iter_downloads_to_process()}
+    assert [row[0] for row in datastore.iter_files_to_verify()] == ["somefauser-someimage02.png"]
+
+
+@pytest.fixture
+def workers(shared_datastores: tuple[Datastore, Datastore]) -> tuple[Datastore, Datastore]:
+    first, second = shared_datastores
+    first.save_views([(f"/view/{idx}", "title", "author") for idx in range(6)])
+    for idx in range(6):
+        first.save_download(f"/view/{idx}", "https://...")
+    return first, second
+
+
+def test_claims_split_work_between_workers(workers: tuple[Datastore, Datastore]) -> None:
+    first, second = workers
+
+    claimed = [row[0] for row in first.claim_downloads(4)]
+    rest = [row[0] for row in second.iter_downloads_to_process(batch_size=2)]
+
+    assert claimed == ["/view/0", "/view/1", "/view/2", "/view/3"]
+    assert rest == ["/view/4", "/view/5"]
+    assert second.get_download_to_process("/view/0") is None
+    assert first.get_download_to_process("/view/0") is not None
+
+
+def test_claims_are_released_on_save_and_close(workers: tuple[Datastore, Datastore]) -> None:
+    first, second = workers
+    first.claim_downloads(6)
+
+    first.save_filename("/view/0", "file.png")
+    first.save_failure("/view/1", "ReadError")
+    assert second.claim_downloads(6) == []
+
+    first.close()
+    assert [row[0] for row in second.claim_downloads(6)] == [f"/view/{idx}" for idx in (2, 3, 4, 5)]
+
+
+def test_expired_leases_are_reclaimed(
+    workers: tuple[Datastore, Datastore], clock: FakeClock
+) -> None:
+    first, second = workers
+    first.claim_downloads(2)
+
+    clock.now += LEASE_SECONDS / 2
+    first.renew_leases()
+    clock.now += LEASE_SECONDS / 2
+    assert [row[0] for row in second.claim_downloads(2)] == ["/view/2", "/view/3"]
+
+    clock.now += LEASE_SECONDS
+    assert [row[0] for row in second.claim_downloads(2)] == ["/view/0", "/view/1"]
+
+
+def test_keep_claim_refuses_rows_taken_or_done(
+    workers: tuple[Datastore, Datastore], clock: FakeClock
+) -> None:
+    first, second = workers
+    rows = first.claim_downloads(2)
+
+    assert first.keep_claim("/view/0")
+    assert not second.keep_claim("/view/0")
+
+    # Downloaded by the first worker after the second queued it
+    first.save_filename("/view/1", "file.png")
+    first.flush()
+    clock.now += LEASE_SECONDS
+    assert not second.keep_claim(rows[1][0])
+
+
+def test_iterators_renew_leases(workers: tuple[Datastore, Datastore], clock: FakeClock) -> None:
+    first, second = workers
+
+    rows = first.iter_downloads_to_process(batch_size=6)
+    next(rows)
+    clock.now += LEASE_SECONDS * 0.75
+    next(rows)
+    clock.now += LEASE_SECONDS * 0.5
+
+    assert second.claim_downloads(6) == []
+
+
+def test_claims_are_not_changes(datastore: Datastore, tmp_path: Path) -> None:
+    path = tmp_path / "export.csv"
+    datastore.export(str(path), incremental=True)
+
+    list(datastore.iter_downloads_to_process())
+    datastore.release_claims()
+
+    assert datastore.export(str(path), incremental=True) == 0
+
+
+def test_concurrent_claims_never_overlap(tmp_path: Path) -> None:
+    database = str(tmp_path / "shared.db")
+    with Datastore(database) as datastore:
+        datastore.save_views([(f"/view/{idx:03d}", "title", "author") for idx in range(200)])
+
+    claimed: list[str] = []
+    errors: list[Exception] = []
+
+    def work(worker_id: str) -> None:
+        try:
+            with Datastore(database, worker_id=worker_id) as datastore:
+                while views := datastore.claim_views(3):
+                    claimed.extend(views)
+                    for view in views:
+                        datastore.save_download(view, None)
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=work, args=(f"worker{idx}",)) for idx in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert sorted(claimed) == sorted(set(claimed))
+    assert len(claimed) == 200
+
+
+def test_open_recreates_outdated_change_trigger(tmp_path: Path) -> None:
+    database = str(tmp_path / "old.db")
+    Datastore(database).close()
+    conn = sqlite3.connect(database)
+    conn.executescript("""
+        DROP TRIGGER track_update;
+        CREATE TRIGGER track_update AFTER UPDATE ON downloads
+            WHEN NEW.change_seq IS OLD.change_seq
+        BEGIN
+            UPDATE downloads SET change_seq = change_seq + 1 WHERE rowid = NEW.rowid;
+        END;
+        """)
+    conn.close()
+
+    with Datastore(database) as datastore:
+        with datastore.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'track_update'")
+            assert "UPDATE OF" in cursor.fetchone()[0]
+
+
+def test_save_filename_leaves_rows_claimed_by_others(
+    workers: tuple[Datastore, Datastore], clock: FakeClock
+) -> None:
+    first, second = workers
+    first.claim_downloads(1)
+    clock.now += LEASE_SECONDS
+    second.claim_downloads(1)
+
+    first.save_filename("/view/0", "stale.png")
+    first.flush()
+
+    assert list(first.iter_filenames()) == []
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from fafav_downloader.extractor import extract_page
+
+FAVORITES_PAGE = Path("tests/fixtures/fav_page.html").read_text(encoding="utf-8")
+USER_NAME = "wolf-nymph"
+VIEW_PAGE = Path("tests/fixtures/view_page.html").read_text(encoding="utf-8")
+
+
+def test_extract_favorites_page() -> None:
+    result = extract_page(FAVORITES_PAGE, USER_NAME)
+
+    assert len(result.favorites) == 128
+    assert ("/view/62382851/", "Agate Dragon", "allagar") in result.favorites
+    assert result.next_page == f"/favorites/{USER_NAME}/1745887089/next"
+    assert result.download_url is None
+
+
+def test_extract_view_page() -> None:
+    expected = (
+        "https://d.furaffinity.net/art/greekceltic/1757948691/1757948691.greekceltic_sticklegs2.png"
+    )
+
+    result = extract_page(VIEW_PAGE)
+
+    assert result.download_url == expected
+    assert result.next_page is None
+    assert not result.favorites
+
+
+def test_next_page_ignores_username_case() -> None:
+    result = extract_page(FAVORITES_PAGE, USER_NAME.upper())
+
+    assert result.next_page == f"/favorites/{USER_NAME}/1745887089/next"
+
+
+def test_username_is_escaped() -> None:
+    body = '<form action="/favorites/wolfxnymph/1/next" method="get">'
+
+    result = extract_page(body, "wolf.nymph")
+
+    assert result.next_page is None
+
+
+def test_pathological_lines_find_nothing() -> None:
+    unterminated_links = '<a href="/user/abc' * 500
+    block = (
+        "<figcaption>\n  <p>\n"
+        f'    <a href="/view/1/" title="{"x" * 5000}">t</a>{" y" * 5000}\n'
+        "  </p>\n  <p>\n"
+        f"{unterminated_links}\n"
+    )
+
+    result = extract_page(block * 10)
+
+    assert not result.favorites
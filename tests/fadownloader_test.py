@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import hashlib
+import threading
 from pathlib import Path
 from unittest.mock import MagicMock
 
@@ -8,6 +10,8 @@ import pytest
 
 from fafav_downloader import fadownloader
 from fafav_downloader.datastore import Datastore
+from fafav_downloader.filenames import FilenameIndex
+from fafav_downloader.filesink import FileSink
 
 FAVORITES_PAGE = Path("tests/fixtures/fav_page.html").read_text(encoding="utf-8")
 USER_NAME = "wolf-nymph"
@@ -118,6 +122,45 @@ def test_save_download_links(datastore: Datastore) -> None:
     assert not datastore.get_views_to_download()
 
 
+def test_download_favorite_files_stops_after_current_file(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    stop = threading.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        stop.set()
+        return httpx.Response(200, content=b"x" * 10)
+
+    http_client = httpx.Client(transport=httpx.MockTransport(handler))
+    remaining = datastore.count_downloads_to_process()
+
+    fadownloader.download_favorite_files(http_client, datastore, stop=stop)
+
+    assert len(list(tmp_path.iterdir())) == 1
+    assert datastore.count_downloads_to_process() == remaining - 1
+
+
+def test_download_favorite_files_uses_given_filename_index(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    monkeypatch.setattr(FilenameIndex, "from_datastore", MagicMock(side_effect=AssertionError))
+    names = FilenameIndex()
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"x" * 10))
+
+    fadownloader.download_favorite_files(httpx.Client(transport=transport), datastore, names=names)
+    fadownloader.correct_file_extensions(datastore, names=names)
+
+    downloaded = {path.name for path in tmp_path.iterdir()}
+    assert downloaded
+    assert all(filename in names for filename in downloaded)
+
+
 def test_save_view_over_existing_download_does_not_change_row() -> None:
     datastore = Datastore(":memory:")
     datastore.save_view(("/view/123456789", "title", "author"))
@@ -141,3 +184,373 @@ def test_sanitize_filename(filename: str, expected: str) -> None:
     result = fadownloader._sanitize_filename(filename)
 
     assert result == expected
+
+
+def test_download_favorite_files(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"x" * 10))
+    http_client = httpx.Client(transport=transport)
+
+    fadownloader.download_favorite_files(http_client, datastore, chunk_size=3)
+
+    assert {path.read_bytes() for path in tmp_path.iterdir()} == {b"x" * 10}
+    assert len(list(tmp_path.iterdir())) == 2
+    assert not datastore.get_downloads_to_process()
+
+
+def test_save_view_links_stops_on_known_pages() -> None:
+    datastore = Datastore()
+    datastore.save_views(list(fadownloader.get_favorite_data(FAVORITES_PAGE)), USER_NAME)
+    mockhttp = MagicMock(get=MagicMock(return_value=httpx.Response(200, content=FAVORITES_PAGE)))
+
+    fadownloader.save_view_links(USER_NAME, mockhttp, datastore, known_pages=2)
+
+    assert mockhttp.get.call_count == 2
+
+
+def test_save_view_links_full_scan_walks_every_page() -> None:
+    datastore = Datastore()
+    datastore.save_views(list(fadownloader.get_favorite_data(FAVORITES_PAGE)), USER_NAME)
+    seff = [httpx.Response(200, content=FAVORITES_PAGE)] * 4 + [httpx.Response(200, content="")]
+    mockhttp = MagicMock(get=MagicMock(side_effect=seff))
+
+    fadownloader.save_view_links(USER_NAME, mockhttp, datastore, known_pages=None)
+
+    assert mockhttp.get.call_count == 5
+
+
+@pytest.mark.parametrize("duplicates,expected_files", [("hardlink", 2), ("skip", 1)])
+def test_download_favorite_files_deduplicates_content(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    duplicates: str,
+    expected_files: int,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"same"))
+    http_client = httpx.Client(transport=transport)
+
+    fadownloader.download_favorite_files(http_client, datastore, duplicates=duplicates)
+
+    files = list(tmp_path.iterdir())
+    with datastore.cursor() as cursor:
+        cursor.execute(
+            "SELECT filename, sha256 FROM downloads WHERE view IN ('/view/3', '/view/4')"
+        )
+        rows = cursor.fetchall()
+
+    assert len(files) == expected_files
+    assert files[0].stat().st_nlink == expected_files
+    assert len({sha256 for _, sha256 in rows}) == 1
+    assert len({filename for filename, _ in rows}) == expected_files
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        (b"\x89PNG\r\n\x1a\n\x00\x00", "png"),
+        (b"GIF89a\x00", "gif"),
+        (b"\xff\xd8\xff\xe0", "jpg"),
+        (b"RIFF\x10\x00\x00\x00WEBPVP8 ", "webp"),
+        (b"\x00\x00\x00\x18ftypmp42", "mp4"),
+        (b"\x1a\x45\xdf\xa3\x9f", "webm"),
+        (b"CWS\x0a", "swf"),
+        (b"%PDF-1.7", "pdf"),
+        (b"{\\rtf1\\ansi", "rtf"),
+        (b"Once upon a time,\r\nthere was a \xc3\xa9", "txt"),
+        (b"Cut off multibyte \xe2\x82", "txt"),
+        (b"\x00\x01\x02\x03", None),
+        (b"", None),
+    ],
+)
+def test_sniff_extension(header: bytes, expected: str | None) -> None:
+    assert fadownloader.sniff_extension(header) == expected
+
+
+def test_download_names_file_by_sniffed_type(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    content = b"GIF89a" + b"\x00" * 100
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=content))
+    http_client = httpx.Client(transport=transport)
+
+    fadownloader.download_favorite_files(http_client, datastore, chunk_size=2)
+
+    with datastore.cursor() as cursor:
+        cursor.execute("SELECT filename, filetype FROM downloads WHERE view='/view/3'")
+        filename, filetype = cursor.fetchone()
+
+    assert filename == "author-title.gif"
+    assert filetype == "gif"
+
+
+def test_correct_file_extensions_repairs_unknown_types(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    (tmp_path / "somefauser-someimage.png").write_bytes(b"\xff\xd8\xff\xe0")
+    (tmp_path / "somefauser-someimage.jpg").write_bytes(b"taken")
+
+    fadownloader.correct_file_extensions(datastore)
+
+    with datastore.cursor() as cursor:
+        cursor.execute(
+            "SELECT filename, filetype FROM downloads WHERE view IN ('/view/5', '/view/6')"
+        )
+        rows = sorted(cursor.fetchall())
+
+    assert (tmp_path / "somefauser-someimage-0001.jpg").read_bytes() == b"\xff\xd8\xff\xe0"
+    assert not (tmp_path / "somefauser-someimage.png").exists()
+    assert rows == [
+        ("somefauser-someimage-0001.jpg", "jpg"),
+        ("somefauser-someimage02.png", None),
+    ]
+
+
+def test_download_favorite_files_into_layout(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    content = b"GIF89a" + b"\x00" * 100
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=content))
+    http_client = httpx.Client(transport=transport)
+
+    fadownloader.download_favorite_files(http_client, datastore, layout="author")
+
+    with datastore.cursor() as cursor:
+        cursor.execute("SELECT filename FROM downloads WHERE view='/view/3'")
+        (filename,) = cursor.fetchone()
+
+    assert filename == "author/author-title.gif"
+    assert (tmp_path / filename).read_bytes() == content
+
+
+def test_migrate_layout_moves_library(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    for filename in datastore.iter_filenames():
+        (tmp_path / filename).write_bytes(filename.encode())
+
+    fadownloader.migrate_layout(datastore, "author")
+
+    filenames = list(datastore.iter_filenames())
+    assert all(filename.startswith("author/") for filename in filenames)
+    assert all((tmp_path / filename).read_bytes() for filename in filenames)
+    assert {path.name for path in tmp_path.iterdir()} == {"author"}
+
+    fadownloader.migrate_layout(datastore, "flat")
+
+    assert all("/" not in filename for filename in datastore.iter_filenames())
+    assert all(path.is_file() for path in tmp_path.iterdir())
+
+
+def test_migrate_layout_resumes_interrupted_move(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    with datastore.cursor(commit_on_exit=True) as cursor:
+        cursor.execute(
+            "UPDATE downloads SET sha256=? WHERE filename='somefauser-someimage.png'",
+            (hashlib.sha256(b"moved").hexdigest(),),
+        )
+    (tmp_path / "author").mkdir()
+    (tmp_path / "author" / "somefauser-someimage.png").write_bytes(b"unrelated")
+    (tmp_path / "author" / "somefauser-someimage-0001.png").write_bytes(b"moved")
+
+    fadownloader.migrate_layout(datastore, "author")
+
+    filenames = set(datastore.iter_filenames())
+    assert "author/somefauser-someimage-0001.png" in filenames
+    assert "author/somefauser-someimage.png" not in filenames
+
+
+def test_migrate_layout_resumes_move_of_file_without_hash(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    (tmp_path / "author").mkdir()
+    (tmp_path / "author" / "somefauser-someimage.png").write_bytes(b"moved")
+
+    fadownloader.migrate_layout(datastore, "author")
+
+    assert "author/somefauser-someimage.png" in set(datastore.iter_filenames())
+
+
+def test_hash_layout_keeps_postfixed_files_in_place(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    datastore = Datastore()
+    names = FilenameIndex()
+    for view in ("/view/1", "/view/2"):
+        datastore.save_view((view, "t", "a"))
+        filename = fadownloader._build_filename("a", "t", "x.png", names, "png", "hash")
+        (tmp_path / filename).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / filename).write_bytes(view.encode())
+        datastore.save_filename(view, filename)
+    before = set(datastore.iter_filenames())
+
+    fadownloader.migrate_layout(datastore, "hash")
+
+    assert set(datastore.iter_filenames()) == before
+    assert len({filename.rsplit("/", 1)[0] for filename in before}) == 1
+
+
+def test_pool_configs_from_arguments() -> None:
+    args = fadownloader.parse_args(["user", "--cdn-connections", "16", "--read-timeout", "5"])
+
+    site_pool, cdn_pool = fadownloader._pool_configs(args)
+
+    assert site_pool.max_connections == fadownloader.SITE_POOL.max_connections
+    assert cdn_pool.max_connections == 16
+    assert site_pool.read_timeout == cdn_pool.read_timeout == 5
+    assert site_pool.connect_timeout == fadownloader.SITE_POOL.connect_timeout
+
+
+def test_watch_cannot_be_combined_with_async() -> None:
+    with pytest.raises(SystemExit):
+        fadownloader.parse_args(["user", "--watch", "--pipeline"])
+
+
+def test_download_favorite_files_records_failures(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/gone":
+            return httpx.Response(410)
+        raise httpx.ConnectError("refused")
+
+    datastore.save_download("/view/3", "https://d.furaffinity.net/gone")
+    datastore.save_download("/view/4", "https://d.furaffinity.net/flaky")
+    http_client = httpx.Client(transport=httpx.MockTransport(handler))
+
+    fadownloader.download_favorite_files(http_client, datastore)
+
+    assert datastore.get_failure("/view/3") == (1, 410, "Gone", None)
+    failure = datastore.get_failure("/view/4")
+    assert failure is not None
+    assert failure[:3] == (1, None, "ConnectError: refused")
+    assert failure[3] is not None
+    assert not datastore.get_downloads_to_process()
+
+
+def test_save_download_links_marks_unavailable_views() -> None:
+    datastore = Datastore()
+    datastore.save_views([("/view/1/", "title", "author"), ("/view/2/", "title", "author")])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/view/1/":
+            return httpx.Response(200, text="<html>Submission not found</html>")
+        return httpx.Response(503)
+
+    http_client = httpx.Client(transport=httpx.MockTransport(handler))
+    fadownloader.save_download_links(http_client, datastore)
+
+    assert datastore.get_views_to_download() == ["/view/2/"]
+    assert datastore.count_downloads_to_process() == 0
+
+
+def test_usernames_are_only_required_to_scan() -> None:
+    assert fadownloader.parse_args(["--verify"]).usernames == []
+    assert fadownloader.parse_args(["--migrate-layout", "--layout", "hash"]).usernames == []
+
+    with pytest.raises(SystemExit):
+        fadownloader.parse_args(["--watch"])
+    with pytest.raises(SystemExit):
+        fadownloader.parse_args(["--pipeline"])
+
+
+def test_bandwidth_limiter_from_arguments() -> None:
+    args = fadownloader.parse_args(
+        ["user", "--bandwidth-limit", "1M", "--bandwidth-schedule", "01:00-07:00=unlimited"]
+    )
+
+    limiter = fadownloader._bandwidth_limiter(args)
+
+    assert limiter is not None
+    assert limiter.rate == 1024**2
+    assert limiter.schedule[0].rate is None
+    assert fadownloader._bandwidth_limiter(fadownloader.parse_args(["user"])) is None
+
+
+def test_bandwidth_limit_rejects_invalid_rate() -> None:
+    with pytest.raises(SystemExit):
+        fadownloader.parse_args(["user", "--bandwidth-limit", "fast"])
+
+
+def test_commit_takes_next_name_when_taken(tmp_path: Path) -> None:
+    names = FilenameIndex(["author-title.png"])
+    # Placed by another process after the index was seeded
+    (tmp_path / "author-title.png").write_bytes(b"other")
+
+    with FileSink(tmp_path) as sink:
+        sink.write(b"content")
+        filename = fadownloader._commit(sink, "author-title.png", names)
+
+    assert filename == "author-title-0001.png"
+    assert (tmp_path / filename).read_bytes() == b"content"
+    assert (tmp_path / "author-title.png").read_bytes() == b"other"
+
+
+def test_link_takes_next_name_when_taken(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    names = FilenameIndex(["author-first.png", "author-title.png"])
+    (tmp_path / "author-first.png").write_bytes(b"content")
+    # Placed by another process after the index was seeded
+    (tmp_path / "author-title.png").write_bytes(b"other")
+
+    filename = fadownloader._link("author-first.png", "author-title.png", names)
+
+    assert filename == "author-title-0001.png"
+    assert (tmp_path / filename).stat().st_nlink == 2
+    assert (tmp_path / "author-title.png").read_bytes() == b"other"
+
+
+def test_download_favorite_files_batches_commits(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    datastore = Datastore(str(tmp_path / "test.db"), batch_size=200, flush_ms=60_000)
+    views = [f"/view/{idx}" for idx in range(50)]
+    datastore.save_views([(view, view[6:], "author") for view in views])
+    for view in views:
+        datastore.save_download(view, f"https://d.furaffinity.net{view}.png")
+    datastore.flush()
+    statements: list[str] = []
+    datastore._dbconn.set_trace_callback(statements.append)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"same"))
+
+    fadownloader.download_favorite_files(httpx.Client(transport=transport), datastore)
+    datastore.flush()
+
+    assert statements.count("COMMIT") <= 3
+    assert len(list(datastore.iter_filenames())) == 50
+    assert datastore.count_downloads_to_process() == 0
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+
+from fafav_downloader.datastore import Datastore
+from fafav_downloader.filenames import FilenameIndex
+
+
+def test_allocate_free_name_unchanged() -> None:
+    names = FilenameIndex()
+
+    assert names.allocate("author-title.png", ".png") == "author-title.png"
+    assert "author-title.png" in names
+
+
+def test_allocate_postfixes_taken_names() -> None:
+    names = FilenameIndex(["author-title.png"])
+
+    assert names.allocate("author-title.png", ".png") == "author-title-0001.png"
+    assert names.allocate("author-title.png", ".png") == "author-title-0002.png"
+    assert names.allocate("author-title.jpg", ".jpg") == "author-title.jpg"
+
+
+def test_seeded_postfixes_are_skipped() -> None:
+    names = FilenameIndex(["author-title.png", "author-title-0007.png"])
+
+    assert names.allocate("author-title.png", ".png") == "author-title-0008.png"
+
+
+def test_rename_frees_old_name() -> None:
+    names = FilenameIndex(["author-title.unknown"])
+
+    names.rename("author-title.unknown", "author-title.png")
+
+    assert "author-title.unknown" not in names
+    assert names.allocate("author-title.unknown", ".unknown") == "author-title.unknown"
+    assert names.allocate("author-title.png", ".png") == "author-title-0001.png"
+
+
+def test_from_datastore_includes_directory(tmp_path: Path) -> None:
+    datastore = Datastore()
+    datastore.save_view(("/view/1", "title", "author"))
+    datastore.save_filename("/view/1", "saved.png")
+    (tmp_path / "on_disk.png").write_bytes(b"")
+
+    names = FilenameIndex.from_datastore(datastore, tmp_path)
+
+    assert "saved.png" in names
+    assert "on_disk.png" in names
+
+
+def test_concurrent_allocations_are_unique() -> None:
+    names = FilenameIndex()
+    allocated: list[str] = []
+
+    def allocate() -> None:
+        for _ in range(100):
+            allocated.append(names.allocate("author-title.png", ".png"))
+
+    threads = [threading.Thread(target=allocate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(allocated)) == 400
+
+
+def test_from_datastore_scans_subdirectories(tmp_path: Path) -> None:
+    (tmp_path / "author").mkdir()
+    (tmp_path / "author" / "author-title.png").write_bytes(b"")
+
+    names = FilenameIndex.from_datastore(Datastore(), tmp_path)
+
+    assert "author/author-title.png" in names
+    assert names.allocate("author/author-title.png", ".png") == "author/author-title-0001.png"
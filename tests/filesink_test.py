@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from fafav_downloader.filesink import FileSink
+
+
+def test_commit_moves_file_into_place(tmp_path: Path) -> None:
+    with FileSink(tmp_path) as sink:
+        sink.write(b"some ")
+        sink.write(b"bytes")
+        target = sink.commit("final.png")
+
+    assert target == tmp_path / "final.png"
+    assert target.read_bytes() == b"some bytes"
+    assert sink.size == 10
+    assert list(tmp_path.iterdir()) == [target]
+
+
+def test_commit_never_replaces_existing_file(tmp_path: Path) -> None:
+    (tmp_path / "final.png").write_bytes(b"taken")
+
+    with FileSink(tmp_path) as sink:
+        sink.write(b"some bytes")
+        with pytest.raises(FileExistsError):
+            sink.commit("final.png")
+        target = sink.commit("other.png")
+
+    assert (tmp_path / "final.png").read_bytes() == b"taken"
+    assert target.read_bytes() == b"some bytes"
+    assert {path.name for path in tmp_path.iterdir()} == {"final.png", "other.png"}
+
+
+def test_incomplete_body_leaves_no_file(tmp_path: Path) -> None:
+    with pytest.raises(ConnectionError):
+        with FileSink(tmp_path) as sink:
+            sink.write(b"partial")
+            raise ConnectionError()
+
+    assert not list(tmp_path.iterdir())
+
+
+def test_sha256_of_written_content(tmp_path: Path) -> None:
+    with FileSink(tmp_path) as sink:
+        sink.write(b"some ")
+        sink.write(b"bytes")
+
+    assert sink.sha256 == hashlib.sha256(b"some bytes").hexdigest()
+
+
+def test_header_keeps_leading_bytes(tmp_path: Path) -> None:
+    with FileSink(tmp_path) as sink:
+        sink.write(b"ab")
+        sink.write(b"c" * 100)
+
+    assert sink.header == b"ab" + b"c" * 62
+
+
+def test_part_file_is_kept_on_error(tmp_path: Path) -> None:
+    with pytest.raises(ConnectionError):
+        with FileSink(tmp_path, ".view-1.part") as sink:
+            sink.write(b"partial")
+            raise ConnectionError()
+
+    assert (tmp_path / ".view-1.part").read_bytes() == b"partial"
+
+
+def test_part_file_resumes_at_offset(tmp_path: Path) -> None:
+    (tmp_path / ".view-1.part").write_bytes(b"some unrecorded")
+
+    with FileSink(tmp_path, ".view-1.part", offset=5) as sink:
+        assert sink.size == 5
+        sink.write(b"bytes")
+        target = sink.commit("final.png")
+
+    assert target.read_bytes() == b"some bytes"
+    assert sink.sha256 == hashlib.sha256(b"some bytes").hexdigest()
+    assert sink.header == b"some bytes"
+    assert list(tmp_path.iterdir()) == [target]
+
+
+def test_part_file_restart(tmp_path: Path) -> None:
+    with FileSink(tmp_path, ".view-1.part") as sink:
+        sink.write(b"stale")
+        sink.restart()
+        sink.write(b"fresh")
+        target = sink.commit("final.png")
+
+    assert target.read_bytes() == b"fresh"
+    assert sink.sha256 == hashlib.sha256(b"fresh").hexdigest()
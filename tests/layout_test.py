@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import pytest
+
+from fafav_downloader.layout import join_path
+from fafav_downloader.layout import shard_directory
+from fafav_downloader.layout import split_path
+
+VIEW_DATE = "2024-05-17 10:11:12.131415+00:00"
+
+
+@pytest.mark.parametrize(
+    "layout,expected",
+    [
+        ("flat", ""),
+        ("author", "author"),
+        ("date", "2024/05"),
+    ],
+)
+def test_shard_directory(layout: str, expected: str) -> None:
+    assert shard_directory(layout, "author-title.png", "author", VIEW_DATE) == expected
+
+
+def test_shard_directory_hash_is_two_stable_levels() -> None:
+    directory = shard_directory("hash", "author-title.png", "author", VIEW_DATE)
+
+    assert len(directory) == 5
+    assert directory[2] == "/"
+    assert directory == shard_directory("hash", "author-title.png", "other", None)
+    assert directory == shard_directory("hash", "author-title-0001.png", "author", None)
+    assert directory != shard_directory("hash", "author-other.png", "author", None)
+
+
+def test_shard_directory_missing_values() -> None:
+    assert shard_directory("author", "title.png", "", VIEW_DATE) == "unknown"
+    assert shard_directory("date", "title.png", "author", None) == "unknown"
+
+
+def test_shard_directory_unknown_layout() -> None:
+    with pytest.raises(ValueError):
+        shard_directory("sideways", "title.png", "author", VIEW_DATE)
+
+
+def test_join_and_split_path() -> None:
+    assert join_path("", "title.png") == "title.png"
+    assert join_path("ab/cd", "title.png") == "ab/cd/title.png"
+    assert split_path("ab/cd/title.png") == ("ab/cd", "title.png")
+    assert split_path("title.png") == ("", "title.png")
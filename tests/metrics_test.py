@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import httpx
+
+from fafav_downloader.datastore import Datastore
+from fafav_downloader.metrics import METRICS
+from fafav_downloader.metrics import Metrics
+from fafav_downloader.metrics import MetricsWriter
+from fafav_downloader.metrics import Progress
+from fafav_downloader.ratelimit import AdaptiveRateLimiter
+from fafav_downloader.ratelimit import RateLimitedTransport
+
+
+def test_counters_and_histograms_snapshot() -> None:
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.inc("requests_total", host="a")
+    metrics.inc("requests_total", 2, host="a")
+    metrics.observe("latency_seconds", 0.5, host="a")
+    metrics.observe("latency_seconds", 5, host="a")
+
+    snapshot = metrics.snapshot()
+
+    assert snapshot["counters"] == [{"name": "requests_total", "labels": {"host": "a"}, "value": 3}]
+    histogram = snapshot["histograms"][0]
+    assert histogram["buckets"] == {"0.1": 0, "1.0": 1, "+Inf": 2}
+    assert histogram["sum"] == 5.5
+    assert histogram["count"] == 2
+
+
+def test_prometheus_text_format() -> None:
+    metrics = Metrics(buckets=(1.0,))
+    metrics.inc("responses_total", host="a", status="200")
+    metrics.inc("responses_total", host='b"', status="404")
+    metrics.observe("latency_seconds", 0.5)
+
+    text = metrics.to_prometheus()
+
+    assert text.count("# TYPE fadownload_responses_total counter") == 1
+    assert 'fadownload_responses_total{host="a",status="200"} 1' in text
+    assert 'fadownload_responses_total{host="b\\"",status="404"} 1' in text
+    assert 'fadownload_latency_seconds_bucket{le="1.0"} 1' in text
+    assert 'fadownload_latency_seconds_bucket{le="+Inf"} 1' in text
+    assert "fadownload_latency_seconds_count 1" in text
+
+
+def test_writer_writes_on_exit(tmp_path: Path) -> None:
+    metrics = Metrics()
+    metrics.inc("items_total")
+
+    with MetricsWriter(tmp_path / "metrics.json", metrics, interval=60):
+        pass
+    with MetricsWriter(tmp_path / "metrics.prom", metrics, interval=60):
+        pass
+
+    snapshot = json.loads((tmp_path / "metrics.json").read_text())
+    assert snapshot["counters"][0]["value"] == 1
+    assert "fadownload_items_total 1" in (tmp_path / "metrics.prom").read_text()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["metrics.json", "metrics.prom"]
+
+
+def test_progress_rate_and_eta() -> None:
+    now = [0.0]
+    metrics = Metrics()
+    progress = Progress("download", 10, metrics, clock=lambda: now[0])
+
+    now[0] = 2.0
+    progress.advance()
+    now[0] = 4.0
+    message = progress.advance()
+
+    assert message == "(2 / 10, 0.5/s, ETA 16s)"
+    assert metrics.value("stage_items_total", stage="download") == 2
+    assert Progress("scan", None, metrics, clock=lambda: 1.0).advance() == "(1, 0.0/s)"
+
+
+def test_transport_records_status_latency_and_retries() -> None:
+    METRICS.reset()
+    statuses = iter([503, 200])
+    transport = RateLimitedTransport(
+        httpx.MockTransport(lambda request: httpx.Response(next(statuses))),
+        AdaptiveRateLimiter(initial_rate=1000, burst=10),
+    )
+
+    httpx.Client(transport=transport).get("https://example.com/")
+
+    assert METRICS.value("http_responses_total", host="example.com", status="503") == 1
+    assert METRICS.value("http_responses_total", host="example.com", status="200") == 1
+    assert METRICS.value("http_retries_total", host="example.com") == 1
+    histograms = {item["name"] for item in METRICS.snapshot()["histograms"]}
+    assert {"http_request_seconds", "ratelimit_wait_seconds"} <= histograms
+
+
+def test_datastore_records_commits() -> None:
+    METRICS.reset()
+    store = Datastore()
+
+    store.save_download("/view/1", "https://...")
+
+    assert METRICS.value("db_rows_written_total") == 1
+    histograms = {item["name"] for item in METRICS.snapshot()["histograms"]}
+    assert "db_commit_seconds" in histograms
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+
+import httpx
+
+from fafav_downloader.pagecache import AsyncCachingTransport
+from fafav_downloader.pagecache import CachingTransport
+from fafav_downloader.pagecache import PageCache
+from tests.conftest import FakeClock
+
+VIEW_URL = "https://www.furaffinity.net/view/1/"
+FAVORITES_URL = "https://www.furaffinity.net/favorites/user/"
+HTML = {"content-type": "text/html; charset=UTF-8", "etag": '"v1"'}
+
+
+def make_server(
+    body: bytes = b"<html>page</html>",
+) -> tuple[list[httpx.Request], httpx.MockTransport]:
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("if-none-match") == HTML["etag"]:
+            return httpx.Response(304)
+        return httpx.Response(200, headers=HTML, content=body)
+
+    return requests, httpx.MockTransport(handler)
+
+
+def test_fresh_page_served_from_cache(clock: FakeClock) -> None:
+    cache = PageCache(clock=clock)
+    requests, server = make_server()
+    client = httpx.Client(transport=CachingTransport(server, cache))
+
+    first = client.get(VIEW_URL)
+    second = client.get(VIEW_URL)
+
+    assert first.text == second.text == "<html>page</html>"
+    assert len(requests) == 1
+    assert (cache.hits, cache.revalidated, cache.misses) == (1, 0, 1)
+    assert cache.hit_rate() == 0.5
+
+
+def test_stale_page_is_revalidated(clock: FakeClock) -> None:
+    cache = PageCache(ttl=60, clock=clock)
+    requests, server = make_server()
+    client = httpx.Client(transport=CachingTransport(server, cache))
+
+    client.get(VIEW_URL)
+    clock.now += 61
+    response = client.get(VIEW_URL)
+
+    assert response.text == "<html>page</html>"
+    assert requests[1].headers["if-none-match"] == '"v1"'
+    assert cache.revalidated == 1
+
+
+def test_favorites_always_revalidated(clock: FakeClock) -> None:
+    cache = PageCache(clock=clock)
+    requests, server = make_server()
+    client = httpx.Client(transport=CachingTransport(server, cache))
+
+    client.get(FAVORITES_URL)
+    client.get(FAVORITES_URL)
+
+    assert len(requests) == 2
+    assert cache.revalidated == 1
+
+
+def test_only_html_is_cached(clock: FakeClock) -> None:
+    cache = PageCache(clock=clock)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"bytes"))
+    client = httpx.Client(transport=CachingTransport(transport, cache))
+
+    client.get(VIEW_URL)
+
+    assert cache.get(VIEW_URL) is None
+
+
+def test_encoded_body_is_stored_decoded(clock: FakeClock) -> None:
+    cache = PageCache(clock=clock)
+    headers = {**HTML, "content-encoding": "gzip"}
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, headers=headers, content=gzip.compress(b"<html>"))
+    )
+    client = httpx.Client(transport=CachingTransport(transport, cache))
+
+    response = client.get(VIEW_URL)
+    entry = cache.get(VIEW_URL)
+
+    assert response.text == "<html>"
+    assert entry is not None and entry.body == b"<html>"
+
+
+def test_least_recently_used_pages_evicted(clock: FakeClock) -> None:
+    cache = PageCache(max_bytes=50, clock=clock)
+    page = bytes(range(40))
+
+    cache.store("https://a/", httpx.Headers(HTML), page)
+    clock.now += 1
+    cache.store("https://b/", httpx.Headers(HTML), page)
+
+    assert cache.get("https://a/") is None
+    assert cache.get("https://b/") is not None
+
+
+def test_async_transport_revalidates(clock: FakeClock) -> None:
+    cache = PageCache(clock=clock)
+    requests, server = make_server()
+
+    async def fetch() -> list[str]:
+        async with httpx.AsyncClient(transport=AsyncCachingTransport(server, cache)) as client:
+            return [(await client.get(FAVORITES_URL)).text for _ in range(2)]
+
+    assert asyncio.run(fetch()) == ["<html>page</html>"] * 2
+    assert len(requests) == 2
+    assert cache.revalidated == 1
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
+
+from fafav_downloader import fadownloader
+from fafav_downloader import pipeline
+from fafav_downloader.asyncdownloader import HostLimits
+from fafav_downloader.datastore import Datastore
+
+FAVORITES_PAGE = Path("tests/fixtures/fav_page.html").read_text(encoding="utf-8")
+VIEW_PAGE = Path("tests/fixtures/view_page.html").read_text(encoding="utf-8")
+USER_NAME = "wolf-nymph"
+
+
+@pytest.fixture(autouse=True)
+def download_path(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+
+
+def handler(request: httpx.Request) -> httpx.Response:
+    if request.url.path == f"/favorites/{USER_NAME}/":
+        return httpx.Response(200, text=FAVORITES_PAGE)
+    if request.url.path.startswith("/favorites/"):
+        return httpx.Response(200, text="")
+    if request.url.path.startswith("/view/"):
+        return httpx.Response(200, text=VIEW_PAGE)
+    return httpx.Response(200, content=b"image bytes")
+
+
+def test_run_pipeline_processes_backlog_and_new_favorites(
+    datastore: Datastore,
+    tmp_path: Path,
+) -> None:
+    starting_rows = datastore.row_count()
+
+    async def _run() -> None:
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            await pipeline.run_pipeline(
+                client,
+                datastore,
+                usernames=[USER_NAME],
+                workers=4,
+                queue_size=2,
+            )
+
+    asyncio.run(_run())
+
+    # 128 favorites scanned plus two unresolved and two unprocessed rows in the fixture
+    assert datastore.row_count() == starting_rows + 128
+    assert not datastore.get_views_to_download()
+    assert not datastore.get_downloads_to_process()
+    assert len(list(tmp_path.iterdir())) == 128 + 2 + 2
+
+
+def test_scan_favorites_yields_only_new_views() -> None:
+    datastore = Datastore()
+    datastore.save_view(("/view/33636424/", "Golden Sleep", "wintersoul"))
+
+    async def _run() -> list[list[tuple[str, str, str]]]:
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            scan = pipeline.scan_favorites(USER_NAME, client, datastore, HostLimits())
+            return [new_views async for new_views in scan]
+
+    pages = asyncio.run(_run())
+
+    assert len(pages) == 2
+    assert len(pages[0]) == 127
+    assert ("/view/33636424/", "Golden Sleep", "wintersoul") not in pages[0]
+    assert datastore.row_count() == 128
+
+
+def test_scan_favorites_stops_on_known_pages() -> None:
+    datastore = Datastore()
+    datastore.save_views(list(fadownloader.get_favorite_data(FAVORITES_PAGE)), USER_NAME)
+    requested: list[str] = []
+
+    def repeat_handler(request: httpx.Request) -> httpx.Response:
+        requested.append(request.url.path)
+        return httpx.Response(200, text=FAVORITES_PAGE)
+
+    async def _run() -> None:
+        transport = httpx.MockTransport(repeat_handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            scan = pipeline.scan_favorites(
+                USER_NAME,
+                client,
+                datastore,
+                HostLimits(),
+                known_pages=3,
+            )
+            async for _ in scan:
+                pass
+
+    asyncio.run(_run())
+
+    assert len(requested) == 3
+
+
+def test_run_pipeline_shares_views_between_users() -> None:
+    datastore = Datastore()
+    view_requests: list[str] = []
+
+    def shared_handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path in (f"/favorites/{USER_NAME}/", "/favorites/other-user/"):
+            return httpx.Response(200, text=FAVORITES_PAGE)
+        if request.url.path.startswith("/view/"):
+            view_requests.append(request.url.path)
+        return handler(request)
+
+    async def _run() -> None:
+        transport = httpx.MockTransport(shared_handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            await pipeline.run_pipeline(
+                client,
+                datastore,
+                usernames=[USER_NAME, "other-user"],
+                workers=4,
+            )
+
+    asyncio.run(_run())
+
+    favorites = list(fadownloader.get_favorite_data(FAVORITES_PAGE))
+    assert datastore.row_count() == 128
+    assert len(view_requests) == len(set(view_requests)) == 128
+    assert not datastore.filter_new_views(favorites, "other-user")
+    assert not datastore.filter_new_views(favorites, USER_NAME)
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator
+from datetime import datetime
+from datetime import time
+
+import httpx
+import pytest
+
+from fafav_downloader import ratelimit
+from fafav_downloader.ratelimit import AdaptiveRateLimiter
+from fafav_downloader.ratelimit import AsyncBandwidthLimitedTransport
+from fafav_downloader.ratelimit import BandwidthLimitedTransport
+from fafav_downloader.ratelimit import BandwidthLimiter
+from fafav_downloader.ratelimit import BandwidthWindow
+from fafav_downloader.ratelimit import RateLimitedTransport
+from fafav_downloader.ratelimit import TokenBucket
+from tests.conftest import FakeClock
+
+HOST = "www.furaffinity.net"
+
+
+def test_token_bucket_spaces_reservations() -> None:
+    bucket = TokenBucket(rate=2.0, capacity=1.0, now=0.0)
+
+    delays = [bucket.reserve(0.0) for _ in range(3)]
+
+    assert delays == [0.0, 0.5, 1.0]
+
+
+def test_token_bucket_refills_over_time() -> None:
+    bucket = TokenBucket(rate=1.0, capacity=1.0, now=0.0)
+    bucket.reserve(0.0)
+
+    assert bucket.reserve(5.0) == 0.0
+
+
+def test_success_increases_rate_up_to_max(clock: FakeClock) -> None:
+    limiter = AdaptiveRateLimiter(initial_rate=1.0, max_rate=1.15, clock=clock)
+
+    limiter.observe(HOST, 200, 0.1)
+    assert limiter.rate(HOST) == pytest.approx(1.1)
+
+    limiter.observe(HOST, 200, 0.1)
+    assert limiter.rate(HOST) == pytest.approx(1.15)
+
+
+def test_throttle_halves_rate_and_honors_retry_after(clock: FakeClock) -> None:
+    limiter = AdaptiveRateLimiter(initial_rate=2.0, clock=clock)
+
+    limiter.observe(HOST, 429, 0.1, "30")
+
+    assert limiter.rate(HOST) == pytest.approx(1.0)
+    assert limiter.reserve(HOST) == pytest.approx(30.0)
+    assert limiter.reserve("d.furaffinity.net") == 0.0
+
+
+def test_slow_response_decreases_rate(clock: FakeClock) -> None:
+    limiter = AdaptiveRateLimiter(initial_rate=1.0, latency_target=1.0, clock=clock)
+
+    limiter.observe(HOST, 200, 5.0)
+
+    assert limiter.rate(HOST) == pytest.approx(0.9)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("120", 120.0),
+        ("Wed, 21 Oct 2015 07:28:00 GMT", 0.0),
+        ("not a date", None),
+    ],
+)
+def test_parse_retry_after(value: str, expected: float | None) -> None:
+    assert ratelimit.parse_retry_after(value) == expected
+
+
+def test_transport_retries_throttled_responses(monkeypatch: pytest.MonkeyPatch) -> None:
+    sleeps: list[float] = []
+    monkeypatch.setattr(ratelimit.time, "sleep", sleeps.append)
+    responses = iter([httpx.Response(503, headers={"retry-after": "7"}), httpx.Response(200)])
+    transport = httpx.MockTransport(lambda request: next(responses))
+    limiter = AdaptiveRateLimiter()
+    client = httpx.Client(transport=RateLimitedTransport(transport, limiter))
+
+    response = client.get(f"https://{HOST}/view/1/")
+
+    assert response.status_code == 200
+    assert sleeps[0] == 0.0
+    assert sleeps[1] == pytest.approx(7.0, abs=0.1)
+
+
+def test_transport_gives_up_after_max_retries(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ratelimit.time, "sleep", lambda seconds: None)
+    calls: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(502)
+
+    transport = RateLimitedTransport(httpx.MockTransport(handler), AdaptiveRateLimiter(), 2)
+    client = httpx.Client(transport=transport)
+
+    response = client.get(f"https://{HOST}/view/1/")
+
+    assert response.status_code == 502
+    assert len(calls) == 3
+
+
+def test_bandwidth_limiter_paces_bytes(clock: FakeClock) -> None:
+    limiter = BandwidthLimiter(1000.0, burst=0.5, clock=clock)
+
+    waits = [limiter.reserve(500) for _ in range(3)]
+    clock.now += 2.0
+
+    assert waits == [0.0, 0.5, 1.0]
+    assert limiter.reserve(500) == 0.0
+
+
+def test_bandwidth_limiter_unlimited(clock: FakeClock) -> None:
+    limiter = BandwidthLimiter(clock=clock)
+
+    assert [limiter.reserve(10**9) for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_bandwidth_limiter_follows_schedule(clock: FakeClock) -> None:
+    moment = datetime(2024, 5, 17, 12, 0)
+    schedule = [
+        BandwidthWindow(time(8), time(18), 1000.0),
+        BandwidthWindow(time(22), time(6), None),
+    ]
+    limiter = BandwidthLimiter(100.0, schedule=schedule, clock=clock, wallclock=lambda: moment)
+
+    assert limiter.current_rate() == 1000.0
+    assert limiter.reserve(1500) == pytest.approx(1.0)
+
+    moment = moment.replace(hour=23)
+    assert limiter.current_rate() is None
+    moment = moment.replace(hour=19)
+    assert limiter.current_rate() == 100.0
+    clock.now += 1.0
+    assert limiter.reserve(50) == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [("2048", 2048.0), ("500K", 512000.0), ("1.5m", 1.5 * 1024**2), ("unlimited", None)],
+)
+def test_parse_rate(value: str, expected: float | None) -> None:
+    assert ratelimit.parse_rate(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "0", "-1K", "fast", "5T"])
+def test_parse_rate_invalid(value: str) -> None:
+    with pytest.raises(ValueError):
+        ratelimit.parse_rate(value)
+
+
+def test_parse_window() -> None:
+    window = ratelimit.parse_window("22:30-06:00=2M")
+
+    assert window == BandwidthWindow(time(22, 30), time(6), 2 * 1024**2)
+    assert window.contains(time(23)) and window.contains(time(1))
+    assert not window.contains(time(12))
+    with pytest.raises(ValueError):
+        ratelimit.parse_window("22:30=2M")
+
+
+def test_bandwidth_transport_waits_per_chunk(
+    clock: FakeClock,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    sleeps: list[float] = []
+    monkeypatch.setattr(ratelimit.time, "sleep", sleeps.append)
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, content=iter([b"x" * 100] * 4))
+    )
+    limiter = BandwidthLimiter(100.0, burst=1.0, clock=clock)
+    client = httpx.Client(transport=BandwidthLimitedTransport(transport, limiter))
+
+    with client.stream("GET", "https://d.furaffinity.net/art/a/1.png") as response:
+        body = b"".join(response.iter_bytes())
+
+    assert body == b"x" * 400
+    assert sleeps == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_async_bandwidth_transport_shares_limiter(
+    clock: FakeClock,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    sleeps: list[float] = []
+
+    async def sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(ratelimit.asyncio, "sleep", sleep)
+    limiter = BandwidthLimiter(100.0, burst=1.0, clock=clock)
+    limiter.reserve(100)
+
+    async def body() -> AsyncIterator[bytes]:
+        yield b"x" * 50
+
+    async def get() -> bytes:
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body()))
+        async with httpx.AsyncClient(
+            transport=AsyncBandwidthLimitedTransport(transport, limiter)
+        ) as client:
+            response = await client.get("https://d.furaffinity.net/art/a/1.png")
+        return response.content
+
+    assert asyncio.run(get()) == b"x" * 50
+    assert sleeps == [0.5]
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import itertools
+from collections.abc import AsyncIterator
+from collections.abc import Iterator
+from pathlib import Path
+
+import httpx
+import pytest
+
+from fafav_downloader import asyncdownloader
+from fafav_downloader import fadownloader
+from fafav_downloader.datastore import LEASE_SECONDS
+from fafav_downloader.datastore import RETRY_MAX_SECONDS
+from fafav_downloader.datastore import Datastore
+from fafav_downloader.resume import LeaseLostError
+from fafav_downloader.resume import PartialDownload
+from fafav_downloader.resume import part_name
+from tests.conftest import FakeClock
+
+VIEW = "/view/1/"
+LINK = "https://d.furaffinity.net/art/author/1/file.png"
+CONTENT = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+ETAG = '"v1"'
+HEADERS = {"etag": ETAG, "content-length": str(len(CONTENT))}
+
+
+@pytest.fixture
+def download_path(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> Path:
+    monkeypatch.setattr(fadownloader, "DOWNLOAD_PATH", tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def datastore() -> Datastore:
+    # Every reading of the clock is the longest backoff later, so failed attempts can be resumed
+    clock = itertools.count(step=RETRY_MAX_SECONDS)
+    datastore = Datastore(clock=lambda: next(clock))
+    datastore.save_views([(VIEW, "title", "author")])
+    datastore.save_download(VIEW, LINK)
+    return datastore
+
+
+def _broken_body(length: int) -> Iterator[bytes]:
+    yield CONTENT[:length]
+    raise httpx.ReadError("connection lost")
+
+
+def _range_response(request: httpx.Request) -> httpx.Response:
+    start = int(request.headers["range"].removeprefix("bytes=").removesuffix("-"))
+    return httpx.Response(
+        206,
+        headers={"etag": ETAG, "content-range": f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}"},
+        content=CONTENT[start:],
+    )
+
+
+def _download(datastore: Datastore, handler: httpx.MockTransport) -> None:
+    fadownloader.download_favorite_files(httpx.Client(transport=handler), datastore, chunk_size=10)
+
+
+def _interrupt(datastore: Datastore, length: int = 100) -> None:
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, headers=HEADERS, content=_broken_body(length))
+    )
+    _download(datastore, transport)
+
+
+def test_interrupted_download_keeps_part_file(datastore: Datastore, download_path: Path) -> None:
+    _interrupt(datastore)
+
+    assert (download_path / part_name(VIEW)).read_bytes() == CONTENT[:100]
+    assert datastore.get_partial(VIEW) == (100, len(CONTENT), ETAG)
+    assert datastore.get_download_to_process(VIEW) is not None
+
+
+def test_resume_with_range_request(datastore: Datastore, download_path: Path) -> None:
+    _interrupt(datastore)
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return _range_response(request)
+
+    _download(datastore, httpx.MockTransport(handler))
+
+    assert requests[0].headers["range"] == "bytes=100-"
+    assert requests[0].headers["if-range"] == ETAG
+    assert [path.read_bytes() for path in download_path.iterdir()] == [CONTENT]
+    assert datastore.get_filename_by_hash(hashlib.sha256(CONTENT).hexdigest())
+    assert datastore.get_partial(VIEW) is None
+
+
+def test_full_response_restarts_part_file(datastore: Datastore, download_path: Path) -> None:
+    _interrupt(datastore)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=CONTENT))
+
+    _download(datastore, transport)
+
+    assert [path.read_bytes() for path in download_path.iterdir()] == [CONTENT]
+
+
+def test_mismatched_range_falls_back_to_full_request(
+    datastore: Datastore,
+    download_path: Path,
+) -> None:
+    _interrupt(datastore)
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if "range" in request.headers:
+            return httpx.Response(206, headers={"content-range": "bytes 50-99/2000"}, content=b"x")
+        return httpx.Response(200, headers=HEADERS, content=CONTENT)
+
+    _download(datastore, httpx.MockTransport(handler))
+
+    assert len(requests) == 2
+    assert "range" not in requests[1].headers
+    assert [path.read_bytes() for path in download_path.iterdir()] == [CONTENT]
+
+
+def test_short_body_is_not_stored(datastore: Datastore, download_path: Path) -> None:
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, headers=HEADERS, content=CONTENT[:10])
+    )
+
+    _download(datastore, transport)
+
+    assert [path.name for path in download_path.iterdir()] == [part_name(VIEW)]
+    assert datastore.get_partial(VIEW) == (10, len(CONTENT), ETAG)
+
+
+def test_checkpoints_record_progress(datastore: Datastore, tmp_path: Path) -> None:
+    with PartialDownload(tmp_path, datastore, VIEW, checkpoint_bytes=4) as partial:
+        partial.start(httpx.Response(200, headers=HEADERS))
+        partial.write(b"12345")
+        assert datastore.get_partial(VIEW) == (5, len(CONTENT), ETAG)
+        partial.write(b"67")
+        assert datastore.get_partial(VIEW) == (5, len(CONTENT), ETAG)
+
+
+def test_async_download_resumes(datastore: Datastore, download_path: Path) -> None:
+    async def broken_body() -> AsyncIterator[bytes]:
+        yield CONTENT[:100]
+        raise httpx.ReadError("connection lost")
+
+    def interrupted(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers=HEADERS, content=broken_body())
+
+    async def run(handler: httpx.MockTransport) -> None:
+        async with httpx.AsyncClient(transport=handler) as client:
+            await asyncdownloader.download_favorite_files(client, datastore, chunk_size=10)
+
+    asyncio.run(run(httpx.MockTransport(interrupted)))
+    assert datastore.get_partial(VIEW) == (100, len(CONTENT), ETAG)
+
+    asyncio.run(run(httpx.MockTransport(_range_response)))
+
+    assert [path.read_bytes() for path in download_path.iterdir()] == [CONTENT]
+
+
+@pytest.fixture
+def workers(shared_datastores: tuple[Datastore, Datastore]) -> tuple[Datastore, Datastore]:
+    first, second = shared_datastores
+    first.save_views([(VIEW, "title", "author")])
+    first.save_download(VIEW, LINK)
+    return first, second
+
+
+def test_download_claimed_by_another_worker_is_left_alone(
+    tmp_path: Path, workers: tuple[Datastore, Datastore]
+) -> None:
+    first, second = workers
+    second.get_download_to_process(VIEW)
+    (tmp_path / part_name(VIEW)).write_bytes(b"theirs")
+
+    with pytest.raises(LeaseLostError):
+        PartialDownload(tmp_path, first, VIEW)
+
+    assert (tmp_path / part_name(VIEW)).read_bytes() == b"theirs"
+
+
+def test_long_download_renews_claim(
+    tmp_path: Path, workers: tuple[Datastore, Datastore], clock: FakeClock
+) -> None:
+    first, second = workers
+
+    with PartialDownload(tmp_path, first, VIEW) as partial:
+        for _ in range(3):
+            partial.write(b"chunk")
+            clock.now += LEASE_SECONDS * 0.6
+
+        assert second.get_download_to_process(VIEW) is None
+
+
+def test_download_taken_over_keeps_part_file(
+    tmp_path: Path, workers: tuple[Datastore, Datastore], clock: FakeClock
+) -> None:
+    first, second = workers
+
+    with pytest.raises(LeaseLostError):
+        with PartialDownload(tmp_path, first, VIEW) as partial:
+            partial.write(b"chunk")
+            clock.now += LEASE_SECONDS * 2
+            assert second.get_download_to_process(VIEW) is not None
+            partial.write(b"chunk")
+
+    assert (tmp_path / part_name(VIEW)).read_bytes() == b"chunk"
+    assert first.get_partial(VIEW) is None
+
+
+def test_fresh_claim_is_not_checked_again(
+    tmp_path: Path, workers: tuple[Datastore, Datastore]
+) -> None:
+    first, _ = workers
+    assert first.get_download_to_process(VIEW) is not None
+    statements: list[str] = []
+    first._dbconn.set_trace_callback(statements.append)
+
+    with PartialDownload(tmp_path, first, VIEW) as partial:
+        partial.write(b"chunk")
+        assert partial.complete()
+
+    assert not [statement for statement in statements if "claimed_by" in statement]
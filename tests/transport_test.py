@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import pytest
+
+from fafav_downloader import transport
+from fafav_downloader.ratelimit import AdaptiveRateLimiter
+from fafav_downloader.transport import AsyncPoolTransport
+from fafav_downloader.transport import PoolConfig
+from fafav_downloader.transport import PoolTransport
+
+SITE = "www.furaffinity.net"
+
+
+def test_pool_config_limits_and_timeout() -> None:
+    config = PoolConfig(max_connections=3, keepalive_expiry=5, connect_timeout=2, read_timeout=7)
+
+    limits = config.limits()
+    timeout = config.timeout()
+
+    assert limits.max_connections == 3
+    assert limits.max_keepalive_connections == 3
+    assert limits.keepalive_expiry == 5
+    assert timeout.connect == 2
+    assert timeout.read == 7
+    assert timeout.pool is None
+
+
+def test_pool_transport_applies_timeouts() -> None:
+    seen: list[dict[str, float | None]] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.extensions["timeout"])
+        return httpx.Response(200)
+
+    config = PoolConfig(max_connections=1, read_timeout=42)
+    client = httpx.Client(transport=PoolTransport(httpx.MockTransport(handler), config))
+
+    client.get("https://example.com/")
+
+    assert seen[0]["read"] == 42
+    assert seen[0]["connect"] == config.connect_timeout
+
+
+def test_async_pool_transport_applies_timeouts() -> None:
+    seen: list[dict[str, float | None]] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.extensions["timeout"])
+        return httpx.Response(200)
+
+    config = PoolConfig(max_connections=1, read_timeout=42)
+
+    async def get() -> None:
+        async_transport = AsyncPoolTransport(httpx.MockTransport(handler), config)
+        async with httpx.AsyncClient(transport=async_transport) as client:
+            await client.get("https://example.com/")
+
+    asyncio.run(get())
+
+    assert seen[0]["read"] == 42
+
+
+def test_build_client_mounts_pool_per_host() -> None:
+    site_pool = PoolConfig(max_connections=1, read_timeout=11)
+    cdn_pool = PoolConfig(max_connections=2, read_timeout=22)
+
+    client = transport.build_client(
+        {},
+        AdaptiveRateLimiter(),
+        pools={SITE: site_pool},
+        default_pool=cdn_pool,
+        http2=False,
+    )
+
+    site = client._transport_for_url(httpx.URL(f"https://{SITE}/view/1/"))
+    cdn = client._transport_for_url(httpx.URL("https://d.furaffinity.net/art/file.png"))
+
+    assert site is not cdn
+    assert site.transport.timeout["read"] == 11  # type: ignore[attr-defined]
+    assert cdn.transport.timeout["read"] == 22  # type: ignore[attr-defined]
+
+
+def test_http2_falls_back_when_not_installed(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(transport, "HTTP2_AVAILABLE", False)
+
+    assert transport.use_http2(True) is False
+    assert transport.use_http2(False) is False
+
+    client = transport.build_async_client({}, AdaptiveRateLimiter(), pools={}, http2=True)
+
+    assert isinstance(client, httpx.AsyncClient)
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from fafav_downloader import verify
+from fafav_downloader.datastore import Datastore
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100 + b"\x00\x00\x00\x00IEND\xaeB`\x82"
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 100 + b"\xff\xd9"
+GIF = b"GIF89a" + b"\x00" * 100 + b";"
+
+
+@pytest.mark.parametrize(
+    "content",
+    [PNG, JPEG, GIF, JPEG + b"\x00" * 10, PNG + b"trailing", GIF + b"\x01", b"plain text"],
+)
+def test_check_file_intact(tmp_path: Path, content: bytes) -> None:
+    path = tmp_path / "file"
+    path.write_bytes(content)
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    result = verify.check_file(str(path), len(content), sha256)
+
+    assert result.problem is None
+    assert result.size == len(content)
+
+
+@pytest.mark.parametrize(
+    ("content", "size", "sha256", "problem"),
+    [
+        (PNG[:-4], None, None, "truncated"),
+        (JPEG[:-2], None, None, "truncated"),
+        (GIF[:-1], None, None, "truncated"),
+        (PNG, len(PNG) + 1, None, f"size is {len(PNG)}, expected {len(PNG) + 1}"),
+        (PNG, len(PNG), "0" * 64, "hash mismatch"),
+    ],
+)
+def test_check_file_damaged(
+    tmp_path: Path,
+    content: bytes,
+    size: int | None,
+    sha256: str | None,
+    problem: str,
+) -> None:
+    path = tmp_path / "file"
+    path.write_bytes(content)
+
+    assert verify.check_file(str(path), size, sha256).problem == problem
+
+
+def test_check_file_missing(tmp_path: Path) -> None:
+    assert verify.check_file(str(tmp_path / "file"), None, None).problem == "missing"
+
+
+def test_verify_library(datastore: Datastore, tmp_path: Path) -> None:
+    datastore.save_filename(
+        "/view/5",
+        "somefauser-someimage.png",
+        sha256=hashlib.sha256(PNG).hexdigest(),
+        size=len(PNG),
+    )
+    (tmp_path / "somefauser-someimage.png").write_bytes(PNG)
+
+    requeued = verify.verify_library(datastore, tmp_path, workers=2)
+
+    assert requeued == 1
+    assert [row[0] for row in datastore.iter_files_to_verify()] == ["somefauser-someimage.png"]
+    assert "/view/6" in {row[0] for row in datastore.iter_downloads_to_process()}
+
+    (tmp_path / "somefauser-someimage.png").write_bytes(PNG[:-4])
+
+    assert verify.verify_library(datastore, tmp_path, workers=2) == 1
+    assert (tmp_path / "somefauser-someimage.png.corrupt").exists()
+    assert not list(datastore.iter_files_to_verify())
+
+
+def test_verify_library_skips_unchanged(
+    datastore: Datastore,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    for filename in datastore.iter_filenames():
+        (tmp_path / filename).write_bytes(PNG)
+    verify.verify_library(datastore, tmp_path, workers=1)
+    monkeypatch.setattr(verify, "check_file", None)
+
+    assert verify.verify_library(datastore, tmp_path, workers=1) == 0
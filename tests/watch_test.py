@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import signal
+import sqlite3
+import threading
+
+import httpx
+import pytest
+
+from fafav_downloader import watch as watch_module
+from fafav_downloader.watch import StopSignal
+from fafav_downloader.watch import next_delay
+from fafav_downloader.watch import watch
+
+
+def test_watch_runs_cycles_until_stopped() -> None:
+    stop = threading.Event()
+    calls: list[int] = []
+
+    def cycle() -> None:
+        calls.append(len(calls))
+        if len(calls) == 3:
+            stop.set()
+
+    cycles = watch(cycle, stop, interval=0, jitter=0)
+
+    assert cycles == 3
+    assert calls == [0, 1, 2]
+
+
+def test_watch_survives_failed_cycles() -> None:
+    stop = threading.Event()
+    calls: list[int] = []
+
+    def cycle() -> None:
+        calls.append(len(calls))
+        if len(calls) == 2:
+            stop.set()
+        raise httpx.ConnectError("offline")
+
+    assert watch(cycle, stop, interval=0, jitter=0) == 2
+
+
+def test_watch_survives_locked_database() -> None:
+    stop = threading.Event()
+
+    def cycle() -> None:
+        stop.set()
+        raise sqlite3.OperationalError("database is locked")
+
+    assert watch(cycle, stop, interval=0, jitter=0) == 1
+
+
+def test_watch_waits_for_interval(monkeypatch: pytest.MonkeyPatch) -> None:
+    stop = threading.Event()
+    waits: list[float | None] = []
+
+    def wait(timeout: float | None = None) -> bool:
+        waits.append(timeout)
+        stop.set()
+        return True
+
+    monkeypatch.setattr(stop, "wait", wait)
+
+    watch(lambda: None, stop, interval=30, jitter=0, clock=lambda: 100.0)
+
+    assert waits == [30]
+
+
+def test_next_delay_applies_jitter_and_elapsed(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(watch_module.random, "uniform", lambda low, high: high)
+
+    assert next_delay(60, 5, 10) == 55
+    assert next_delay(60, 5, 90) == 0
+
+
+def test_stop_signal_sets_event_then_interrupts() -> None:
+    previous = signal.getsignal(signal.SIGTERM)
+
+    with StopSignal((signal.SIGTERM,)) as stop:
+        signal.raise_signal(signal.SIGTERM)
+        assert stop.is_set()
+
+        with pytest.raises(KeyboardInterrupt):
+            signal.raise_signal(signal.SIGTERM)
+
+    assert signal.getsignal(signal.SIGTERM) == previous